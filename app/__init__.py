@@ -1,6 +1,10 @@
+import os
+
 from flask import Flask
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 
 from app.config import Config
 
@@ -8,25 +12,109 @@ db = SQLAlchemy()
 migrate = Migrate()
 
 
-def create_app() -> Flask:
+def create_app(config_class: type = Config) -> Flask:
     """
     Creates and configures a Flask application instance.
 
     This function initializes the Flask application with configuration settings, sets up
     the SQLAlchemy database connection, and initializes Flask-Migrate for database migrations.
-    It also registers the main blueprint for handling routes.
+    It also creates the storage backend holding file content and the per-hash locks coordinating
+    writers of the same content, and registers the main blueprint for handling routes and the
+    `flask store` commands. Background maintenance is left to server workers, which start it
+    with `start_background_tasks`, so that migrations and CLI commands do not run it. When
+    streaming uploads are enabled, uploaded files are hashed and spooled into the store while
+    the request is parsed. Under gevent workers, blocking disk and database calls run on a
+    bounded thread pool. Metadata writes of concurrent requests are committed together, and
+    SQLite databases run in WAL mode.
+
+    Args:
+        config_class (type): The configuration class to load settings from. Defaults to `Config`.
 
     Returns:
         Flask: The configured Flask application instance.
     """
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
+
+    from app import concurrency
+
+    _drop_sqlite_pool_sizing(app)
+    concurrency.init_app(app)
+
+    if app.config["STREAMING_UPLOADS"]:
+        from app.streaming import StreamingRequest
+
+        app.request_class = StreamingRequest
+
+    if app.config["COMPRESSION"]:
+        from app.compression import Codec
+
+        Codec(app.config["COMPRESSION"])
+
+    from app.storage import HashLocks, create_storage
+
+    storage = create_storage(app)
+    app.extensions["storage"] = storage
 
     db.init_app(app)
     migrate.init_app(app, db)
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            event.listen(db.engine, "connect", _sqlite_pragmas(app))
+        # A PostgreSQL database may be shared by several nodes, whose writers of the same
+        # blob then exclude each other with advisory locks.
+        app.extensions["hash_locks"] = HashLocks(
+            os.path.join(app.config["STORAGE_FOLDER"], ".locks"),
+            db.engine if db.engine.dialect.name == "postgresql" else None,
+        )
+
+    from app.repositories.metadata_writer import MetadataWriter
+
+    app.extensions["metadata_writer"] = MetadataWriter(
+        app.config["METADATA_COMMIT_WINDOW"], app.config["METADATA_COMMIT_MAX_ROWS"]
+    )
+
+    from app.cache import hot_object_cache, metadata_cache
+    from app.hash_filter import hash_filter
+
+    metadata_cache.init_app(app)
+    hot_object_cache.init_app(app)
+    hash_filter.init_app(app)
 
     from app.routes import main as main_blueprint
 
     app.register_blueprint(main_blueprint)
 
+    from app.commands import store_cli
+
+    app.cli.add_command(store_cli)
+
     return app
+
+
+def _drop_sqlite_pool_sizing(app: Flask) -> None:
+    # SQLite databases are local files or in-memory databases, whose pools (such as the
+    # StaticPool of "sqlite://") take no size, overflow or timeout; only servers get them.
+    if make_url(app.config["SQLALCHEMY_DATABASE_URI"]).get_backend_name() != "sqlite":
+        return
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        key: value
+        for key, value in app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}).items()
+        if key not in ("pool_size", "max_overflow", "pool_timeout")
+    }
+
+
+def _sqlite_pragmas(app: Flask):
+    # Set on every new connection: WAL lets readers run alongside the writer, and the busy
+    # timeout makes writers wait for the lock instead of failing with "database is locked".
+    journal_mode = app.config["SQLITE_JOURNAL_MODE"]
+    busy_timeout = int(app.config["SQLITE_BUSY_TIMEOUT"] * 1000)
+
+    def on_connect(connection, connection_record) -> None:
+        cursor = connection.cursor()
+        if journal_mode:
+            cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA busy_timeout={busy_timeout}")
+        cursor.close()
+
+    return on_connect
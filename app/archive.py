@@ -0,0 +1,112 @@
+import os
+import tarfile
+import time
+import zipfile
+from collections.abc import Callable, Iterable, Iterator
+
+FORMATS = {"zip": "application/zip", "tar": "application/x-tar"}
+
+# An archive member: its name, its size and a callable streaming its content.
+ArchiveEntry = tuple[str, int, Callable[[], Iterable[bytes]]]
+
+
+def unique_names(names: Iterable[str]) -> Iterator[str]:
+    """
+    Turns stored filenames into distinct, flat archive member names.
+
+    Directory separators are replaced so that members cannot be extracted outside the target
+    directory, and repeated names get a ` (n)` suffix before their extension, the way browsers
+    name repeated downloads.
+
+    Args:
+        names (Iterable[str]): The stored filenames, in archive order.
+
+    Returns:
+        Iterator[str]: The member names, in the same order.
+    """
+    used = set()
+    for name in names:
+        name = name.replace("/", "_").replace("\\", "_").strip(". ") or "file"
+        stem, extension = os.path.splitext(name)
+        candidate = name
+        count = 0
+        while candidate.casefold() in used:
+            count += 1
+            candidate = f"{stem} ({count}){extension}"
+        used.add(candidate.casefold())
+        yield candidate
+
+
+def iter_archive(
+    entries: Iterable[ArchiveEntry], archive_format: str
+) -> Iterator[bytes]:
+    """
+    Streams an archive of the given entries, built while it is sent.
+
+    Members are stored without compression and the content of each one is read chunk by
+    chunk, so memory use does not depend on the number or size of the members, and the
+    first bytes are produced as soon as the first member header is written.
+
+    Args:
+        entries (Iterable[ArchiveEntry]): The members of the archive.
+        archive_format (str): "zip" or "tar".
+
+    Returns:
+        Iterator[bytes]: The bytes of the archive.
+    """
+    if archive_format == "tar":
+        yield from _iter_tar(entries)
+        return
+    output = _Output()
+    for _ in _write_zip(entries, output):
+        if output.chunks:
+            yield output.drain()
+    if output.chunks:
+        yield output.drain()
+
+
+def _write_zip(entries: Iterable[ArchiveEntry], output: "_Output") -> Iterator[None]:
+    # Written to an unseekable file, every member is followed by a data descriptor.
+    date_time = time.localtime()[:6]
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED) as archive:
+        for name, size, read in entries:
+            info = zipfile.ZipInfo(name, date_time)
+            info.file_size = size
+            with archive.open(info, "w") as member:
+                yield
+                for chunk in read():
+                    member.write(chunk)
+                    yield
+
+
+def _iter_tar(entries: Iterable[ArchiveEntry]) -> Iterator[bytes]:
+    mtime = int(time.time())
+    for name, size, read in entries:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = mtime
+        info.mode = 0o644
+        yield info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+        yield from read()
+        if size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE)
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+class _Output:
+    # A write-only, unseekable file collecting the bytes written since the last drain.
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
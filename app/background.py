@@ -0,0 +1,113 @@
+import threading
+from collections.abc import Callable
+
+from flask import Flask
+
+
+def start_periodic_task(
+    app: Flask, name: str, interval: float, task: Callable[[], object]
+) -> threading.Thread:
+    """
+    Runs a task periodically in a daemon thread, inside an application context.
+
+    Exceptions raised by the task are logged and do not stop the thread. Every worker process
+    runs its own thread, so tasks must be safe to run concurrently with themselves.
+
+    Args:
+        app (Flask): The application whose context the task runs in.
+        name (str): The name of the thread, used in log messages.
+        interval (float): The number of seconds to wait between runs.
+        task (Callable[[], object]): The task to run.
+
+    Returns:
+        threading.Thread: The started thread.
+    """
+
+    def run() -> None:
+        stopped = threading.Event()
+        while not stopped.wait(interval):
+            with app.app_context():
+                try:
+                    task()
+                except Exception as e:
+                    app.logger.error(f"Background task {name} failed: {str(e)}.")
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def start_background_tasks(app: Flask) -> list[threading.Thread]:
+    """
+    Starts the periodic maintenance of the application in the current process.
+
+    This runs the garbage collection of unreferenced blobs and of expired upload sessions, the
+    scrubbing of the store if enabled and, for the pack backend and chunked storage, the
+    compaction of pack files and the removal of orphaned chunks, each at the interval set in
+    the configuration. It is called by server workers once the application is loaded (see
+    `gunicorn.conf.py`), and not by `create_app`, so that migrations and CLI commands do not
+    start it.
+
+    Args:
+        app (Flask): The application to maintain.
+
+    Returns:
+        list[threading.Thread]: The started threads.
+    """
+    threads = []
+
+    if app.config["BLOB_GC_INTERVAL"] > 0:
+        from app.services.file_service import FileService
+
+        threads.append(
+            start_periodic_task(
+                app,
+                "blob-gc",
+                app.config["BLOB_GC_INTERVAL"],
+                lambda: FileService.collect_garbage(
+                    app.config["BLOB_GC_BATCH_SIZE"], app.config["BLOB_GC_IO_BUDGET"]
+                ),
+            )
+        )
+
+    if app.config["UPLOAD_SESSION_GC_INTERVAL"] > 0:
+        from app.services.upload_session_service import UploadSessionService
+
+        threads.append(
+            start_periodic_task(
+                app,
+                "upload-session-gc",
+                app.config["UPLOAD_SESSION_GC_INTERVAL"],
+                UploadSessionService.collect_expired,
+            )
+        )
+
+    if (
+        app.config["STORAGE_BACKEND"] == "pack" or app.config["STORAGE_CHUNKING"]
+    ) and app.config["PACK_COMPACT_INTERVAL"] > 0:
+        threads.append(
+            start_periodic_task(
+                app,
+                "storage-maintenance",
+                app.config["PACK_COMPACT_INTERVAL"],
+                app.extensions["storage"].maintenance,
+            )
+        )
+
+    if app.config["SCRUB_INTERVAL"] > 0:
+        from app.services.scrub_service import ScrubService
+
+        threads.append(
+            start_periodic_task(
+                app,
+                "scrub",
+                app.config["SCRUB_INTERVAL"],
+                lambda: ScrubService.scrub(
+                    app.config["SCRUB_WORKERS"],
+                    app.config["SCRUB_IO_BUDGET"],
+                    app.config["SCRUB_REPAIR"],
+                ),
+            )
+        )
+
+    return threads
@@ -0,0 +1,471 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+
+from flask import Flask, current_app
+
+from app import db
+from app.models import FileMetadata
+
+_MISSING = object()
+
+
+def uses_local_database(app: Flask) -> bool:
+    """
+    Tells whether the metadata database can only be used by the host running the application.
+
+    Caches kept in the storage folder only see the changes made on their host, so they are
+    only consistent with an SQLite database, which cannot be shared by several nodes.
+
+    Args:
+        app (Flask): The application whose database is checked.
+
+    Returns:
+        bool: True if the database is SQLite, False otherwise.
+    """
+    with app.app_context():
+        return db.engine.dialect.name == "sqlite"
+
+
+class LRUCache:
+    """
+    Thread-safe, bounded least-recently-used cache with per-entry expiry.
+
+    Attributes:
+        max_entries (int): The maximum number of entries kept in the cache.
+        hits (int): The number of lookups answered from the cache.
+        misses (int): The number of lookups that found no live entry.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        """
+        Returns the cached value for a key and marks it as recently used.
+
+        Args:
+            key (Hashable): The key to look up.
+            default: The value returned when the key is missing or expired.
+
+        Returns:
+            The cached value, or `default` if there is no live entry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value, ttl: float) -> None:
+        """
+        Stores a value, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key (Hashable): The key to store the value under.
+            value: The value to store.
+            ttl (float): The number of seconds the entry stays valid.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """
+        Removes an entry from the cache if it is present.
+
+        Args:
+            key (Hashable): The key to remove.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Removes every entry from the cache.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the cache size and its hit and miss counters.
+
+        Returns:
+            dict: A dictionary with the `entries`, `max_entries`, `hits` and `misses` counters.
+        """
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class InvalidationLog:
+    """
+    Invalidation log shared by every worker process through a memory-mapped file.
+
+    The file holds a monotonically increasing counter followed by a ring buffer of the
+    most recently invalidated hashes. Publishing a hash appends it to the ring under an
+    exclusive file lock. Readers compare the shared counter with the position they last
+    consumed, which is a plain memory read, and only look at the ring when another process
+    has published something. A reader that falls more than a full ring behind, or that
+    reads a key too long to fit in a slot, is told to drop everything.
+
+    Attributes:
+        path (str): The path of the memory-mapped file.
+        slots (int): The number of hashes kept in the ring buffer.
+    """
+
+    _HEADER = struct.Struct("<Q")
+    _SLOT_SIZE = 128
+
+    def __init__(self, path: str, slots: int = 4096):
+        self.path = path
+        self.slots = slots
+        size = self._HEADER.size + slots * self._SLOT_SIZE
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    @property
+    def position(self) -> int:
+        """
+        Returns the number of hashes published so far.
+
+        Returns:
+            int: The shared counter.
+        """
+        return self._HEADER.unpack_from(self._map, 0)[0]
+
+    def publish(self, file_hash: str) -> None:
+        """
+        Appends a hash to the log so that every process drops its cached entries for it.
+
+        Args:
+            file_hash (str): The hash to invalidate.
+
+        Returns:
+            None
+        """
+        key = file_hash.encode()
+        if len(key) >= self._SLOT_SIZE:
+            key = b""
+        with open(self.path, "rb") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            position = self.position
+            offset = self._HEADER.size + (position % self.slots) * self._SLOT_SIZE
+            self._map[offset : offset + 1 + len(key)] = bytes([len(key)]) + key
+            self._HEADER.pack_into(self._map, 0, position + 1)
+
+    def read_since(self, position: int) -> list[str] | None:
+        """
+        Returns the hashes published after a given position.
+
+        Args:
+            position (int): The position the caller has consumed up to.
+
+        Returns:
+            list[str] | None: The published hashes, or None if the caller must treat every
+                entry as invalid.
+        """
+        current = self.position
+        if current - position > self.slots:
+            return None
+        hashes = []
+        for index in range(position, current):
+            offset = self._HEADER.size + (index % self.slots) * self._SLOT_SIZE
+            length = self._map[offset]
+            if length == 0:
+                return None
+            hashes.append(self._map[offset + 1 : offset + 1 + length].decode())
+        return hashes
+
+
+class MetadataCache:
+    """
+    Cache of file metadata lookups placed in front of `FileRepository`.
+
+    Both found files and misses (negative entries) are cached with their own TTL. Whenever a
+    file is added or deleted its hash is published to an `InvalidationLog` shared by all
+    worker processes, and every process drops the corresponding entries before its next
+    lookup, so a cached answer never outlives a change made by another worker. The log is
+    local to the host, so the cache is disabled when the database may be shared by others.
+    """
+
+    def __init__(self):
+        self._cache = None
+        self._log = None
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Sets up the cache for an application.
+
+        The cache is disabled when `METADATA_CACHE_SIZE` is 0, or when the database is not
+        SQLite, since changes made by other nodes would not invalidate it.
+
+        Args:
+            app (Flask): The application to set up the cache for.
+
+        Returns:
+            None
+        """
+        app.extensions["metadata_cache"] = self
+        if app.config["METADATA_CACHE_SIZE"] <= 0 or not uses_local_database(app):
+            self._cache = None
+            return
+        self._cache = LRUCache(app.config["METADATA_CACHE_SIZE"])
+        self._log = InvalidationLog(
+            os.path.join(app.config["STORAGE_FOLDER"], ".meta", "invalidation")
+        )
+        self._position = self._log.position
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Returns whether the cache is enabled.
+
+        Returns:
+            bool: True if lookups are cached, False otherwise.
+        """
+        return self._cache is not None
+
+    def get(
+        self, file_hash: str, loader: Callable[[str], FileMetadata | None]
+    ) -> FileMetadata | None:
+        """
+        Returns the metadata of a file, calling the loader on a cache miss.
+
+        A result is only stored if no invalidation was published while the loader ran, so a
+        concurrent upload or delete in another process cannot leave a stale entry behind.
+
+        Args:
+            file_hash (str): The hash of the file.
+            loader (Callable[[str], FileMetadata | None]): Called with the hash to load the
+                metadata; returns None if the file does not exist.
+
+        Returns:
+            FileMetadata | None: The metadata of the file, or None if it does not exist.
+        """
+        if self._cache is None:
+            return loader(file_hash)
+
+        self._sync()
+        cached = self._cache.get(file_hash, _MISSING)
+        if cached is not _MISSING:
+            return cached
+
+        position = self._log.position
+        metadata = loader(file_hash)
+        if self._log.position == position:
+            ttl = current_app.config[
+                "METADATA_CACHE_TTL" if metadata else "METADATA_CACHE_NEGATIVE_TTL"
+            ]
+            self._cache.set(file_hash, metadata, ttl)
+        return metadata
+
+    def invalidate(self, file_hash: str) -> None:
+        """
+        Drops the cached metadata of a file in every worker process.
+
+        Args:
+            file_hash (str): The hash of the file that was added or deleted.
+
+        Returns:
+            None
+        """
+        if self._cache is None:
+            return
+        self._log.publish(file_hash)
+        self._cache.pop(file_hash)
+
+    def stats(self) -> dict:
+        """
+        Returns the cache statistics.
+
+        Returns:
+            dict: The size and hit and miss counters of the cache, or `{"enabled": False}`.
+        """
+        if self._cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self._cache.stats()}
+
+    def _sync(self) -> None:
+        if self._log.position == self._position:
+            return
+        with self._lock:
+            position = self._log.position
+            hashes = self._log.read_since(self._position)
+            if hashes is None:
+                self._cache.clear()
+            else:
+                for file_hash in hashes:
+                    self._cache.pop(file_hash)
+            self._position = position
+
+
+class HotObjectCache:
+    """
+    In-memory cache of small file bodies bounded by a total byte budget.
+
+    Files are addressed by their content hash, so cached bodies never go stale; entries are
+    only evicted in least-recently-used order when the budget is exceeded, or when the file
+    is deleted. Files larger than `HOT_CACHE_MAX_OBJECT_SIZE` are never cached.
+
+    Attributes:
+        max_bytes (int): The maximum total size of the cached bodies.
+        max_object_size (int): The size of the largest body that is cached.
+        hits (int): The number of lookups answered from the cache.
+        misses (int): The number of lookups that had to read the file.
+    """
+
+    def __init__(self):
+        self.max_bytes = 0
+        self.max_object_size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Sets up the cache for an application.
+
+        The cache is disabled when `HOT_CACHE_MAX_BYTES` is 0.
+
+        Args:
+            app (Flask): The application to set up the cache for.
+
+        Returns:
+            None
+        """
+        app.extensions["hot_object_cache"] = self
+        self.max_bytes = app.config["HOT_CACHE_MAX_BYTES"]
+        self.max_object_size = min(
+            app.config["HOT_CACHE_MAX_OBJECT_SIZE"], self.max_bytes
+        )
+        self.hits = self.misses = 0
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def accepts(self, size: int) -> bool:
+        """
+        Returns whether a body of the given size is eligible for caching.
+
+        Args:
+            size (int): The size of the body in bytes.
+
+        Returns:
+            bool: True if the cache is enabled and the body is small enough.
+        """
+        return 0 < self.max_bytes and size <= self.max_object_size
+
+    def get(self, file_hash: str, loader: Callable[[str], bytes]) -> bytes:
+        """
+        Returns the body of a file, calling the loader and caching the result on a miss.
+
+        Args:
+            file_hash (str): The hash of the file.
+            loader (Callable[[str], bytes]): Called with the hash to read the body.
+
+        Returns:
+            bytes: The body of the file.
+        """
+        with self._lock:
+            data = self._entries.get(file_hash)
+            if data is not None:
+                self._entries.move_to_end(file_hash)
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        data = loader(file_hash)
+        if len(data) > self.max_object_size:
+            return data
+
+        with self._lock:
+            if file_hash not in self._entries:
+                self._entries[file_hash] = data
+                self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+        return data
+
+    def discard(self, file_hash: str) -> None:
+        """
+        Removes the body of a file from the cache if it is present.
+
+        Args:
+            file_hash (str): The hash of the file.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            data = self._entries.pop(file_hash, None)
+            if data is not None:
+                self._size -= len(data)
+
+    def stats(self) -> dict:
+        """
+        Returns the cache statistics.
+
+        Returns:
+            dict: The number of cached bodies, their total size, the byte budget and the hit
+                and miss counters of the cache, or `{"enabled": False}`.
+        """
+        if self.max_bytes <= 0:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "max_object_size": self.max_object_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+metadata_cache = MetadataCache()
+hot_object_cache = HotObjectCache()
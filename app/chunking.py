@@ -0,0 +1,95 @@
+import hashlib
+from collections.abc import Iterator
+from typing import BinaryIO
+
+_MASK_64 = (1 << 64) - 1
+
+# Random but fixed values, so that every process cuts the same content at the same places.
+_GEAR = tuple(
+    int.from_bytes(hashlib.sha256(bytes([value])).digest()[:8], "little")
+    for value in range(256)
+)
+
+
+def _high_bits_mask(bits: int) -> int:
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def find_cut_point(
+    data: bytes, start: int, end: int, min_size: int, avg_size: int, max_size: int
+) -> int:
+    """
+    Finds where the chunk starting at `start` ends, using the FastCDC algorithm.
+
+    A gear rolling hash is computed over the bytes after the first `min_size` ones, and the
+    chunk is cut at the first position where the hash has all the bits of a mask set to zero.
+    A stricter mask is used before `avg_size` and a looser one after it, which keeps chunk
+    sizes close to the average (normalized chunking).
+
+    Args:
+        data (bytes): The buffer holding the content.
+        start (int): The offset of the chunk in the buffer.
+        end (int): The offset after the last byte available in the buffer.
+        min_size (int): The minimum size of a chunk.
+        avg_size (int): The target average size of a chunk, a power of two.
+        max_size (int): The maximum size of a chunk.
+
+    Returns:
+        int: The offset after the last byte of the chunk.
+    """
+    length = end - start
+    if length <= min_size:
+        return end
+    length = min(length, max_size)
+    normal = min(avg_size, length)
+    bits = avg_size.bit_length() - 1
+    strict_mask = _high_bits_mask(bits + 2)
+    loose_mask = _high_bits_mask(max(bits - 2, 1))
+    gear = _GEAR
+
+    fingerprint = 0
+    for position in range(start + min_size, start + normal):
+        fingerprint = ((fingerprint << 1) + gear[data[position]]) & _MASK_64
+        if not fingerprint & strict_mask:
+            return position + 1
+    for position in range(start + normal, start + length):
+        fingerprint = ((fingerprint << 1) + gear[data[position]]) & _MASK_64
+        if not fingerprint & loose_mask:
+            return position + 1
+    return start + length
+
+
+def iter_chunks(
+    stream: BinaryIO, min_size: int, avg_size: int, max_size: int
+) -> Iterator[bytes]:
+    """
+    Splits a stream into content-defined chunks.
+
+    Since cut points only depend on the bytes around them, an insertion or deletion in the
+    content only changes the chunks next to it, and the rest of the chunks are the same as
+    for the original content. At most a few times `max_size` bytes are held in memory.
+
+    Args:
+        stream (BinaryIO): The stream to split.
+        min_size (int): The minimum size of a chunk.
+        avg_size (int): The target average size of a chunk, a power of two.
+        max_size (int): The maximum size of a chunk.
+
+    Returns:
+        Iterator[bytes]: The chunks, in order.
+    """
+    buffer = b""
+    start = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - start < max_size:
+            data = stream.read(4 * max_size)
+            eof = not data
+            buffer = buffer[start:] + data
+            start = 0
+            continue
+        if start == len(buffer):
+            return
+        cut = find_cut_point(buffer, start, len(buffer), min_size, avg_size, max_size)
+        yield buffer[start:cut]
+        start = cut
@@ -0,0 +1,187 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app.services.file_service import FileService
+from app.services.filesystem_service import FileSystemService
+from app.services.import_service import ImportService
+from app.services.scrub_service import ScrubService
+from app.storage import (
+    ChunkedStorage,
+    LocalStorage,
+    PackStorage,
+    iter_backends,
+    parse_shard_layout,
+)
+
+store_cli = AppGroup("store", help="Maintenance commands for the file store.")
+
+
+@store_cli.command("gc")
+@click.option(
+    "--batch-size",
+    default=1000,
+    show_default=True,
+    help="Number of blobs examined per pass.",
+)
+@click.option(
+    "--io-budget",
+    default=0,
+    show_default=True,
+    help="Maximum number of bytes removed per second, 0 for no limit.",
+)
+def collect_garbage(batch_size: int, io_budget: int) -> None:
+    """
+    Removes the content of blobs that are no longer referenced by any file.
+
+    With chunked storage, chunks left behind by interrupted stores are removed as well.
+    """
+    total = 0
+    while removed := FileService.collect_garbage(batch_size, io_budget):
+        total += removed
+    click.echo(f"Removed {total} unreferenced blobs.")
+    for storage in iter_backends(FileSystemService.get_storage()):
+        if isinstance(storage, ChunkedStorage):
+            click.echo(f"Removed {storage.collect_orphans()} orphaned chunks.")
+
+
+@store_cli.command("compact")
+def compact_packs() -> None:
+    """
+    Rewrites the pack files whose share of live content dropped below the threshold.
+    """
+    packs = [
+        storage
+        for storage in iter_backends(FileSystemService.get_storage())
+        if isinstance(storage, PackStorage)
+    ]
+    if not packs:
+        click.echo("The storage backend does not use pack files.")
+        return
+    click.echo(f"Compacted {sum(storage.compact() for storage in packs)} pack files.")
+
+
+@store_cli.command("reshard")
+@click.option(
+    "--from",
+    "source",
+    default=None,
+    help="Layout to move blobs from, as <depth>:<width>. "
+    "Defaults to SHARD_FALLBACK_LAYOUT.",
+)
+@click.option(
+    "--workers",
+    default=8,
+    show_default=True,
+    help="Number of shard directories processed in parallel.",
+)
+def reshard(source: str | None, workers: int) -> None:
+    """
+    Moves blobs from a previous shard layout to the configured one.
+
+    Run it while every worker is configured with the previous layout as
+    SHARD_FALLBACK_LAYOUT, so that blobs stay readable while they are moved.
+    """
+    directories = [
+        storage
+        for storage in iter_backends(FileSystemService.get_storage())
+        if isinstance(storage, LocalStorage)
+    ]
+    if not directories:
+        click.echo("The storage backend does not shard blobs into directories.")
+        return
+    try:
+        layout = parse_shard_layout(
+            source or current_app.config["SHARD_FALLBACK_LAYOUT"]
+        )
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--from")
+    if layout is None:
+        raise click.UsageError(
+            "No previous layout given and SHARD_FALLBACK_LAYOUT is empty."
+        )
+    moved = sum(storage.reshard(layout, workers) for storage in directories)
+    depth, width = directories[0].layout
+    click.echo(f"Moved {moved} blobs to layout {depth}:{width}.")
+
+
+@store_cli.command("scrub")
+@click.option(
+    "--workers",
+    default=None,
+    type=int,
+    help="Number of processes rehashing content. Defaults to SCRUB_WORKERS.",
+)
+@click.option(
+    "--io-budget",
+    default=0,
+    show_default=True,
+    help="Maximum number of bytes read per second, 0 for no limit.",
+)
+@click.option(
+    "--repair",
+    is_flag=True,
+    help="Quarantine corrupt content and remove orphaned content.",
+)
+@click.option(
+    "--restart",
+    is_flag=True,
+    help="Ignore the checkpoint of an interrupted scrub and start over.",
+)
+def scrub(workers: int | None, io_budget: int, repair: bool, restart: bool) -> None:
+    """
+    Checks that the store matches the database and that blobs match their hashes.
+
+    Reports referenced blobs missing from the store, blobs whose content is
+    corrupt and content without a blob record. An interrupted scrub resumes
+    from its last checkpoint.
+    """
+    counts = ScrubService.scrub(
+        workers or current_app.config["SCRUB_WORKERS"],
+        io_budget,
+        repair,
+        restart=restart,
+        report=lambda status, file_hash: click.echo(f"{status} {file_hash}"),
+    )
+    if counts is None:
+        raise click.ClickException("Another scrub is already running.")
+    click.echo(
+        "Checked {checked} blobs: {missing} missing, {corrupt} corrupt, "
+        "{orphan} orphaned, {repaired} repaired.".format(**counts)
+    )
+
+
+@store_cli.command("import")
+@click.argument(
+    "directory", type=click.Path(exists=True, file_okay=False, resolve_path=True)
+)
+@click.option("--owner", required=True, help="User owning the imported files.")
+@click.option(
+    "--workers",
+    default=4,
+    show_default=True,
+    help="Number of processes hashing files.",
+)
+@click.option(
+    "--batch-size",
+    default=1000,
+    show_default=True,
+    help="Number of files committed per transaction.",
+)
+def import_files(directory: str, owner: str, workers: int, batch_size: int) -> None:
+    """
+    Imports every file below DIRECTORY for a user.
+
+    Content is hardlinked into the store when it is on the same filesystem,
+    so imported files must not be modified in place afterwards. An
+    interrupted import resumes after the last committed batch when run again
+    with the same directory and owner.
+    """
+    counts = ImportService.import_directory(
+        directory,
+        owner,
+        workers,
+        batch_size,
+        lambda counts: click.echo(ImportService.describe(counts)),
+    )
+    click.echo(f"Done. {ImportService.describe(counts)}")
@@ -0,0 +1,143 @@
+import zlib
+from collections.abc import Iterable, Iterator
+from typing import BinaryIO
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ("gzip", "zstd")
+
+# Exceptions raised while decompressing damaged content.
+DECOMPRESSION_ERRORS = (zlib.error,) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+class Codec:
+    """
+    Streaming compressor and decompressor for one `Content-Encoding`.
+
+    Blobs are compressed in the exact format of the HTTP content coding with the same name,
+    so a stored blob can be sent as is to clients that accept that coding.
+
+    Attributes:
+        name (str): The content coding, "gzip" or "zstd".
+        level (int): The compression level, 0 for the codec's default.
+    """
+
+    def __init__(self, name: str, level: int = 0):
+        if name not in CODECS:
+            raise ValueError(f"Unknown compression codec: {name}.")
+        if name == "zstd" and zstandard is None:
+            raise ValueError("The zstd codec requires the zstandard package.")
+        self.name = name
+        self.level = level
+
+    def compressor(self):
+        """
+        Returns a new streaming compressor with `compress` and `flush` methods.
+
+        Returns:
+            A compression object for this codec.
+        """
+        if self.name == "gzip":
+            return zlib.compressobj(self.level or 6, zlib.DEFLATED, 31)
+        return zstandard.ZstdCompressor(level=self.level or 3).compressobj()
+
+    def decompress(self, chunks: Iterable[bytes], chunk_size: int) -> Iterator[bytes]:
+        """
+        Decompresses a stream of compressed chunks.
+
+        Each yielded chunk holds at most `chunk_size` bytes, however well the content
+        compresses.
+
+        Args:
+            chunks (Iterable[bytes]): The compressed content.
+            chunk_size (int): The maximum size of each decompressed chunk.
+
+        Returns:
+            Iterator[bytes]: The decompressed content.
+        """
+        if self.name == "zstd":
+            yield from zstandard.ZstdDecompressor().read_to_iter(
+                _ChunkReader(chunks), write_size=chunk_size
+            )
+            return
+        decompressor = zlib.decompressobj(31)
+        for data in chunks:
+            while data:
+                yield decompressor.decompress(data, chunk_size)
+                data = decompressor.unconsumed_tail
+        yield decompressor.flush()
+
+    def ratio(self, sample: bytes) -> float:
+        """
+        Returns how well a sample of the content compresses.
+
+        Args:
+            sample (bytes): The beginning of the content.
+
+        Returns:
+            float: The compressed size divided by the sample size.
+        """
+        if not sample:
+            return 1.0
+        compressor = self.compressor()
+        compressed = compressor.compress(sample) + compressor.flush()
+        return len(compressed) / len(sample)
+
+    def compress_stream(
+        self, source: BinaryIO, target: BinaryIO, chunk_size: int
+    ) -> int:
+        """
+        Compresses a stream into another one chunk by chunk.
+
+        Args:
+            source (BinaryIO): The stream to read the content from.
+            target (BinaryIO): The stream to write the compressed content to.
+            chunk_size (int): The number of bytes read at once.
+
+        Returns:
+            int: The number of compressed bytes written.
+        """
+        compressor = self.compressor()
+        written = 0
+        while chunk := source.read(chunk_size):
+            written += target.write(compressor.compress(chunk))
+        written += target.write(compressor.flush())
+        return written
+
+    def decompress_range(
+        self, chunks: Iterable[bytes], start: int, stop: int, chunk_size: int
+    ) -> Iterator[bytes]:
+        """
+        Decompresses a stream of compressed chunks and yields a byte range of the content.
+
+        Output before `start` is decompressed and discarded, and decompression stops as soon
+        as `stop` is reached, so memory usage does not depend on the size of the content.
+
+        Args:
+            chunks (Iterable[bytes]): The compressed content.
+            start (int): The offset of the first byte of the content to yield.
+            stop (int): The offset after the last byte of the content to yield.
+            chunk_size (int): The maximum size of each yielded chunk.
+
+        Returns:
+            Iterator[bytes]: The chunks of the range.
+        """
+        position = 0
+        for data in self.decompress(chunks, chunk_size):
+            end = position + len(data)
+            if end > start and data:
+                yield data[max(start - position, 0) : stop - position]
+            position = end
+            if position >= stop:
+                return
+
+
+class _ChunkReader:
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+
+    def read(self, size: int = -1) -> bytes:
+        return next(self._chunks, b"")
@@ -0,0 +1,208 @@
+import _thread
+import contextvars
+import fcntl
+import functools
+import inspect
+from collections.abc import Callable, Iterable, Iterator
+
+from flask import Flask
+from sqlalchemy.engine import make_url
+
+try:
+    import gevent
+    from gevent import monkey
+except ImportError:
+    gevent = None
+
+# The native identifier of the thread running the gevent hub, set by `init_app`.
+_hub_thread = None
+
+
+def init_app(app: Flask) -> None:
+    """
+    Prepares cooperative serving when the worker runs on gevent.
+
+    Gunicorn's gevent workers patch the standard library before loading the application, so
+    that every connection is served by a greenlet and waiting on sockets yields to the others.
+    Blocking disk and database calls are then handed to the hub's thread pool, which is sized
+    to `IO_THREADS` threads; the number of connections is only limited by `worker_connections`
+    and by memory. Without gevent, or when the standard library is not patched, nothing changes.
+
+    Args:
+        app (Flask): The application being created.
+
+    Returns:
+        None
+    """
+    global _hub_thread
+    if gevent is None or not monkey.is_module_patched("socket"):
+        return
+    _hub_thread = monkey.get_original("_thread", "get_ident")()
+    gevent.get_hub().threadpool.maxsize = app.config["IO_THREADS"]
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In-memory SQLite databases share a single connection and never wait for one.
+        return
+    # A thread of the pool must never wait for a connection held by a greenlet, which may
+    # itself be waiting for a thread, so connections are opened on demand beyond the pool.
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+        "max_overflow": -1,
+    }
+
+
+def is_cooperative() -> bool:
+    """
+    Tells whether the caller runs in a greenlet of the gevent hub.
+
+    Returns:
+        bool: True if blocking calls made here would stall every connection of the worker.
+    """
+    return (
+        _hub_thread is not None
+        and monkey.get_original("_thread", "get_ident")() == _hub_thread
+    )
+
+
+def is_patched() -> bool:
+    """
+    Tells whether the worker serves cooperatively, from any of its threads.
+
+    Returns:
+        bool: True if the standard library is patched by gevent and `init_app` ran.
+    """
+    return _hub_thread is not None
+
+
+def run_blocking(function: Callable, *args, **kwargs):
+    """
+    Runs a blocking call on the I/O thread pool when serving cooperatively.
+
+    The call runs with a copy of the caller's context variables, so the application context
+    and the database session of the request are available to it. Outside of the hub, and
+    in particular inside the thread pool itself, the function is simply called.
+
+    Args:
+        function (Callable): The blocking function.
+        *args: The positional arguments of the function.
+        **kwargs: The keyword arguments of the function.
+
+    Returns:
+        The result of the function, whose exceptions are raised in the caller.
+    """
+    if not is_cooperative():
+        return function(*args, **kwargs)
+    context = contextvars.copy_context()
+    return gevent.get_hub().threadpool.apply(context.run, (function, *args), kwargs)
+
+
+def iter_blocking(iterable: Iterable) -> Iterator:
+    """
+    Iterates over a blocking iterable, fetching each item on the I/O thread pool.
+
+    Args:
+        iterable (Iterable): An iterable reading from disk or from the database.
+
+    Returns:
+        Iterator: The items of the iterable.
+    """
+    if not is_cooperative():
+        return iter(iterable)
+    return _iter_offloaded(iter(iterable))
+
+
+def offloaded(function: Callable) -> Callable:
+    """
+    Decorates a blocking function so that it runs on the I/O thread pool.
+
+    The items of generator functions are fetched one at a time on the pool instead.
+
+    Args:
+        function (Callable): The blocking function.
+
+    Returns:
+        Callable: The decorated function.
+    """
+    if inspect.isgeneratorfunction(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return iter_blocking(function(*args, **kwargs))
+
+    else:
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return run_blocking(function, *args, **kwargs)
+
+    return wrapper
+
+
+def flock(file, operation: int) -> None:
+    """
+    Applies an `flock` lock without blocking the hub.
+
+    In the hub, the lock is polled with a growing delay rather than waited for on the thread
+    pool: a holder may need a thread of the pool to release it, and waiters would otherwise
+    occupy every thread.
+
+    Args:
+        file: The open file, or file descriptor, to lock.
+        operation (int): The `fcntl.LOCK_*` operation.
+
+    Raises:
+        BlockingIOError: If `LOCK_NB` is given and the lock is held elsewhere.
+
+    Returns:
+        None
+    """
+    if operation & fcntl.LOCK_NB or not is_cooperative():
+        fcntl.flock(file, operation)
+        return
+    delay = 0.001
+    while True:
+        try:
+            fcntl.flock(file, operation | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            gevent.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+
+def native_lock():
+    """
+    Creates a lock of the operating system, even when gevent patched the standard library.
+
+    Patched locks only wake up greenlets of the hub they were created in, while this one
+    can be released by any thread. Waiting on it blocks the whole thread, so it must only
+    be waited on outside of the hub.
+
+    Returns:
+        The new, unlocked lock.
+    """
+    if gevent is None:
+        return _thread.allocate_lock()
+    return monkey.get_original("_thread", "allocate_lock")()
+
+
+def native_local():
+    """
+    Creates thread-local storage of the operating system, even when gevent patched the
+    standard library.
+
+    Patched storage is local to each greenlet, while this one is shared by the calls that a
+    thread of the I/O pool runs in turn, so per-thread resources such as database connections
+    are opened once per thread.
+
+    Returns:
+        The new, empty thread-local storage.
+    """
+    if gevent is None:
+        return _thread._local()
+    return monkey.get_original("_thread", "_local")()
+
+
+def _iter_offloaded(iterator: Iterator) -> Iterator:
+    done = object()
+    while (item := run_blocking(next, iterator, done)) is not done:
+        yield item
@@ -0,0 +1,444 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+
+from flask import Flask, current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.cache import uses_local_database
+from app.concurrency import flock
+
+
+class BloomFilter:
+    """
+    Bloom filter stored in a memory-mapped file and shared by every worker process.
+
+    The file starts with a header holding the filter parameters, the number of stored
+    files it was last synchronised with, and the number of deletes it has seen since it
+    was built. Bits are only ever set, under an exclusive file lock, so lookups are plain
+    memory reads. A rebuilt filter is written to a new file that atomically replaces the
+    old one; the old file is then flagged as superseded so that other processes remap it.
+    Writers hold `<path>.rebuild` shared from adding their keys until their changes are
+    committed and counted, and rebuilds hold it exclusively, so that a rebuild never scans
+    the database while a key added to the old file is not committed yet.
+
+    Attributes:
+        path (str): The path of the memory-mapped file.
+        num_bits (int): The number of bits in the filter.
+        num_hashes (int): The number of bit positions set per key.
+    """
+
+    _HEADER = struct.Struct("<8sQQqqQ")
+    _MAGIC = b"DRWBLOOM"
+    _COUNT_OFFSET = 24
+    _DELETES_OFFSET = 32
+    _SUPERSEDED_OFFSET = 40
+
+    def __init__(self, path: str, num_bits: int, num_hashes: int):
+        self.path = path
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self._map = None
+        self._inode = None
+
+    @classmethod
+    def for_capacity(cls, path: str, capacity: int, error_rate: float) -> "BloomFilter":
+        """
+        Creates a filter sized for a number of keys and a false-positive rate.
+
+        Args:
+            path (str): The path of the memory-mapped file.
+            capacity (int): The expected number of keys.
+            error_rate (float): The acceptable false-positive rate at that capacity.
+
+        Returns:
+            BloomFilter: The (not yet opened) filter.
+        """
+        num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        num_bits += -num_bits % 8
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(path, num_bits, num_hashes)
+
+    @property
+    def count(self) -> int:
+        """
+        Returns the number of stored files the filter is synchronised with.
+
+        Returns:
+            int: The stored file count, or -1 if the filter has never been built.
+        """
+        return struct.unpack_from("<q", self._map, self._COUNT_OFFSET)[0]
+
+    @property
+    def deletes(self) -> int:
+        """
+        Returns the number of deletes since the filter was built.
+
+        Returns:
+            int: The number of keys whose bits are still set although they were deleted.
+        """
+        return struct.unpack_from("<q", self._map, self._DELETES_OFFSET)[0]
+
+    def open(self, lock: bool = True) -> None:
+        """
+        Maps the filter file, creating an empty, unbuilt filter if it is missing or was
+        created with different parameters.
+
+        Args:
+            lock (bool): Whether to take the file lock; False if the caller already holds it.
+
+        Returns:
+            None
+        """
+        size = self._HEADER.size + self.num_bits // 8
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if lock:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            header = os.pread(fd, self._HEADER.size, 0)
+            expected = (self._MAGIC, self.num_bits, self.num_hashes)
+            if (
+                len(header) != self._HEADER.size
+                or self._HEADER.unpack(header)[:3] != expected
+                or os.fstat(fd).st_size != size
+            ):
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, self._HEADER.pack(*expected, -1, 0, 0), 0)
+            if lock:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._inode = os.fstat(fd).st_ino
+            self._swap(mmap.mmap(fd, size))
+        finally:
+            os.close(fd)
+
+    def might_contain(self, key: str) -> bool:
+        """
+        Returns whether a key may be in the filter.
+
+        Args:
+            key (str): The key to look up.
+
+        Returns:
+            bool: False if the key is definitely absent, True if it may be present.
+        """
+        mapping = self._map
+        if mapping[self._SUPERSEDED_OFFSET]:
+            self.open()
+            mapping = self._map
+        header_size = self._HEADER.size
+        for position in self._positions(key):
+            if not mapping[header_size + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, key: str) -> None:
+        """
+        Adds a key to the filter.
+
+        Args:
+            key (str): The key to add.
+
+        Returns:
+            None
+        """
+        with self._locked():
+            self._set_bits(self._map, key)
+
+    def adjust(self, count: int = 0, deletes: int = 0) -> None:
+        """
+        Updates the stored file count and delete counter after a committed change.
+
+        Args:
+            count (int): The change in the number of stored files.
+            deletes (int): The number of deleted files.
+
+        Returns:
+            None
+        """
+        with self._locked():
+            if self.count >= 0:
+                struct.pack_into("<q", self._map, self._COUNT_OFFSET, self.count + count)
+            struct.pack_into(
+                "<q", self._map, self._DELETES_OFFSET, self.deletes + deletes
+            )
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        """
+        Keeps the filter from being rebuilt until the block exits.
+
+        Writers add their keys, commit them and adjust the counters within the block. They
+        pass through `<path>.gate` on their way in, which a waiting rebuild holds, so that a
+        steady flow of writers cannot starve it.
+
+        Returns:
+            Iterator[None]: A context manager holding off rebuilds.
+        """
+        with (
+            open(f"{self.path}.gate", "a+b") as gate,
+            open(f"{self.path}.rebuild", "a+b") as rebuild,
+        ):
+            flock(gate, fcntl.LOCK_EX)
+            flock(rebuild, fcntl.LOCK_SH)
+            flock(gate, fcntl.LOCK_UN)
+            yield
+
+    def rebuild(self, keys: Iterable[str]) -> int:
+        """
+        Builds a new filter from all keys and atomically replaces the current file with it.
+
+        The rebuild waits for the writers holding it off, and blocks new ones while the keys
+        are scanned, so every key added to the old file is either committed before the scan
+        starts or added to the new file.
+
+        Args:
+            keys (Iterable[str]): Every key that is currently stored.
+
+        Returns:
+            int: The number of keys added.
+        """
+        size = self._HEADER.size + self.num_bits // 8
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with (
+            open(f"{self.path}.gate", "a+b") as gate,
+            open(f"{self.path}.rebuild", "a+b") as rebuild,
+        ):
+            flock(gate, fcntl.LOCK_EX)
+            flock(rebuild, fcntl.LOCK_EX)
+            with self._locked():
+                with open(temp_path, "w+b") as f:
+                    f.truncate(size)
+                    new_map = mmap.mmap(f.fileno(), size)
+                count = 0
+                for key in keys:
+                    self._set_bits(new_map, key)
+                    count += 1
+                self._HEADER.pack_into(
+                    new_map, 0, self._MAGIC, self.num_bits, self.num_hashes, count, 0, 0
+                )
+                new_map.flush()
+                os.replace(temp_path, self.path)
+                self._map[self._SUPERSEDED_OFFSET] = 1
+                self._inode = os.stat(self.path).st_ino
+                self._swap(new_map)
+        return count
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return (
+            (first + index * second) % self.num_bits for index in range(self.num_hashes)
+        )
+
+    def _set_bits(self, target: mmap.mmap, key: str) -> None:
+        header_size = self._HEADER.size
+        for position in self._positions(key):
+            offset = header_size + (position >> 3)
+            target[offset] |= 1 << (position & 7)
+
+    def _swap(self, new_map: mmap.mmap) -> None:
+        # Lookups in other threads of the worker may still be reading the old mapping, so it
+        # is not closed under them but unmapped once the last of them has dropped it.
+        self._map = new_map
+
+    def _locked(self) -> "_FileLock":
+        lock = _FileLock(self.path)
+        if lock.acquire() != self._inode:
+            self.open(lock=False)
+        return lock
+
+
+class _FileLock:
+    def __init__(self, path: str):
+        self._path = path
+        self._file = None
+
+    def acquire(self) -> int:
+        while True:
+            self._file = open(self._path, "rb")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            inode = os.fstat(self._file.fileno()).st_ino
+            if inode == os.stat(self._path).st_ino:
+                return inode
+            self._file.close()
+
+    def __enter__(self) -> "_FileLock":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._file.close()
+
+
+class HashFilter:
+    """
+    Front filter of stored file hashes that answers definite misses without a database query.
+
+    The filter is built from a streaming scan of the referenced blobs and persisted in the
+    storage folder, so a restart only rescans the table when the persisted filter is out of date
+    (its count no longer matches the table) or when too many deleted hashes have accumulated
+    in it. Hashes are added before their metadata is committed, so a stored file is never
+    reported as missing. Deleted hashes stay in the filter until the next rebuild and only
+    cost a database query.
+    """
+
+    def __init__(self):
+        self._filter = None
+        self._ready = False
+        self._lock = threading.Lock()
+        self.definite_misses = 0
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Sets up the filter for an application and loads it if the database is ready.
+
+        The filter is disabled unless `BLOOM_FILTER_ENABLED` is set, and when the database is
+        not SQLite, since files added by other nodes would be missing from it. If the `file`
+        table cannot be read yet (for instance before the migrations ran), the filter is loaded
+        on first use.
+
+        Args:
+            app (Flask): The application to set up the filter for.
+
+        Returns:
+            None
+        """
+        app.extensions["hash_filter"] = self
+        self._ready = False
+        self.definite_misses = 0
+        if not app.config["BLOOM_FILTER_ENABLED"]:
+            self._filter = None
+            return
+        if not uses_local_database(app):
+            app.logger.warning(
+                "The Bloom filter is disabled, since it cannot follow a shared database."
+            )
+            self._filter = None
+            return
+        self._filter = BloomFilter.for_capacity(
+            os.path.join(app.config["STORAGE_FOLDER"], ".meta", "bloom"),
+            app.config["BLOOM_FILTER_CAPACITY"],
+            app.config["BLOOM_FILTER_ERROR_RATE"],
+        )
+        with app.app_context():
+            self._ensure_loaded()
+
+    def might_contain(self, file_hash: str) -> bool:
+        """
+        Returns whether a file with the given hash may be stored.
+
+        Args:
+            file_hash (str): The hash to look up.
+
+        Returns:
+            bool: False if the file is definitely not stored, True if it may be.
+        """
+        if not self._ensure_loaded():
+            return True
+        if self._filter.might_contain(file_hash):
+            return True
+        self.definite_misses += 1
+        return False
+
+    def writing(self) -> AbstractContextManager:
+        """
+        Returns a context manager keeping the filter from being rebuilt until it exits.
+
+        Hashes must be added, their metadata committed and the changes recorded within it,
+        and so must deletes be committed and recorded.
+
+        Returns:
+            AbstractContextManager: The context manager, which does nothing if the filter is
+                                    disabled.
+        """
+        if not self._ensure_loaded():
+            return nullcontext()
+        return self._filter.writing()
+
+    def add(self, file_hash: str) -> None:
+        """
+        Adds a hash to the filter. Must be called before the file's metadata is committed,
+        within `writing`.
+
+        Args:
+            file_hash (str): The hash of the file being stored.
+
+        Returns:
+            None
+        """
+        if self._ensure_loaded():
+            self._filter.add(file_hash)
+
+    def record_changes(self, added: int = 0, deleted: int = 0) -> None:
+        """
+        Records committed changes to the set of referenced blobs.
+
+        Args:
+            added (int): The number of blobs that became referenced.
+            deleted (int): The number of blobs that are no longer referenced.
+
+        Returns:
+            None
+        """
+        if self._ensure_loaded():
+            self._filter.adjust(count=added - deleted, deletes=deleted)
+
+    def stats(self) -> dict:
+        """
+        Returns the filter statistics.
+
+        Returns:
+            dict: The filter size and counters, or `{"enabled": False}`.
+        """
+        if self._filter is None:
+            return {"enabled": False}
+        if not self._ready:
+            return {"enabled": True, "ready": False}
+        return {
+            "enabled": True,
+            "ready": True,
+            "bits": self._filter.num_bits,
+            "hashes": self._filter.num_hashes,
+            "count": self._filter.count,
+            "deletes": self._filter.deletes,
+            "definite_misses": self.definite_misses,
+        }
+
+    def _ensure_loaded(self) -> bool:
+        if self._filter is None:
+            return False
+        if self._ready:
+            return True
+        with self._lock:
+            if self._ready:
+                return True
+            from app.repositories.file_repository import FileRepository
+
+            try:
+                self._filter.open()
+                count = FileRepository.count_referenced_blobs()
+                if (
+                    self._filter.count != count
+                    or self._filter.deletes
+                    > current_app.config["BLOOM_FILTER_MAX_DELETES_RATIO"] * count
+                ):
+                    count = self._filter.rebuild(
+                        FileRepository.iter_referenced_hashes()
+                    )
+                    current_app.logger.info(f"Hash filter built from {count} files.")
+            except SQLAlchemyError as e:
+                current_app.logger.warning(f"Hash filter not loaded yet: {str(e)}.")
+                return False
+            self._ready = True
+            return True
+
+
+hash_filter = HashFilter()
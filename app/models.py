@@ -1,26 +1,99 @@
+from typing import NamedTuple
+
 from app import db
 
 
+class Blob(db.Model):
+    """
+    SQLAlchemy model for storing the content-level metadata of stored files.
+
+    Each distinct content is stored once, under its hash, no matter how many users own it.
+    The reference count tracks the number of `File` ownership records pointing at the blob;
+    a blob whose count dropped to zero is a tombstone, whose content is removed from the store by
+    a background pass unless the blob is referenced again first.
+
+    Attributes:
+        file_hash (str): SHA-256 hash of the content, the primary key.
+        size (int): Size of the content in bytes, None for files stored before sizes were recorded.
+        refcount (int): Number of ownership records referencing the blob.
+        encoding (str): Content coding the blob is compressed with in the store, None if it is
+            stored as is.
+        reclaim_after (float): Unix time before which the content of an unreferenced blob is not
+            removed, set after a failed removal; None to remove it on the next pass.
+
+    Methods:
+        __repr__(): Provides a string representation of the Blob instance.
+    """
+
+    file_hash = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    encoding = db.Column(db.String(16), nullable=True)
+    reclaim_after = db.Column(db.Float, nullable=True)
+
+    def __repr__(self) -> str:
+        """
+        Returns a string representation of the Blob instance.
+
+        Returns:
+            str: A string representation of the Blob instance, e.g., "<Blob file_hash (refcount 1)>".
+        """
+        return f"<Blob {self.file_hash} (refcount {self.refcount})>"
+
+
 class File(db.Model):
     """
-    SQLAlchemy model for storing file metadata.
+    SQLAlchemy model for storing file ownership metadata.
 
-    This model represents a file stored in the database with attributes such as
-    a unique hash, filename, and a primary key ID.
+    This model represents a user's file, with attributes such as the hash of its content,
+    filename, owner, and a primary key ID. Several users may own the same content, but each
+    user owns a given content at most once.
 
     Attributes:
         id (int): Primary key identifier for the file.
-        file_hash (str): SHA-256 hash of the file, unique across all records.
-        filename (str): Original name of the file.
+        file_hash (str): SHA-256 hash of the file, referencing its `Blob`.
+        filename (str): Original name of the file, cut to its last `MAX_FILENAME_LENGTH`
+            characters.
+        username (str): Name of the user who uploaded the file.
+        blob (Blob): The blob holding the file's content metadata.
 
     Methods:
         __repr__(): Provides a string representation of the File instance.
     """
 
+    __table_args__ = (
+        db.UniqueConstraint(
+            "username", "file_hash", name="uq_file_username_file_hash"
+        ),
+        db.Index("ix_file_username_id", "username", "id"),
+    )
+
+    MAX_FILENAME_LENGTH = 255
+
     id = db.Column(db.Integer, primary_key=True)
-    file_hash = db.Column(db.String(64), unique=True, nullable=False)
-    filename = db.Column(db.String(64), nullable=False)
+    file_hash = db.Column(
+        db.String(64), db.ForeignKey("blob.file_hash"), nullable=False, index=True
+    )
+    filename = db.Column(db.String(MAX_FILENAME_LENGTH), nullable=False)
     username =  db.Column(db.String(80), nullable=False)
+    blob = db.relationship(Blob, lazy="joined")
+
+    def to_metadata(self) -> "FileMetadata":
+        """
+        Returns a detached snapshot of the file's metadata.
+
+        Returns:
+            FileMetadata: The hash, filename, owner, size and stored encoding of the file.
+        """
+        if self.blob is None:
+            return FileMetadata(self.file_hash, self.filename, self.username, None)
+        return FileMetadata(
+            self.file_hash,
+            self.filename,
+            self.username,
+            self.blob.size,
+            self.blob.encoding,
+        )
 
     def __repr__(self) -> str:
         """
@@ -33,3 +106,25 @@ class File(db.Model):
             str: A string representation of the File instance, e.g., "<File filename with hash file_hash>".
         """
         return f"<File {self.filename} with hash {self.file_hash}"
+
+
+class FileMetadata(NamedTuple):
+    """
+    Immutable snapshot of a file's metadata.
+
+    Unlike `File` instances, snapshots are not bound to a database session, so they can be
+    cached and shared between requests.
+
+    Attributes:
+        file_hash (str): SHA-256 hash of the file.
+        filename (str): Original name of the file.
+        username (str): Name of the user who uploaded the file.
+        size (int): Size of the file in bytes, or None if unknown.
+        encoding (str): Content coding the file is compressed with in the store, or None.
+    """
+
+    file_hash: str
+    filename: str
+    username: str
+    size: int | None
+    encoding: str | None = None
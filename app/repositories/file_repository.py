@@ -1,23 +1,32 @@
+import time
+from collections.abc import Callable, Iterable, Iterator
+
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import SQLAlchemyError
 
 from app import db
-from app.models import File
+from app.concurrency import offloaded
+from app.models import Blob, File, FileMetadata
 
 
 class FileRepository:
     """
     Repository class for handling file-related database operations.
 
-    This class provides static methods for interacting with the `File` model in the database.
-    It includes operations such as retrieving, adding, checking existence, and deleting file records.
+    This class provides static methods for interacting with the `File` and `Blob` models in the
+    database. It includes operations such as retrieving, adding, checking existence, and deleting
+    file records, and maintaining the reference counts of the blobs they point at.
     """
 
     @staticmethod
+    @offloaded
     def get_file_by_hash(file_hash: str) -> File:
         """
         Retrieves a file record from the database based on its hash.
 
-        This method queries the database for a file record with the specified file hash.
+        This method queries the database for a file record with the specified file hash. If several
+        users own the content, the oldest record is returned.
 
         Args:
             file_hash (str): The hash of the file to retrieve.
@@ -25,33 +34,239 @@ class FileRepository:
         Returns:
             File: The file record if found, otherwise None.
         """
-        return File.query.filter_by(file_hash=file_hash).first()
+        return File.query.filter_by(file_hash=file_hash).order_by(File.id).first()
+
+    @staticmethod
+    def release_connection() -> None:
+        """
+        Ends the current transaction and returns its connection to the pool.
+
+        Callers release the connection before waiting for a hash lock or sending a long
+        response, so that greenlets holding connections cannot exhaust the pool while the
+        holder of the lock waits for one.
+
+        Returns:
+            None
+        """
+        db.session.close()
 
     @staticmethod
-    def add_file(file_record: File) -> None:
+    def add_file(file: FileMetadata, stored: bool = False) -> int | None:
         """
-        Adds a new file record to the database.
+        Adds a new file record to the database and references its blob.
 
-        This method adds the provided file record to the database and commits the transaction.
-        If an error occurs, it rolls back the transaction to maintain database integrity.
+        The write is committed by the metadata writer, possibly together with the writes of
+        concurrent requests. If it fails, nothing is added.
 
         Args:
-            file_record (File): The file record to be added to the database.
+            file (FileMetadata): The hash, filename, owner, size and stored encoding of the file.
+            stored (bool): Whether the content was just written to the store, in which case the
+                encoding of an existing blob is updated as well.
 
         Raises:
             SQLAlchemyError: If an error occurs during the database operation.
 
         Returns:
-            None
+            int | None: The new reference count of the blob, 1 if it was not referenced before,
+                        or None if the user already owns the file.
         """
-        try:
-            db.session.add(file_record)
-            db.session.commit()
-        except SQLAlchemyError as e:
-            db.session.rollback()
-            raise e
+        return FileRepository.add_files([file], {file.file_hash} if stored else set())[0]
+
+    @staticmethod
+    def add_files(
+        files: list[FileMetadata], stored: set[str] = frozenset()
+    ) -> list[int | None]:
+        """
+        Adds several file records to the database in a single transaction.
+
+        The blob of each file has its reference count incremented, or is created if it does not
+        exist. The increment revives a tombstoned blob, whose content is then kept. Files the user
+        already owns are skipped with `ON CONFLICT DO NOTHING` rather than looked up first. Either
+        all of the records are added or, if an error occurs, none of them.
+
+        Args:
+            files (list[FileMetadata]): The hash, filename, owner, size and stored encoding of
+                each file; the hashes must be distinct.
+            stored (set[str]): The hashes whose content was just written to the store, whose
+                existing blobs get the new encoding.
+
+        Raises:
+            SQLAlchemyError: If an error occurs during the database operation.
+
+        Returns:
+            list[int | None]: The new reference count of each blob, in the order of `files`, or
+                              None for the files the user already owns.
+        """
+        return current_app.extensions["metadata_writer"].run(
+            lambda: [FileRepository._add_file(file, file.file_hash in stored) for file in files],
+            rows=2 * len(files),
+        )
+
+    @staticmethod
+    @offloaded
+    def get_existing_hashes(
+        file_hashes: Iterable[str], username: str | None = None
+    ) -> set[str]:
+        """
+        Returns which of the given hashes have a file record in the database.
+
+        The lookup runs as set-based `IN` queries of at most `QUERY_CHUNK_SIZE` hashes each,
+        instead of one query per hash.
+
+        Args:
+            file_hashes (Iterable[str]): The hashes to look up.
+            username (str, optional): Only consider files owned by this user. Defaults to None.
+
+        Returns:
+            set[str]: The subset of hashes that exist in the database.
+        """
+        file_hashes = list(dict.fromkeys(file_hashes))
+        chunk_size = current_app.config["QUERY_CHUNK_SIZE"]
+        existing = set()
+        for start in range(0, len(file_hashes), chunk_size):
+            query = db.select(File.file_hash).where(
+                File.file_hash.in_(file_hashes[start : start + chunk_size])
+            )
+            if username is not None:
+                query = query.where(File.username == username)
+            existing.update(db.session.scalars(query))
+        return existing
+
+    @staticmethod
+    @offloaded
+    def get_metadata(file_hashes: Iterable[str]) -> dict[str, FileMetadata]:
+        """
+        Returns the metadata of several files, joined with their blobs.
+
+        The lookup runs as set-based `IN` queries of at most `QUERY_CHUNK_SIZE` hashes each.
+        When several users own the same content, the oldest file record is used.
+
+        Args:
+            file_hashes (Iterable[str]): The hashes to look up.
+
+        Returns:
+            dict[str, FileMetadata]: The metadata of the files found, by hash.
+        """
+        file_hashes = list(dict.fromkeys(file_hashes))
+        chunk_size = current_app.config["QUERY_CHUNK_SIZE"]
+        metadata = {}
+        for start in range(0, len(file_hashes), chunk_size):
+            rows = db.session.execute(
+                db.select(
+                    File.file_hash, File.filename, File.username, Blob.size, Blob.encoding
+                )
+                .outerjoin(Blob, Blob.file_hash == File.file_hash)
+                .where(File.file_hash.in_(file_hashes[start : start + chunk_size]))
+                .order_by(File.id.desc())
+            )
+            metadata.update((row[0], FileMetadata(*row)) for row in rows)
+        return metadata
+
+    @staticmethod
+    @offloaded
+    def count_referenced_blobs() -> int:
+        """
+        Returns the number of blobs referenced by at least one file record.
+
+        Returns:
+            int: The number of referenced blobs.
+        """
+        return db.session.scalar(
+            db.select(db.func.count()).select_from(Blob).where(Blob.refcount > 0)
+        )
+
+    @staticmethod
+    @offloaded
+    def iter_referenced_hashes(batch_size: int = 10000) -> Iterator[str]:
+        """
+        Streams the hashes of all blobs referenced by at least one file record.
+
+        Rows are fetched from the database in batches, so memory usage does not grow with
+        the size of the table.
+
+        Args:
+            batch_size (int): The number of rows fetched at once.
+
+        Returns:
+            Iterator[str]: The hashes of all stored files.
+        """
+        yield from db.session.scalars(
+            db.select(Blob.file_hash)
+            .where(Blob.refcount > 0)
+            .execution_options(yield_per=batch_size)
+        )
+
+    @staticmethod
+    @offloaded
+    def get_referenced_blobs(
+        after: str, limit: int
+    ) -> list[tuple[str, int | None, str | None]]:
+        """
+        Returns one page of the blobs referenced by at least one file record, ordered by hash.
+
+        Args:
+            after (str): The hash after which the page starts, "" for the first page.
+            limit (int): The maximum number of blobs in the page.
+
+        Returns:
+            list[tuple[str, int | None, str | None]]: The hash, size and content coding of each
+                                                      blob.
+        """
+        return list(
+            db.session.execute(
+                db.select(Blob.file_hash, Blob.size, Blob.encoding)
+                .where(Blob.refcount > 0, Blob.file_hash > after)
+                .order_by(Blob.file_hash)
+                .limit(limit)
+            )
+        )
 
     @staticmethod
+    @offloaded
+    def is_blob_referenced(file_hash: str) -> bool:
+        """
+        Checks if a blob is referenced by at least one file record.
+
+        Args:
+            file_hash (str): The hash of the blob.
+
+        Returns:
+            bool: True if the blob exists and is referenced, False otherwise.
+        """
+        refcount = db.session.scalar(
+            db.select(Blob.refcount).where(Blob.file_hash == file_hash)
+        )
+        return refcount is not None and refcount > 0
+
+    @staticmethod
+    @offloaded
+    def get_known_blobs(file_hashes: Iterable[str]) -> set[str]:
+        """
+        Returns which of the given hashes have a blob record, referenced or not.
+
+        The lookup runs as set-based `IN` queries of at most `QUERY_CHUNK_SIZE` hashes each.
+
+        Args:
+            file_hashes (Iterable[str]): The hashes to look up.
+
+        Returns:
+            set[str]: The subset of hashes with a blob record.
+        """
+        file_hashes = list(dict.fromkeys(file_hashes))
+        chunk_size = current_app.config["QUERY_CHUNK_SIZE"]
+        known = set()
+        for start in range(0, len(file_hashes), chunk_size):
+            known.update(
+                db.session.scalars(
+                    db.select(Blob.file_hash).where(
+                        Blob.file_hash.in_(file_hashes[start : start + chunk_size])
+                    )
+                )
+            )
+        return known
+
+    @staticmethod
+    @offloaded
     def file_exists(file_hash: str) -> bool:
         """
         Checks if a file record exists in the database based on its hash.
@@ -69,25 +284,200 @@ class FileRepository:
         ).scalar()
 
     @staticmethod
-    def delete_file(file_record: File) -> None:
+    @offloaded
+    def iter_user_files(
+        username: str, after_id: int, limit: int, prefix: str | None = None
+    ) -> Iterator[tuple[int, str, str, int | None]]:
+        """
+        Streams one page of a user's files in ID order.
+
+        The page is selected with keyset pagination (`id > after_id`) over the `(username, id)`
+        index, so each page costs the same regardless of how deep into the listing it is.
+
+        Args:
+            username (str): The owner of the files.
+            after_id (int): The ID of the last file of the previous page, 0 for the first page.
+            limit (int): The maximum number of files in the page.
+            prefix (str, optional): Only list files whose name starts with this prefix.
+
+        Returns:
+            Iterator[tuple[int, str, str, int | None]]: The ID, hash, filename and size of each file.
+        """
+        query = (
+            db.select(File.id, File.file_hash, File.filename, Blob.size)
+            .outerjoin(Blob, Blob.file_hash == File.file_hash)
+            .where(File.username == username, File.id > after_id)
+            .order_by(File.id)
+            .limit(limit)
+        )
+        if prefix:
+            query = query.where(File.filename.startswith(prefix, autoescape=True))
+        yield from db.session.execute(query.execution_options(yield_per=1000))
+
+    @staticmethod
+    @offloaded
+    def owns_file(file_hash: str, username: str) -> bool:
+        """
+        Checks if a user owns a file with the given hash.
+
+        Args:
+            file_hash (str): The hash of the file to check for.
+            username (str): The user to check.
+
+        Returns:
+            bool: True if the user owns the file, False otherwise.
+        """
+        return db.session.query(
+            File.query.filter_by(file_hash=file_hash, username=username).exists()
+        ).scalar()
+
+    @staticmethod
+    def delete_file(file_hash: str, username: str) -> int | None:
         """
-        Deletes a file record from the database.
+        Deletes a user's file record from the database and releases its reference to the blob.
 
-        This method removes the specified file record from the database and commits the transaction.
-        If an error occurs, it rolls back the transaction to maintain database integrity.
+        The blob itself is left for the garbage collector. The write is committed by the metadata
+        writer, possibly together with the writes of concurrent requests.
 
         Args:
-            file_record (File): The file record to be deleted from the database.
+            file_hash (str): The hash of the file to delete.
+            username (str): The owner of the file.
 
         Raises:
             SQLAlchemyError: If an error occurs during the database operation.
 
         Returns:
-            None
+            int | None: The remaining reference count of the blob, or None if the user does
+                        not own the file.
+        """
+        return current_app.extensions["metadata_writer"].run(
+            lambda: FileRepository._delete_file(file_hash, username), rows=2
+        )
+
+    @staticmethod
+    @offloaded
+    def get_unreferenced_blobs(limit: int) -> list[tuple[str, int | None]]:
+        """
+        Returns the tombstoned blobs whose content is due for removal.
+
+        Blobs are due unless a failed removal postponed them to a later time.
+
+        Args:
+            limit (int): The maximum number of blobs to return.
+
+        Returns:
+            list[tuple[str, int | None]]: The hash and size of each unreferenced blob.
+        """
+        return list(
+            db.session.execute(
+                db.select(Blob.file_hash, Blob.size)
+                .where(
+                    Blob.refcount <= 0,
+                    db.or_(
+                        Blob.reclaim_after.is_(None),
+                        Blob.reclaim_after <= time.time(),
+                    ),
+                )
+                .limit(limit)
+            )
+        )
+
+    @staticmethod
+    @offloaded
+    def delete_unreferenced_blob(
+        file_hash: str, remove_content: Callable[[str], bool], retry_delay: float = 0
+    ) -> bool:
+        """
+        Deletes a blob record if it is still unreferenced, removing its content in the same transaction.
+
+        The conditional delete only succeeds while the blob is unreferenced. Callers hold the
+        blob's hash lock, which uploads also hold from their check for stored content until their
+        reference is committed, so that content is not removed under a new reference. If the
+        content cannot be removed, the transaction is rolled back and the blob is retried once
+        `retry_delay` seconds have passed.
+
+        Args:
+            file_hash (str): The hash of the blob.
+            remove_content (Callable[[str], bool]): Called with the hash to remove the content;
+                returns False on failure.
+            retry_delay (float): The number of seconds to wait before retrying a failed removal.
+
+        Raises:
+            SQLAlchemyError: If an error occurs during the database operation.
+
+        Returns:
+            bool: True if the blob was deleted, False otherwise.
         """
         try:
-            db.session.delete(file_record)
+            result = db.session.execute(
+                db.delete(Blob).where(Blob.file_hash == file_hash, Blob.refcount <= 0)
+            )
+            if not result.rowcount:
+                db.session.rollback()
+                return False
+            if not remove_content(file_hash):
+                db.session.rollback()
+                db.session.execute(
+                    db.update(Blob)
+                    .where(Blob.file_hash == file_hash, Blob.refcount <= 0)
+                    .values(reclaim_after=time.time() + retry_delay)
+                )
+                db.session.commit()
+                return False
             db.session.commit()
+            return True
         except SQLAlchemyError as e:
             db.session.rollback()
             raise e
+
+    @staticmethod
+    def _add_file(file: FileMetadata, stored: bool) -> int | None:
+        # Both inserts skip existing rows instead of checking for them first, so that concurrent
+        # writers of the same content, possibly on other nodes, never hit a unique constraint.
+        db.session.execute(
+            _insert(Blob)
+            .values(
+                file_hash=file.file_hash, size=file.size, refcount=0, encoding=file.encoding
+            )
+            .on_conflict_do_nothing(index_elements=[Blob.file_hash])
+        )
+        result = db.session.execute(
+            _insert(File)
+            .values(file_hash=file.file_hash, filename=file.filename, username=file.username)
+            .on_conflict_do_nothing(index_elements=[File.username, File.file_hash])
+        )
+        if not result.rowcount:
+            return None
+        values = {"refcount": Blob.refcount + 1, "reclaim_after": None}
+        if stored:
+            values["encoding"] = file.encoding
+        db.session.execute(
+            db.update(Blob).where(Blob.file_hash == file.file_hash).values(**values)
+        )
+        return db.session.scalar(
+            db.select(Blob.refcount).where(Blob.file_hash == file.file_hash)
+        )
+
+    @staticmethod
+    def _delete_file(file_hash: str, username: str) -> int | None:
+        result = db.session.execute(
+            db.delete(File).where(File.file_hash == file_hash, File.username == username)
+        )
+        if not result.rowcount:
+            return None
+        db.session.execute(
+            db.update(Blob)
+            .where(Blob.file_hash == file_hash)
+            .values(refcount=Blob.refcount - 1)
+        )
+        refcount = db.session.scalar(
+            db.select(Blob.refcount).where(Blob.file_hash == file_hash)
+        )
+        return refcount or 0
+
+
+def _insert(model: type[db.Model]):
+    # PostgreSQL and SQLite share the `INSERT ... ON CONFLICT` syntax, but not its constructs.
+    if db.session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
@@ -0,0 +1,141 @@
+from collections.abc import Callable
+
+from app import db
+from app.concurrency import is_patched, native_lock, offloaded
+
+
+class MetadataWriter:
+    """
+    Commits the metadata writes of concurrent requests together, in one transaction.
+
+    The first caller becomes the leader of a batch: it waits up to `window` seconds, or until
+    the batch holds `max_rows` rows, for other callers to join, then runs every write of the
+    batch in its own database session and commits them at once, so concurrent uploads share
+    the journal flush and take SQLite's write lock once. The leader only waits when other
+    writes are in progress in the process, or when the worker serves cooperatively, so that
+    a lone write is committed at once. If the batch cannot be committed,
+    it is rolled back and each write is retried in a transaction of its own, so a failing
+    write, such as a duplicate upload, only fails its own caller. Batches are per process.
+
+    Writes are callables using `db.session` without committing; they may run again after a
+    rollback, so they must not have effects outside of the database.
+
+    Attributes:
+        window (float): The number of seconds a batch waits for more writes, 0 to commit
+            every write on its own.
+        max_rows (int): The number of rows after which a batch is committed without waiting.
+        batches (int): The number of transactions committed by this process.
+        writes (int): The number of writes committed by this process.
+    """
+
+    def __init__(self, window: float = 0.002, max_rows: int = 500):
+        self.window = window
+        self.max_rows = max_rows
+        self.batches = 0
+        self.writes = 0
+        self._lock = native_lock()
+        self._batch = None
+        self._committing = 0
+
+    @offloaded
+    def run(self, write: Callable, rows: int = 1):
+        """
+        Runs a write in the next batch and returns once the batch is committed.
+
+        Callers must not have pending changes in their own session, which the leader commits
+        along with the batch.
+
+        Args:
+            write (Callable): Called without arguments to apply the write to `db.session`.
+            rows (int): The number of rows the write changes, counted towards `max_rows`.
+
+        Raises:
+            Exception: The exception raised by the write, or by the commit of the write.
+
+        Returns:
+            The value returned by the write.
+        """
+        entry = _Entry(write)
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            batch.entries.append(entry)
+            batch.rows += rows
+            full = batch.rows >= self.max_rows
+            if full:
+                self._batch = None
+                if not leader:
+                    batch.full.release()
+            wait = (
+                leader
+                and not full
+                and self.window > 0
+                and (self._committing > 0 or is_patched())
+            )
+            if leader:
+                self._committing += 1
+
+        if leader:
+            try:
+                if wait:
+                    batch.full.acquire(timeout=self.window)
+                with self._lock:
+                    if self._batch is batch:
+                        self._batch = None
+                self._commit(batch.entries)
+            finally:
+                with self._lock:
+                    self._committing -= 1
+                for other in batch.entries:
+                    if other is not entry:
+                        other.done.release()
+        else:
+            entry.done.acquire()
+        if entry.error is not None:
+            raise entry.error
+        return entry.result
+
+    def stats(self) -> dict:
+        """
+        Returns the number of commits performed by this process.
+
+        Returns:
+            dict: The `batches` and `writes` counters.
+        """
+        return {"batches": self.batches, "writes": self.writes}
+
+    def _commit(self, entries: list["_Entry"]) -> None:
+        try:
+            results = [entry.write() for entry in entries]
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(entries) == 1:
+                entries[0].error = e
+                return
+            for entry in entries:
+                self._commit([entry])
+            return
+        for entry, result in zip(entries, results):
+            entry.result = result
+        self.batches += 1
+        self.writes += len(entries)
+
+
+class _Batch:
+    def __init__(self):
+        self.entries = []
+        self.rows = 0
+        self.full = native_lock()
+        self.full.acquire()
+
+
+class _Entry:
+    def __init__(self, write: Callable):
+        self.write = write
+        self.result = None
+        self.error = None
+        self.done = native_lock()
+        self.done.acquire()
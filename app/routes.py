@@ -1,7 +1,20 @@
-from flask import Blueprint, Response, current_app, request, send_file
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    request,
+    stream_with_context,
+)
 
+from app.archive import FORMATS
 from app.auth import requires_auth
+from app.cache import hot_object_cache, metadata_cache
+from app.hash_filter import hash_filter
+from app.services.download_service import DownloadService
 from app.services.file_service import FileService
+from app.services.filesystem_service import FileSystemService
+from app.services.upload_session_service import UploadSessionService
 from app.utils import handle_error, json_response
 
 main = Blueprint("main", __name__)
@@ -39,13 +52,296 @@ def upload_file(username: str) -> Response:
     return json_response(result, 201)
 
 
-@main.route("/download/<file_hash>", methods=["GET"])
+@main.route("/upload/batch", methods=["POST"])
+@requires_auth
+def upload_files(username: str) -> Response:
+    """
+    Handles batch file upload requests.
+
+    This endpoint allows authenticated users to upload many files in one multipart request. Every file part
+    is stored, regardless of its field name. Files that already exist or that repeat another file of the
+    batch are reported as such, and the metadata of all new files is saved in a single transaction.
+
+    Args:
+        username (str): The username of the authenticated user making the request.
+
+    Returns:
+        Response: A Flask Response object containing one result per uploaded file, or an error message.
+    """
+    request.max_form_parts = current_app.config["BATCH_UPLOAD_MAX_FILES"]
+    files = [file for _, file in request.files.items(multi=True)]
+    if not files:
+        return handle_error("No file part.", 400, "No file part in the batch request.")
+
+    results = FileService.upload_files(files, username)
+
+    current_app.logger.info(
+        f"Batch upload processed: {len(results)} files, "
+        f"{sum('error' in result for result in results)} errors."
+    )
+    return json_response({"files": results}, 201)
+
+
+@main.route("/upload/sessions", methods=["POST"])
+@requires_auth
+def create_upload_session(username: str) -> Response:
+    """
+    Handles the creation of resumable upload sessions.
+
+    The request body is a JSON object with the `filename` and the `size` in bytes of the upload, at
+    most `UPLOAD_SESSION_MAX_SIZE`. The content is then sent in chunks with
+    `PATCH /upload/sessions/<upload_id>`, and the upload is finalized with
+    `POST /upload/sessions/<upload_id>/complete`.
+
+    Args:
+        username (str): The username of the authenticated user making the request.
+
+    Returns:
+        Response: A Flask Response object describing the new session, or an error message.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        payload = {}
+    filename, size = payload.get("filename"), payload.get("size")
+    if (
+        not isinstance(filename, str)
+        or not filename
+        or not isinstance(size, int)
+        or isinstance(size, bool)
+        or size < 0
+    ):
+        return handle_error(
+            "Expected a JSON object with a filename and a size.",
+            400,
+            "Invalid upload session payload.",
+        )
+
+    max_size = current_app.config["UPLOAD_SESSION_MAX_SIZE"]
+    if size > max_size:
+        return handle_error(
+            f"Upload too large, at most {max_size} bytes are allowed.",
+            413,
+            f"Upload session of {size} bytes rejected.",
+        )
+
+    session = UploadSessionService.create(username, filename, size)
+
+    current_app.logger.info(f"Upload session created: {session}.")
+    response = _session_response(session, 201)
+    response.headers["Location"] = f"/upload/sessions/{session['upload_id']}"
+    return response
+
+
+@main.route("/upload/sessions/<upload_id>", methods=["GET", "HEAD"])
+@requires_auth
+def get_upload_session(username: str, upload_id: str) -> Response:
+    """
+    Handles requests for the progress of a resumable upload.
+
+    The committed offset is the number of bytes received from the start of the upload without gaps;
+    after a disconnect, the client sends the rest of the upload from there. It is also returned in the
+    `Upload-Offset` header, so a `HEAD` request is enough.
+
+    Args:
+        username (str): The username of the authenticated user making the request.
+        upload_id (str): The identifier of the upload session.
+
+    Returns:
+        Response: A Flask Response object describing the session, or an error message.
+    """
+    session = UploadSessionService.get_session(upload_id, username)
+    if session is None:
+        return handle_error("Upload session not found.", 404)
+    return _session_response(session, 200)
+
+
+@main.route("/upload/sessions/<upload_id>", methods=["PATCH"])
+@requires_auth
+def write_upload_chunk(username: str, upload_id: str) -> Response:
+    """
+    Handles chunks of resumable uploads.
+
+    The request body is the raw content of the chunk and the `Upload-Offset` header its position in the
+    upload. Chunks may be sent in any order and in parallel, but not below the committed offset. The
+    bytes received before a disconnect are kept.
+
+    Args:
+        username (str): The username of the authenticated user making the request.
+        upload_id (str): The identifier of the upload session.
+
+    Returns:
+        Response: A Flask Response object describing the session, or an error message.
+    """
+    offset = request.headers.get("Upload-Offset", type=int)
+    if offset is None:
+        return handle_error("Missing or invalid Upload-Offset header.", 400)
+
+    session = UploadSessionService.write_chunk(
+        upload_id, username, offset, request.stream
+    )
+    if session is None:
+        return handle_error("Upload session not found.", 404)
+    if "error" in session:
+        return handle_error(
+            session["error"], 409, f"Chunk rejected for upload {upload_id}."
+        )
+    return _session_response(session, 200)
+
+
+@main.route("/upload/sessions/<upload_id>/complete", methods=["POST"])
+@requires_auth
+def complete_upload_session(username: str, upload_id: str) -> Response:
+    """
+    Handles the finalization of resumable uploads.
+
+    Once every byte has been received, the content is stored like a regular upload. If the optional JSON
+    body holds a `sha256`, the upload is rejected and its session removed when the content does not
+    match it.
+
+    Args:
+        username (str): The username of the authenticated user making the request.
+        upload_id (str): The identifier of the upload session.
+
+    Returns:
+        Response: A Flask Response object containing the result of the upload operation or an error message.
+    """
+    payload = request.get_json(silent=True)
+    expected_hash = payload.get("sha256") if isinstance(payload, dict) else None
+    if expected_hash is not None and not isinstance(expected_hash, str):
+        return handle_error("Expected the sha256 as a string.", 400)
+
+    result = UploadSessionService.complete(
+        upload_id, username, expected_hash and expected_hash.lower()
+    )
+    if result is None:
+        return handle_error("Upload session not found.", 404)
+    if "offset" in result:
+        return json_response(result, 409)
+    if "error" in result:
+        return handle_error(result["error"], 400, f"Upload error: {result['error']}")
+
+    current_app.logger.info(f"Resumable upload completed successfully: {result}.")
+    return json_response(result, 201)
+
+
+@main.route("/upload/sessions/<upload_id>", methods=["DELETE"])
+@requires_auth
+def abort_upload_session(username: str, upload_id: str) -> Response:
+    """
+    Handles the cancellation of resumable uploads, removing the content received so far.
+
+    Args:
+        username (str): The username of the authenticated user making the request.
+        upload_id (str): The identifier of the upload session.
+
+    Returns:
+        Response: A Flask Response object indicating the result of the cancellation.
+    """
+    if not UploadSessionService.abort(upload_id, username):
+        return handle_error("Upload session not found.", 404)
+    return json_response({"message": "Upload session deleted."}, 200)
+
+
+def _session_response(session: dict, status_code: int) -> Response:
+    """
+    Creates the JSON response describing an upload session, with its progress in headers.
+
+    Args:
+        session (dict): The session as returned by `UploadSessionService`.
+        status_code (int): The HTTP status code for the response.
+
+    Returns:
+        Response: The Flask Response object.
+    """
+    response = jsonify(session)
+    response.status_code = status_code
+    response.headers["Upload-Offset"] = str(session["offset"])
+    response.headers["Upload-Length"] = str(session["size"])
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@main.route("/exists", methods=["POST"])
+@requires_auth
+def find_missing_files(username: str) -> Response:
+    """
+    Handles bulk existence probes.
+
+    This endpoint allows authenticated users to send a JSON object with a `hashes` list and learn which of
+    these files they do not have on the server yet, so that only those need to be uploaded. At most
+    `EXISTS_MAX_HASHES` hashes are accepted per request.
+
+    Args:
+        username (str): The username of the authenticated user making the request.
+
+    Returns:
+        Response: A Flask Response object containing the list of missing hashes, or an error message.
+    """
+    payload = request.get_json(silent=True)
+    file_hashes = payload.get("hashes") if isinstance(payload, dict) else None
+    if not isinstance(file_hashes, list) or not all(
+        isinstance(file_hash, str) for file_hash in file_hashes
+    ):
+        return handle_error(
+            "Expected a JSON object with a list of hashes.",
+            400,
+            "Invalid existence probe payload.",
+        )
+
+    max_hashes = current_app.config["EXISTS_MAX_HASHES"]
+    if len(file_hashes) > max_hashes:
+        return handle_error(
+            f"Too many hashes, at most {max_hashes} are allowed.",
+            413,
+            f"Existence probe with {len(file_hashes)} hashes rejected.",
+        )
+
+    return json_response(
+        {"missing": FileService.find_missing(file_hashes, username)}, 200
+    )
+
+
+@main.route("/files", methods=["GET"])
+@requires_auth
+def list_files(username: str) -> Response:
+    """
+    Handles file listing requests.
+
+    This endpoint allows authenticated users to list their files page by page. Pages are selected with the
+    `after` query parameter, set to the `next_cursor` returned with the previous page, and hold at most
+    `limit` files. The optional `prefix` parameter restricts the listing to filenames starting with it.
+    The JSON response is streamed while the rows are read.
+
+    Args:
+        username (str): The username of the authenticated user making the request.
+
+    Returns:
+        Response: A Flask Response object streaming the page of files, or an error message.
+    """
+    after_id = request.args.get("after", 0, type=int)
+    limit = request.args.get("limit", current_app.config["FILES_PAGE_SIZE"], type=int)
+    if after_id < 0 or not 0 < limit <= current_app.config["FILES_MAX_PAGE_SIZE"]:
+        return handle_error("Invalid pagination parameters.", 400)
+
+    return Response(
+        stream_with_context(
+            FileService.list_files(
+                username, after_id, limit, request.args.get("prefix")
+            )
+        ),
+        mimetype="application/json",
+    )
+
+
+@main.route("/download/<file_hash>", methods=["GET", "HEAD"])
 def download_file(file_hash: str) -> Response:
     """
     Handles file download requests.
 
     This endpoint allows users to download files using a unique file hash. If the file is found, it will be
     sent to the client as an attachment. If the file is not found, an error response will be returned.
+    Since files are immutable, the hash is used as the `ETag`, conditional requests are answered with
+    304 Not Modified, and `Range` requests (including multiple ranges) are answered with 206 Partial Content.
 
     Args:
         file_hash (str): The hash of the file to be downloaded.
@@ -53,26 +349,23 @@ def download_file(file_hash: str) -> Response:
     Returns:
         Response: A Flask Response object for the file download or an error message if the file is not found.
     """
-    result = FileService.download_file(file_hash)
+    metadata = FileService.download_file(file_hash)
 
-    if result is None:
+    if metadata is None:
         return handle_error(
             "File not found.", 404, f"File not found for hash: {file_hash}."
         )
 
-    file_record, file_path = result
-
     try:
-        response = send_file(
-            file_path,
-            as_attachment=True,
-            download_name=file_record.filename,
-            mimetype="application/octet-stream",
-        )
+        response = DownloadService.build_response(metadata)
         current_app.logger.info(
-            f"File downloaded: {file_record.filename} (hash: {file_hash})."
+            f"File downloaded: {metadata.filename} (hash: {file_hash})."
         )
         return response
+    except FileNotFoundError:
+        return handle_error(
+            "File not found.", 404, f"File content missing for hash: {file_hash}."
+        )
     except Exception as e:
         current_app.logger.error(
             f"Error during file download for hash {file_hash}: {str(e)}"
@@ -80,6 +373,54 @@ def download_file(file_hash: str) -> Response:
         return handle_error("Internal Server Error", 500)
 
 
+@main.route("/download/archive", methods=["POST"])
+def download_archive() -> Response:
+    """
+    Handles archive download requests.
+
+    This endpoint allows users to download many files at once. The request body is a JSON object with a
+    `hashes` list and an optional `format`, "zip" (the default) or "tar". The metadata of all files is
+    resolved up front, and the archive is then streamed while it is built, with the stored filenames as
+    member names. If any file is not found, a 404 response lists the missing hashes. At most
+    `ARCHIVE_MAX_FILES` files are accepted per request.
+
+    Returns:
+        Response: A Flask Response object streaming the archive, or an error message.
+    """
+    payload = request.get_json(silent=True)
+    file_hashes = payload.get("hashes") if isinstance(payload, dict) else None
+    if not isinstance(file_hashes, list) or not all(
+        isinstance(file_hash, str) for file_hash in file_hashes
+    ):
+        return handle_error(
+            "Expected a JSON object with a list of hashes.",
+            400,
+            "Invalid archive download payload.",
+        )
+
+    archive_format = payload.get("format", "zip")
+    if archive_format not in FORMATS:
+        return handle_error(
+            f"Unknown archive format, expected one of: {', '.join(FORMATS)}.", 400
+        )
+
+    max_files = current_app.config["ARCHIVE_MAX_FILES"]
+    if len(file_hashes) > max_files:
+        return handle_error(
+            f"Too many files, at most {max_files} are allowed.",
+            413,
+            f"Archive download with {len(file_hashes)} files rejected.",
+        )
+
+    files, missing = FileService.get_archive_metadata(file_hashes)
+    if missing:
+        current_app.logger.error(f"Files not found for archive: {missing}.")
+        return json_response({"error": "Files not found.", "missing": missing}, 404)
+
+    current_app.logger.info(f"Archive download of {len(files)} files.")
+    return DownloadService.archive_response(files, archive_format)
+
+
 @main.route("/delete/<file_hash>", methods=["DELETE"])
 @requires_auth
 def delete_file(username: str, file_hash: str) -> Response:
@@ -108,3 +449,31 @@ def delete_file(username: str, file_hash: str) -> Response:
 
     current_app.logger.info(f"File deleted successfully for hash: {file_hash}.")
     return json_response({"message": "File deleted."}, 200)
+
+
+@main.route("/stats", methods=["GET"])
+@requires_auth
+def stats(username: str) -> Response:
+    """
+    Handles requests for the service's cache statistics.
+
+    This endpoint allows authenticated users to read the per-worker hit and miss counters of the caches
+    and of the hash filter, which are used to size them, together with the storage backend's usage and
+    the number of metadata transactions.
+
+    Args:
+        username (str): The username of the authenticated user making the request.
+
+    Returns:
+        Response: A Flask Response object containing the statistics of each cache.
+    """
+    return json_response(
+        {
+            "metadata_cache": metadata_cache.stats(),
+            "hot_object_cache": hot_object_cache.stats(),
+            "hash_filter": hash_filter.stats(),
+            "storage": FileSystemService.get_storage().stats(),
+            "metadata_writer": current_app.extensions["metadata_writer"].stats(),
+        },
+        200,
+    )
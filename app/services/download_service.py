@@ -0,0 +1,338 @@
+import os
+import uuid
+from collections.abc import Callable, Iterator
+
+from flask import Response, current_app, request, stream_with_context
+
+from app.archive import FORMATS, iter_archive, unique_names
+from app.cache import hot_object_cache
+from app.models import FileMetadata
+from app.services.filesystem_service import FileSystemService
+from app.utils import content_disposition
+
+RangeReader = Callable[[int, int], Iterator[bytes]]
+
+
+class DownloadService:
+    """
+    Service class for building download responses.
+
+    Files are addressed by their SHA-256 hash and are therefore immutable, so every response
+    carries the hash as a strong `ETag` together with long-lived caching headers. Conditional
+    requests (`If-None-Match`, `If-Range`) and single or multiple byte ranges are answered
+    without sending more bytes than the client asked for.
+    """
+
+    @staticmethod
+    def build_response(metadata: FileMetadata) -> Response:
+        """
+        Builds the download response for a stored file.
+
+        Files compressed at rest are sent compressed, with a `Content-Encoding` header, to
+        clients that accept their coding and do not ask for a range; everyone else gets the
+        original content, decompressed as it is streamed. Small files are served from the hot
+        object cache when it is enabled. Otherwise the body is offloaded to the front proxy if
+        configured and the storage backend keeps the file as a plain file, or streamed from
+        the store.
+
+        Args:
+            metadata (FileMetadata): The metadata of the file.
+
+        Raises:
+            FileNotFoundError: If the content of the file is missing from the store.
+
+        Returns:
+            Response: A Flask Response object streaming the requested part of the file.
+        """
+        file_hash = metadata.file_hash
+        encoding = metadata.encoding
+        size = metadata.size
+        if size is None:
+            size = FileSystemService.get_file_size(file_hash)
+            if size is None:
+                raise FileNotFoundError(f"Content missing for hash: {file_hash}.")
+
+        if (
+            encoding is not None
+            and request.range is None
+            and request.accept_encodings[encoding]
+        ):
+            return DownloadService.encoded_response(metadata)
+
+        if hot_object_cache.accepts(size):
+            data = hot_object_cache.get(
+                file_hash, lambda key: FileSystemService.read_file(key, encoding)
+            )
+            response = DownloadService.make_response(
+                file_hash,
+                metadata.filename,
+                len(data),
+                lambda start, stop: iter((data[start:stop],)),
+            )
+        else:
+            if current_app.config["DOWNLOAD_OFFLOAD"] and encoding is None:
+                file_path = FileSystemService.get_local_path(file_hash)
+                if file_path is not None:
+                    return DownloadService.offload_response(metadata, file_path)
+            response = DownloadService.make_response(
+                file_hash,
+                metadata.filename,
+                size,
+                lambda start, stop: FileSystemService.iter_content(
+                    file_hash, encoding, start, stop
+                ),
+            )
+
+        if encoding is not None:
+            response.vary.add("Accept-Encoding")
+        return response
+
+    @staticmethod
+    def archive_response(files: list[FileMetadata], archive_format: str) -> Response:
+        """
+        Builds a response streaming several files as one ZIP or TAR archive.
+
+        The archive is built while it is sent, each member being streamed from the store and
+        decompressed if it is compressed at rest, so neither the archive nor any member is held
+        in memory or written to disk. Members are named after the stored filenames, made
+        distinct where several files share a name.
+
+        Args:
+            files (list[FileMetadata]): The metadata of the files, in archive order, with sizes.
+            archive_format (str): "zip" or "tar".
+
+        Returns:
+            Response: A Flask Response object streaming the archive.
+        """
+        entries = (
+            (
+                name,
+                metadata.size,
+                lambda metadata=metadata: FileSystemService.iter_content(
+                    metadata.file_hash, metadata.encoding, 0, metadata.size
+                ),
+            )
+            for name, metadata in zip(
+                unique_names(metadata.filename for metadata in files), files
+            )
+        )
+        response = Response(
+            stream_with_context(iter_archive(entries, archive_format)),
+            mimetype=FORMATS[archive_format],
+        )
+        response.headers["Content-Disposition"] = content_disposition(
+            f"archive.{archive_format}"
+        )
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    @staticmethod
+    def encoded_response(metadata: FileMetadata) -> Response:
+        """
+        Builds a response sending the compressed bytes of a file compressed at rest as is.
+
+        The compressed representation gets its own entity tag, `<hash>-<encoding>`, and no
+        `Accept-Ranges` header, since ranges are only served from the original content.
+
+        Args:
+            metadata (FileMetadata): The metadata of a file stored with an encoding.
+
+        Returns:
+            Response: A Flask Response object streaming the compressed file.
+        """
+        file_hash = metadata.file_hash
+        response = DownloadService.prepare_response(
+            file_hash, metadata.filename, f"{file_hash}-{metadata.encoding}"
+        )
+        del response.headers["Accept-Ranges"]
+        response.vary.add("Accept-Encoding")
+        if response.status_code == 304:
+            return response
+
+        stored_size = FileSystemService.get_file_size(file_hash)
+        response.content_encoding = metadata.encoding
+        response.content_length = stored_size
+        response.response = FileSystemService.iter_file(file_hash, 0, stored_size)
+        return response
+
+    @staticmethod
+    def offload_response(metadata: FileMetadata, file_path: str) -> Response:
+        """
+        Builds a response that delegates sending the file body to the front proxy.
+
+        Depending on `DOWNLOAD_OFFLOAD`, the response carries either an `X-Accel-Redirect`
+        header (nginx) pointing at the file below `DOWNLOAD_OFFLOAD_PREFIX`, or an
+        `X-Sendfile` header (Apache, lighttpd) with the absolute path of the file. The proxy
+        then streams the file itself and handles `Range` requests, so the worker is released
+        as soon as the headers are produced. `If-None-Match` is still answered here.
+
+        Args:
+            metadata (FileMetadata): The metadata of the file.
+            file_path (str): The path of the file in the store.
+
+        Returns:
+            Response: A Flask Response object without a body.
+        """
+        response = DownloadService.prepare_response(
+            metadata.file_hash, metadata.filename
+        )
+        if response.status_code == 304:
+            return response
+
+        mode = current_app.config["DOWNLOAD_OFFLOAD"]
+        if mode == "x-accel":
+            relative_path = os.path.relpath(
+                file_path, current_app.config["STORAGE_FOLDER"]
+            ).replace(os.sep, "/")
+            prefix = current_app.config["DOWNLOAD_OFFLOAD_PREFIX"].rstrip("/")
+            response.headers["X-Accel-Redirect"] = f"{prefix}/{relative_path}"
+        elif mode == "x-sendfile":
+            response.headers["X-Sendfile"] = os.path.abspath(file_path)
+        else:
+            raise ValueError(f"Unknown download offload mode: {mode}.")
+        return response
+
+    @staticmethod
+    def prepare_response(
+        file_hash: str, filename: str, etag: str | None = None
+    ) -> Response:
+        """
+        Creates a download response with the headers shared by every download.
+
+        The hash is set as a strong `ETag` together with long-lived caching headers. If the
+        request's `If-None-Match` header matches the entity tag, the response is turned into a
+        304 Not Modified response.
+
+        Args:
+            file_hash (str): The hash of the file, used as its entity tag by default.
+            filename (str): The name under which the file is offered to the client.
+            etag (str | None): The entity tag of another representation of the file.
+
+        Returns:
+            Response: A Flask Response object without a body.
+        """
+        etag = etag or file_hash
+        response = Response(mimetype="application/octet-stream")
+        response.set_etag(etag)
+        response.headers["Accept-Ranges"] = "bytes"
+        response.headers["Cache-Control"] = (
+            f"public, max-age={current_app.config['DOWNLOAD_CACHE_MAX_AGE']}, immutable"
+        )
+        response.headers["Content-Disposition"] = content_disposition(filename)
+
+        if request.if_none_match.contains_weak(etag):
+            response.status_code = 304
+        return response
+
+    @staticmethod
+    def make_response(
+        file_hash: str, filename: str, size: int, read_range: RangeReader
+    ) -> Response:
+        """
+        Builds a download response from a callable that reads byte ranges of the content.
+
+        This method answers `If-None-Match` with 304 Not Modified, honours `If-Range`, and
+        returns a 206 Partial Content response for satisfiable `Range` requests, using a
+        `multipart/byteranges` body when several ranges are requested. Unsatisfiable ranges
+        are answered with 416. In every other case the full content is sent.
+
+        Args:
+            file_hash (str): The hash of the file, used as its entity tag.
+            filename (str): The name under which the file is offered to the client.
+            size (int): The size of the content in bytes.
+            read_range (RangeReader): A callable yielding the bytes in `[start, stop)`.
+
+        Returns:
+            Response: The Flask Response object for the request.
+        """
+        response = DownloadService.prepare_response(file_hash, filename)
+        if response.status_code == 304:
+            return response
+
+        ranges = DownloadService.resolve_ranges(file_hash, size)
+
+        if ranges is None:
+            response.response = read_range(0, size)
+            response.content_length = size
+        elif not ranges:
+            response.status_code = 416
+            response.headers["Content-Range"] = f"bytes */{size}"
+            response.headers.pop("Content-Disposition")
+        elif len(ranges) == 1:
+            start, stop = ranges[0]
+            response.status_code = 206
+            response.response = read_range(start, stop)
+            response.content_length = stop - start
+            response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        else:
+            boundary = uuid.uuid4().hex
+            parts = [
+                (
+                    (
+                        f"\r\n--{boundary}\r\n"
+                        "Content-Type: application/octet-stream\r\n"
+                        f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+                    ).encode("ascii"),
+                    start,
+                    stop,
+                )
+                for start, stop in ranges
+            ]
+            closing = f"\r\n--{boundary}--\r\n".encode("ascii")
+
+            def generate() -> Iterator[bytes]:
+                for header, start, stop in parts:
+                    yield header
+                    yield from read_range(start, stop)
+                yield closing
+
+            response.status_code = 206
+            response.response = generate()
+            response.content_length = len(closing) + sum(
+                len(header) + stop - start for header, start, stop in parts
+            )
+            response.headers["Content-Type"] = (
+                f"multipart/byteranges; boundary={boundary}"
+            )
+
+        return response
+
+    @staticmethod
+    def resolve_ranges(file_hash: str, size: int) -> list[tuple[int, int]] | None:
+        """
+        Resolves the byte ranges requested by the current request.
+
+        The `Range` header is ignored when it is missing, malformed, uses a unit other than
+        bytes, asks for more than `MAX_BYTE_RANGES` ranges, or when an `If-Range` validator
+        does not match the file's entity tag.
+
+        Args:
+            file_hash (str): The hash of the file, used as its entity tag.
+            size (int): The size of the content in bytes.
+
+        Returns:
+            list[tuple[int, int]] | None: The satisfiable `[start, stop)` ranges, an empty list
+                if none of the requested ranges can be satisfied, or None if the full content
+                should be sent.
+        """
+        byte_range = request.range
+        if byte_range is None or byte_range.units != "bytes":
+            return None
+        if len(byte_range.ranges) > current_app.config["MAX_BYTE_RANGES"]:
+            return None
+
+        if_range = request.if_range
+        if if_range.date is not None or (
+            if_range.etag is not None and if_range.etag != file_hash
+        ):
+            return None
+
+        ranges = []
+        for start, stop in byte_range.ranges:
+            if start < 0:
+                start, stop = max(size + start, 0), size
+            else:
+                stop = size if stop is None else min(stop, size)
+            if start < stop:
+                ranges.append((start, stop))
+        return ranges
@@ -1,10 +1,17 @@
+import json
+import time
+from collections.abc import Iterator
+
 from flask import current_app
 from sqlalchemy.exc import SQLAlchemyError
 
-from app.models import File
+from app.cache import hot_object_cache, metadata_cache
+from app.concurrency import offloaded
+from app.hash_filter import hash_filter
+from app.models import File, FileMetadata
 from app.repositories.file_repository import FileRepository
 from app.services.filesystem_service import FileSystemService
-from app.utils import hash_file
+from app.streaming import HashingTempFile
 
 
 class FileService:
@@ -21,52 +28,356 @@ class FileService:
         """
         Uploads a file to the system and saves its metadata to the database.
 
-        This method reads the content of the file, computes its hash, and checks if the file already
-        exists in the database. If not, it saves the file to the file system and adds its metadata
-        to the database.
+        This method spools the file into a temporary file inside the store while computing its hash
+        incrementally, and checks if the user already owns the file. If not, it moves the temporary
+        file into place with an atomic rename unless the content is already stored (possibly by
+        another user), then references the blob with that hash and adds the user's file record in a
+        write committed together with those of concurrent requests. The content is never held in
+        memory as a whole, and is stored only once across all users: the blob's lock is held until
+        the file record is committed, so concurrent uploads of the same content wait for the first
+        one and reuse the content it stored, and a failed upload only removes content that no other
+        file references. Compressible content is compressed at rest when `COMPRESSION` is enabled;
+        the hash is always the one of the original content.
 
         Args:
             file (FileStorage): The file object to be uploaded. This should be an instance of Flask's
                                 FileStorage, which has methods like `read()` and `seek()`.
+            username (str): The username of the user uploading the file.
 
         Returns:
             dict: A dictionary containing either the file hash with a success message or an error message
                   if the file could not be saved.
         """
-        file_content = file.read()
-        file_hash = hash_file(file_content)
-        file.seek(0)
+        temp_file = FileSystemService.spool_upload(file)
+        return FileService.save_upload(temp_file, file.filename, username)
+
+    @staticmethod
+    @offloaded
+    def save_upload(temp_file: HashingTempFile, filename: str, username: str) -> dict:
+        """
+        Stores received content, already hashed in a temporary file, as a file of a user.
+
+        This is the second half of `upload_file`, shared with uploads received in several
+        requests. The temporary file is moved into the store or removed. Under gevent workers,
+        it runs on one thread of the I/O pool as a whole, so the blob's lock and the database
+        transaction are never held by a greenlet waiting for a thread.
 
-        if FileRepository.file_exists(file_hash):
+        Args:
+            temp_file (HashingTempFile): The temporary file holding the content.
+            filename (str): The name of the file.
+            username (str): The username of the user uploading the file.
+
+        Returns:
+            dict: A dictionary containing either the file hash with a success message or an error message
+                  if the file could not be saved.
+        """
+        file_hash = temp_file.hexdigest()
+
+        if hash_filter.might_contain(file_hash) and FileRepository.owns_file(
+            file_hash, username
+        ):
+            temp_file.close()
             return {"message": "File already exists.", "file_hash": file_hash}
 
-        if not FileSystemService.save_file(file_content, file_hash):
-            current_app.logger.error(f"Error saving file: {str(e)}.")
-            return {"error": "Could not save file."}
+        FileRepository.release_connection()
+        with FileSystemService.lock_hashes(file_hash), hash_filter.writing():
+            stored = False
+            try:
+                encoding = FileSystemService.choose_encoding(temp_file)
+                if FileSystemService.file_exists(file_hash):
+                    temp_file.close()
+                elif FileSystemService.commit_temp_file(
+                    temp_file, file_hash, encoding
+                ):
+                    stored = True
+                else:
+                    current_app.logger.error(f"Error saving file {file_hash}.")
+                    return {"error": "Could not save file."}
 
-        try:
-            new_file = File(file_hash=file_hash, filename=file.filename, username=username)
-            FileRepository.add_file(new_file)
-        except SQLAlchemyError as e:
-            current_app.logger.error(f"Database error while adding file: {str(e)}.")
-            FileSystemService.delete_file(file_hash)
-            return {"error": "Could not save file metadata."}
+                hash_filter.add(file_hash)
+                refcount = FileRepository.add_file(
+                    FileMetadata(
+                        file_hash,
+                        filename[-File.MAX_FILENAME_LENGTH :],
+                        username,
+                        temp_file.size,
+                        encoding,
+                    ),
+                    stored,
+                )
+                if refcount is None:
+                    # A concurrent upload of the same file by the same user committed first.
+                    return {"message": "File already exists.", "file_hash": file_hash}
+            except SQLAlchemyError as e:
+                temp_file.close()
+                current_app.logger.error(
+                    f"Database error while adding file: {str(e)}."
+                )
+                if stored and not FileRepository.is_blob_referenced(file_hash):
+                    FileSystemService.delete_file(file_hash)
+                return {"error": "Could not save file metadata."}
+            if refcount == 1:
+                hash_filter.record_changes(added=1)
 
+        metadata_cache.invalidate(file_hash)
         return {"file_hash": file_hash}
 
     @staticmethod
-    def download_file(file_hash: str) -> tuple:
+    def upload_files(files: list, username: str) -> list[dict]:
+        """
+        Uploads several files at once and saves their metadata in a single transaction.
+
+        Each file is spooled and hashed while the request is parsed. The hashes are then
+        deduplicated against each other and against the user's files with one set-based query,
+        the blobs of the new files are referenced, missing content is moved into the store, and
+        all of the file records are inserted with one bulk insert and one commit. The locks of the
+        new hashes are held until then, so concurrent uploads of the same content store it once. If
+        that commit fails, the content of the blobs created by this batch is removed again.
+
+        Args:
+            files (list): The uploaded FileStorage objects.
+            username (str): The username of the user uploading the files.
+
+        Returns:
+            list[dict]: One result per file, in request order, containing the filename and either
+                        the file hash (with a message for duplicates) or an error message.
+        """
+        results = []
+        spooled = []
+        for file in files:
+            if file.filename == "":
+                results.append({"filename": "", "error": "No selected file."})
+                continue
+            temp_file = FileSystemService.spool_upload(file)
+            result = {"filename": file.filename, "file_hash": temp_file.hexdigest()}
+            results.append(result)
+            spooled.append((result, temp_file))
+
+        return FileService._save_uploads(spooled, results, username)
+
+    @staticmethod
+    @offloaded
+    def _save_uploads(spooled: list, results: list[dict], username: str) -> list[dict]:
+        # The second half of `upload_files`, run on one thread like `save_upload`.
+        existing = FileRepository.get_existing_hashes(
+            (
+                result["file_hash"]
+                for result, _ in spooled
+                if hash_filter.might_contain(result["file_hash"])
+            ),
+            username,
+        )
+        locked = [
+            result["file_hash"]
+            for result, _ in spooled
+            if result["file_hash"] not in existing
+        ]
+        FileRepository.release_connection()
+        with FileSystemService.lock_hashes(*locked), hash_filter.writing():
+            batch_hashes = set()
+            stored = set()
+            newly_referenced = 0
+            new_files = []
+            new_results = []
+            try:
+                for result, temp_file in spooled:
+                    file_hash = result["file_hash"]
+                    if file_hash in existing:
+                        temp_file.close()
+                        result["message"] = "File already exists."
+                        continue
+                    if file_hash in batch_hashes:
+                        temp_file.close()
+                        result["message"] = "Duplicate of another file in the batch."
+                        continue
+
+                    encoding = FileSystemService.choose_encoding(temp_file)
+                    if FileSystemService.file_exists(file_hash):
+                        temp_file.close()
+                    elif FileSystemService.commit_temp_file(
+                        temp_file, file_hash, encoding
+                    ):
+                        stored.add(file_hash)
+                    else:
+                        raise OSError(f"Could not save file {file_hash}.")
+
+                    batch_hashes.add(file_hash)
+                    hash_filter.add(file_hash)
+                    new_files.append(
+                        FileMetadata(
+                            file_hash,
+                            result["filename"][-File.MAX_FILENAME_LENGTH :],
+                            username,
+                            temp_file.size,
+                            encoding,
+                        )
+                    )
+                    new_results.append(result)
+
+                if new_files:
+                    refcounts = FileRepository.add_files(new_files, stored)
+                    newly_referenced = refcounts.count(1)
+                    for result, refcount in zip(new_results, refcounts):
+                        if refcount is None:
+                            result["message"] = "File already exists."
+            except (OSError, SQLAlchemyError) as e:
+                current_app.logger.error(f"Error while adding files: {str(e)}.")
+                for result, temp_file in spooled:
+                    temp_file.close()
+                for file_hash in stored:
+                    if not FileRepository.is_blob_referenced(file_hash):
+                        FileSystemService.delete_file(file_hash)
+                for result in results:
+                    if "file_hash" in result and "message" not in result:
+                        del result["file_hash"]
+                        result["error"] = "Could not save file."
+                return results
+            hash_filter.record_changes(added=newly_referenced)
+
+        for file_hash in batch_hashes:
+            metadata_cache.invalidate(file_hash)
+        return results
+
+    @staticmethod
+    def find_missing(file_hashes: list[str], username: str) -> list[str]:
+        """
+        Returns which of the given hashes the user does not own yet.
+
+        Hashes that the hash filter reports as definitely absent are answered without a query,
+        the remaining ones with set-based `IN` queries, so clients can probe thousands of hashes
+        at once and upload only the files they do not have on the server.
+
+        Args:
+            file_hashes (list[str]): The hashes to probe.
+            username (str): The user whose files are probed.
+
+        Returns:
+            list[str]: The hashes without a file record, in request order and without duplicates.
+        """
+        existing = FileRepository.get_existing_hashes(
+            (
+                file_hash
+                for file_hash in file_hashes
+                if hash_filter.might_contain(file_hash)
+            ),
+            username,
+        )
+        return [
+            file_hash
+            for file_hash in dict.fromkeys(file_hashes)
+            if file_hash not in existing
+        ]
+
+    @staticmethod
+    def list_files(
+        username: str, after_id: int, limit: int, prefix: str | None = None
+    ) -> Iterator[str]:
+        """
+        Lists one page of a user's files as a stream of JSON fragments.
+
+        Rows are serialised one at a time while they are fetched, so neither the page nor the
+        response body is ever held in memory as a whole. The response ends with `next_cursor`,
+        the value of `after` for the next page, or null on the last page.
+
+        Args:
+            username (str): The owner of the files.
+            after_id (int): The cursor returned with the previous page, 0 for the first page.
+            limit (int): The maximum number of files in the page.
+            prefix (str, optional): Only list files whose name starts with this prefix.
+
+        Returns:
+            Iterator[str]: The fragments of a JSON object with `files` and `next_cursor` fields.
+        """
+        yield '{"files":['
+        count = 0
+        last_id = None
+        for file_id, file_hash, filename, size in FileRepository.iter_user_files(
+            username, after_id, limit, prefix
+        ):
+            item = {
+                "id": file_id,
+                "file_hash": file_hash,
+                "filename": filename,
+                "size": size,
+            }
+            yield ("," if count else "") + json.dumps(item)
+            count += 1
+            last_id = file_id
+        next_cursor = last_id if count == limit else None
+        yield f'],"next_cursor":{json.dumps(next_cursor)}}}'
+
+    @staticmethod
+    def download_file(file_hash: str) -> FileMetadata | None:
         """
         Retrieves a file from the system based on its hash.
 
-        This method checks if the file metadata exists in the database and if the file exists in the file
-        system. If both checks pass, it returns the file record and file path.
+        This method checks if the file metadata exists in the database and if the file exists in the
+        store. If both checks pass, it returns the file metadata. Hashes that the hash
+        filter reports as definitely absent are rejected without a lookup, and results, including
+        misses, are served from the metadata cache when it is enabled.
 
         Args:
             file_hash (str): The hash of the file to be downloaded.
 
         Returns:
-            tuple: A tuple containing the file record and the file path if the file is found, otherwise None.
+            FileMetadata | None: The metadata of the file if it is found, otherwise None.
+        """
+        if not hash_filter.might_contain(file_hash):
+            return None
+
+        metadata = metadata_cache.get(file_hash, FileService.load_metadata)
+        FileRepository.release_connection()
+        return metadata
+
+    @staticmethod
+    def get_archive_metadata(
+        file_hashes: list[str],
+    ) -> tuple[list[FileMetadata], list[str]]:
+        """
+        Resolves the files of an archive download.
+
+        Hashes that the hash filter reports as definitely absent are rejected without a lookup,
+        and the metadata of the others is loaded with set-based queries rather than one query
+        per file.
+
+        Args:
+            file_hashes (list[str]): The hashes of the requested files.
+
+        Returns:
+            tuple[list[FileMetadata], list[str]]: The metadata of the files found, in request
+                                                  order and without duplicates, and the hashes
+                                                  whose record or content is missing.
+        """
+        file_hashes = list(dict.fromkeys(file_hashes))
+        found = FileRepository.get_metadata(
+            file_hash for file_hash in file_hashes if hash_filter.might_contain(file_hash)
+        )
+        files = []
+        missing = []
+        for file_hash in file_hashes:
+            metadata = found.get(file_hash)
+            if metadata is None or not FileSystemService.file_exists(file_hash):
+                missing.append(file_hash)
+                continue
+            if metadata.size is None:
+                metadata = metadata._replace(
+                    size=FileSystemService.get_file_size(file_hash)
+                )
+            files.append(metadata)
+        FileRepository.release_connection()
+        return files, missing
+
+    @staticmethod
+    def load_metadata(file_hash: str) -> FileMetadata | None:
+        """
+        Loads the metadata of a file whose content is present in the store.
+
+        Args:
+            file_hash (str): The hash of the file.
+
+        Returns:
+            FileMetadata | None: The metadata of the file, or None if either the database record
+                                 or the file on disk is missing.
         """
         file_record = FileRepository.get_file_by_hash(file_hash)
         if not file_record:
@@ -75,41 +386,98 @@ class FileService:
             )
             return None
 
-        file_path = FileSystemService.get_file_path(file_hash)
-
         if not FileSystemService.file_exists(file_hash):
             current_app.logger.error(f"File not found on disk for hash: {file_hash}.")
             return None
 
-        return file_record, file_path
+        return file_record.to_metadata()
 
     @staticmethod
     def delete_file(file_hash: str, username: str) -> bool:
         """
-        Deletes a file from the system and its metadata from the database.
+        Deletes a user's file.
+
+        This method deletes the user's file record and decrements the reference count of the blob
+        holding the content, which leaves a tombstone once no file references the content anymore.
+        The content itself is removed later, in the background, by `collect_garbage`.
 
-        This method removes the file from the file system and deletes its metadata from the database.
-        It handles errors by logging and returning a failure status.
+        Database errors are logged rather than raised, and reported as a failed deletion.
 
         Args:
             file_hash (str): The hash of the file to be deleted.
+            username (str): The username of the user deleting the file.
 
         Returns:
-            bool: True if the file and metadata were successfully deleted, False otherwise.
+            bool: True if the file was successfully deleted, False if the user has no such file
+                or the database could not be updated.
         """
-        file_record = FileRepository.get_file_by_hash(file_hash)
-        if not file_record or file_record.username != username:
-            current_app.logger.error(
-                f"File not found in database for hash: {file_hash} by user: {username}."
-            )
-            return False
+        with hash_filter.writing():
+            try:
+                refcount = FileRepository.delete_file(file_hash, username)
+            except SQLAlchemyError as e:
+                current_app.logger.error(f"Error deleting database record: {str(e)}.")
+                return False
+            if refcount is None:
+                current_app.logger.error(
+                    f"File not found in database for hash: {file_hash} by user: {username}."
+                )
+                return False
+            if refcount <= 0:
+                hash_filter.record_changes(deleted=1)
 
-        try:
-            FileSystemService.delete_file(file_hash)
-            FileRepository.delete_file(file_record)
-            return True
-        except (OSError, SQLAlchemyError) as e:
-            current_app.logger.error(
-                f"Error deleting file or database record: {str(e)}."
+        metadata_cache.invalidate(file_hash)
+        if refcount <= 0:
+            hot_object_cache.discard(file_hash)
+        return True
+
+    @staticmethod
+    def collect_garbage(batch_size: int = 1000, io_budget: int = 0) -> int:
+        """
+        Removes the content of blobs that are no longer referenced by any file.
+
+        Deleting a file only leaves a tombstone, a blob whose reference count dropped to zero, so
+        the request does not wait for its content to be removed. Each tombstone is then deleted
+        with a conditional delete that only succeeds while its reference count is still zero, and
+        its content is removed inside the same transaction while the blob's lock is held, which
+        uploads of the same content wait for. That lock spans nodes only when they share a
+        PostgreSQL database, so nodes sharing a store must share its database. Blobs whose
+        content cannot be removed are kept and retried after `BLOB_GC_RETRY_DELAY` seconds. With
+        an I/O budget, the pass pauses after each removal so that it removes at most `io_budget`
+        bytes per second on average.
+
+        Args:
+            batch_size (int): The maximum number of blobs examined in one pass.
+            io_budget (int): The maximum number of bytes removed per second, 0 for no limit.
+
+        Returns:
+            int: The number of blobs removed.
+        """
+        removed = 0
+        blobs = FileRepository.get_unreferenced_blobs(batch_size)
+        FileRepository.release_connection()
+        for file_hash, size in blobs:
+            try:
+                deleted = FileService._collect_blob(file_hash)
+            except SQLAlchemyError as e:
+                current_app.logger.error(
+                    f"Error collecting blob {file_hash}: {str(e)}."
+                )
+                continue
+            if deleted:
+                removed += 1
+                if io_budget > 0 and size:
+                    time.sleep(size / io_budget)
+        if removed:
+            current_app.logger.info(f"Garbage collection removed {removed} blobs.")
+        return removed
+
+    @staticmethod
+    @offloaded
+    def _collect_blob(file_hash: str) -> bool:
+        # Run on one thread like `save_upload`, since it holds the blob's lock.
+        with FileSystemService.lock_hashes(file_hash):
+            return FileRepository.delete_unreferenced_blob(
+                file_hash,
+                FileSystemService.delete_file,
+                current_app.config["BLOB_GC_RETRY_DELAY"],
             )
-            return False
@@ -1,7 +1,18 @@
 import os
+import shutil
+import sys
+import tempfile
+import uuid
+from collections.abc import Iterator
+from contextlib import AbstractContextManager
 
 from flask import current_app
 
+from app.compression import Codec
+from app.concurrency import iter_blocking, offloaded
+from app.storage import StorageBackend
+from app.streaming import HashingTempFile, spool_stream
+
 
 class FileSystemService:
     """
@@ -9,15 +20,48 @@ class FileSystemService:
 
     This class provides static methods for file management tasks such as
     retrieving file paths, saving files, deleting files, and checking if a file exists.
+    The content itself is held by the storage backend selected by `STORAGE_BACKEND`.
     """
 
+    @staticmethod
+    def get_storage() -> StorageBackend:
+        """
+        Returns the storage backend of the current application.
+
+        Returns:
+            StorageBackend: The backend selected by the `STORAGE_BACKEND` setting.
+        """
+        return current_app.extensions["storage"]
+
+    @staticmethod
+    def lock_hashes(*file_hashes: str) -> AbstractContextManager:
+        """
+        Returns a context manager holding the write locks of the given hashes.
+
+        Writers of a blob hold its lock from the moment they check whether the content is stored
+        until their database transaction is over, so only one of several concurrent uploads of the
+        same content, in any thread or worker process, or on any node sharing a PostgreSQL
+        database, stores it, while the others wait and then find it stored. Under gevent workers,
+        locks are held by threads of the I/O pool only, so that their holders never wait for a
+        thread taken by a waiter.
+
+        Args:
+            *file_hashes (str): The hashes to lock.
+
+        Returns:
+            AbstractContextManager: A context manager holding the locks.
+        """
+        return current_app.extensions["hash_locks"].hold(file_hashes)
+
     @staticmethod
     def get_file_path(file_hash: str) -> str:
         """
         Constructs the file path for a given file hash.
 
-        This method generates a file path by combining the storage folder, a subdirectory
-        derived from the first two characters of the file hash, and the file hash itself.
+        This method generates a file path by combining the storage folder, `SHARD_DEPTH` levels
+        of subdirectories named after consecutive `SHARD_WIDTH`-character slices of the start of
+        the file hash (a single level of two characters by default), and the file hash itself.
+        Backends that pack small files together only use it for the files they keep standalone.
 
         Args:
             file_hash (str): The hash of the file used to determine the file path.
@@ -25,17 +69,194 @@ class FileSystemService:
         Returns:
             str: The complete file path for the given file hash.
         """
-        return os.path.join(
-            current_app.config["STORAGE_FOLDER"], file_hash[:2], file_hash
+        return FileSystemService.get_storage().get_file_path(file_hash)
+
+    @staticmethod
+    def get_temp_dir() -> str:
+        """
+        Returns the directory used for in-progress uploads.
+
+        The directory lives inside the storage folder so that finished uploads can be moved
+        into place with an atomic rename on the same filesystem.
+
+        Returns:
+            str: The path of the temporary upload directory.
+        """
+        return os.path.join(current_app.config["STORAGE_FOLDER"], ".tmp")
+
+    @staticmethod
+    def spool_upload(file) -> HashingTempFile:
+        """
+        Returns a hashing temporary file holding the content of an uploaded file.
+
+        Uploads parsed by `StreamingRequest` are already spooled and hashed, so their stream
+        is returned as is. Any other file object is copied in chunks of `UPLOAD_CHUNK_SIZE`
+        bytes, which keeps memory usage constant regardless of the upload size.
+
+        Args:
+            file (FileStorage): The uploaded file.
+
+        Returns:
+            HashingTempFile: The temporary file containing the upload.
+        """
+        if isinstance(file.stream, HashingTempFile):
+            return file.stream
+        return spool_stream(
+            file.stream,
+            FileSystemService.get_temp_dir(),
+            current_app.config["UPLOAD_CHUNK_SIZE"],
         )
 
     @staticmethod
+    def get_codec(encoding: str) -> Codec:
+        """
+        Returns the codec for a content coding, at the configured compression level.
+
+        Args:
+            encoding (str): The content coding, "gzip" or "zstd".
+
+        Raises:
+            ValueError: If the coding is unknown or its codec is not installed.
+
+        Returns:
+            Codec: The codec.
+        """
+        return Codec(encoding, current_app.config["COMPRESSION_LEVEL"])
+
+    @staticmethod
+    def choose_encoding(temp_file: HashingTempFile) -> str | None:
+        """
+        Decides whether a new blob is worth compressing at rest.
+
+        Args:
+            temp_file (HashingTempFile): The temporary file holding the content.
+
+        Returns:
+            str | None: The content coding to store the blob with, or None to store it as is.
+        """
+        temp_file.flush()
+        return FileSystemService.choose_file_encoding(temp_file.name, temp_file.size)
+
+    @staticmethod
+    @offloaded
+    def choose_file_encoding(path: str, size: int) -> str | None:
+        """
+        Decides whether the content of a file is worth compressing at rest.
+
+        When `COMPRESSION` is set, the first `COMPRESSION_SAMPLE_SIZE` bytes of every file of
+        at least `COMPRESSION_MIN_SIZE` bytes are compressed, and the file is compressed if the
+        sample shrinks to at most `COMPRESSION_MAX_RATIO` of its size. Already compressed
+        formats such as images and archives are therefore stored as is. Blobs are never
+        compressed when `STORAGE_CHUNKING` is set, as compression would defeat deduplication
+        of their chunks.
+
+        Args:
+            path (str): The path of the file holding the content.
+            size (int): The size of the file in bytes.
+
+        Returns:
+            str | None: The content coding to store the blob with, or None to store it as is.
+        """
+        encoding = current_app.config["COMPRESSION"]
+        if (
+            not encoding
+            or current_app.config["STORAGE_CHUNKING"]
+            or size < current_app.config["COMPRESSION_MIN_SIZE"]
+        ):
+            return None
+        with open(path, "rb") as f:
+            sample = f.read(current_app.config["COMPRESSION_SAMPLE_SIZE"])
+        ratio = FileSystemService.get_codec(encoding).ratio(sample)
+        if ratio > current_app.config["COMPRESSION_MAX_RATIO"]:
+            return None
+        return encoding
+
+    @staticmethod
+    @offloaded
+    def commit_temp_file(
+        temp_file: HashingTempFile, file_hash: str, encoding: str | None = None
+    ) -> bool:
+        """
+        Moves a finished temporary file to its final location in the store.
+
+        The file is handed to the storage backend, which either renames it into place or
+        appends it to a pack, so readers either see the complete file or no file at all.
+        If an encoding is given, the content is compressed into a second temporary file first.
+
+        Args:
+            temp_file (HashingTempFile): The temporary file holding the content.
+            file_hash (str): The hash of the file used to determine the file path.
+            encoding (str | None): The content coding to compress the file with, if any.
+
+        Returns:
+            bool: True if the file was moved successfully, False otherwise.
+        """
+        source_path = temp_file.detach()
+        try:
+            size = temp_file.size
+            if encoding is not None:
+                source_path, size = FileSystemService._compress(source_path, encoding)
+            FileSystemService.get_storage().store(source_path, file_hash, size)
+            return True
+        except OSError as e:
+            current_app.logger.error(f"Failed to save file {file_hash}: {str(e)}.")
+            for path in {temp_file.name, source_path}:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            return False
+
+    @staticmethod
+    @offloaded
+    def import_file(
+        source_path: str, file_hash: str, size: int, encoding: str | None = None
+    ) -> bool:
+        """
+        Stores the content of a file outside the store, leaving the file in place.
+
+        The file is hardlinked into the temporary directory when it is on the same filesystem
+        as the store, and copied there otherwise, and the link or copy is then committed like
+        an uploaded file. A hardlinked blob shares its data with the source file, which must
+        therefore not be modified in place afterwards.
+
+        Args:
+            source_path (str): The path of the file to import.
+            file_hash (str): The hash of the file.
+            size (int): The size of the file in bytes.
+            encoding (str | None): The content coding to compress the file with, if any.
+
+        Returns:
+            bool: True if the content was stored, False otherwise.
+        """
+        temp_dir = FileSystemService.get_temp_dir()
+        temp_path = os.path.join(temp_dir, f"import-{uuid.uuid4().hex}")
+        try:
+            os.makedirs(temp_dir, exist_ok=True)
+            try:
+                os.link(source_path, temp_path)
+            except OSError:
+                shutil.copyfile(source_path, temp_path)
+            if encoding is not None:
+                temp_path, size = FileSystemService._compress(temp_path, encoding)
+            FileSystemService.get_storage().store(temp_path, file_hash, size)
+            return True
+        except OSError as e:
+            current_app.logger.error(f"Failed to import file {source_path}: {str(e)}.")
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            return False
+
+    @staticmethod
+    @offloaded
     def save_file(file_content: bytes, file_hash: str) -> bool:
         """
         Saves file content to the file system.
 
-        This method writes the provided file content to a file at the path determined
-        by the file hash. It ensures that the necessary directories are created.
+        This method writes the provided file content to a temporary file and hands it to
+        the storage backend.
 
         Args:
             file_content (bytes): The content of the file to be saved.
@@ -44,48 +265,162 @@ class FileSystemService:
         Returns:
             bool: True if the file was saved successfully, False otherwise.
         """
-        file_path = FileSystemService.get_file_path(file_hash)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
         try:
-            with open(file_path, "wb") as f:
-                f.write(file_content)
-            return True
+            temp_file = HashingTempFile(FileSystemService.get_temp_dir())
+            temp_file.write(file_content)
         except IOError as e:
             current_app.logger.error(f"Failed to save file {file_hash}: {str(e)}.")
             return False
+        return FileSystemService.commit_temp_file(temp_file, file_hash)
 
     @staticmethod
-    def delete_file(file_hash: str) -> None:
+    @offloaded
+    def delete_file(file_hash: str) -> bool:
         """
         Deletes a file from the file system.
 
-        This method removes the file specified by the file hash if it exists.
+        This method removes the content of the file from the store if it exists.
 
         Args:
             file_hash (str): The hash of the file used to determine the file path.
 
         Returns:
-            None
+            bool: True if the file is gone, False if it could not be removed.
         """
-        file_path = FileSystemService.get_file_path(file_hash)
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            FileSystemService.get_storage().delete(file_hash)
+            return True
         except OSError as e:
             current_app.logger.error(f"Failed to delete file {file_hash}: {str(e)}.")
+            return False
 
     @staticmethod
+    @offloaded
     def file_exists(file_hash: str) -> bool:
         """
         Checks if a file exists in the file system.
 
-        This method determines whether a file exists at the path specified by the file hash.
-
         Args:
-            file_hash (str): The hash of the file used to determine the file path.
+            file_hash (str): The hash of the file.
 
         Returns:
             bool: True if the file exists, False otherwise.
         """
-        file_path = FileSystemService.get_file_path(file_hash)
-        return os.path.isfile(file_path)
+        return FileSystemService.get_storage().exists(file_hash)
+
+    @staticmethod
+    @offloaded
+    def get_file_size(file_hash: str) -> int | None:
+        """
+        Returns the size of a stored file.
+
+        Args:
+            file_hash (str): The hash of the file.
+
+        Returns:
+            int | None: The size in bytes, or None if the file is not stored.
+        """
+        return FileSystemService.get_storage().size(file_hash)
+
+    @staticmethod
+    def iter_file(file_hash: str, start: int, stop: int) -> Iterator[bytes]:
+        """
+        Streams a byte range of a stored file in chunks of `DOWNLOAD_CHUNK_SIZE` bytes.
+
+        Args:
+            file_hash (str): The hash of the file.
+            start (int): The offset of the first byte.
+            stop (int): The offset after the last byte.
+
+        Returns:
+            Iterator[bytes]: The chunks of the range.
+        """
+        return iter_blocking(
+            FileSystemService.get_storage().read_range(
+                file_hash, start, stop, current_app.config["DOWNLOAD_CHUNK_SIZE"]
+            )
+        )
+
+    @staticmethod
+    def iter_content(
+        file_hash: str, encoding: str | None, start: int, stop: int
+    ) -> Iterator[bytes]:
+        """
+        Streams a byte range of the original content of a stored file.
+
+        Compressed files are decompressed on the fly from their beginning.
+
+        Args:
+            file_hash (str): The hash of the file.
+            encoding (str | None): The content coding the file is stored with, if any.
+            start (int): The offset of the first byte of the original content.
+            stop (int): The offset after the last byte of the original content.
+
+        Returns:
+            Iterator[bytes]: The chunks of the range.
+        """
+        if encoding is None:
+            return FileSystemService.iter_file(file_hash, start, stop)
+        stored_size = FileSystemService.get_file_size(file_hash)
+        if stored_size is None:
+            raise FileNotFoundError(file_hash)
+        return FileSystemService.get_codec(encoding).decompress_range(
+            FileSystemService.iter_file(file_hash, 0, stored_size),
+            start,
+            stop,
+            current_app.config["DOWNLOAD_CHUNK_SIZE"],
+        )
+
+    @staticmethod
+    def read_file(file_hash: str, encoding: str | None = None) -> bytes:
+        """
+        Reads the whole original content of a stored file into memory.
+
+        Args:
+            file_hash (str): The hash of the file.
+            encoding (str | None): The content coding the file is stored with, if any.
+
+        Raises:
+            FileNotFoundError: If the file is not stored.
+
+        Returns:
+            bytes: The content of the file.
+        """
+        size = FileSystemService.get_file_size(file_hash)
+        if size is None:
+            raise FileNotFoundError(file_hash)
+        if encoding is not None:
+            size = sys.maxsize
+        return b"".join(FileSystemService.iter_content(file_hash, encoding, 0, size))
+
+    @staticmethod
+    @offloaded
+    def get_local_path(file_hash: str) -> str | None:
+        """
+        Returns the path of a plain file holding exactly the content of a stored file.
+
+        Only such files can be offloaded to the front proxy.
+
+        Args:
+            file_hash (str): The hash of the file.
+
+        Returns:
+            str | None: The path of the file, or None if the backend stores it otherwise.
+        """
+        return FileSystemService.get_storage().local_path(file_hash)
+
+    @staticmethod
+    def _compress(source_path: str, encoding: str) -> tuple[str, int]:
+        fd, target_path = tempfile.mkstemp(
+            dir=FileSystemService.get_temp_dir(), prefix="compress-"
+        )
+        try:
+            with open(source_path, "rb") as source, os.fdopen(fd, "wb") as target:
+                size = FileSystemService.get_codec(encoding).compress_stream(
+                    source, target, current_app.config["UPLOAD_CHUNK_SIZE"]
+                )
+        except OSError:
+            os.remove(target_path)
+            raise
+        os.remove(source_path)
+        return target_path, size
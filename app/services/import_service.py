@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import chain, islice
+from multiprocessing import get_context
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.cache import metadata_cache
+from app.hash_filter import hash_filter
+from app.concurrency import offloaded
+from app.models import File, FileMetadata
+from app.repositories.file_repository import FileRepository
+from app.services.filesystem_service import FileSystemService
+
+
+class ImportService:
+    """
+    Service class seeding the store with the files of an existing directory tree.
+
+    Files are hashed in parallel by a process pool while the previous batch is committed, their
+    content is hardlinked or copied into the store, and their records are inserted for one owner
+    with one transaction per batch. The tree is walked in sorted order and the last committed
+    file is checkpointed, so an interrupted import resumes after it without hashing the files
+    before it again.
+    """
+
+    @staticmethod
+    def import_directory(
+        directory: str,
+        username: str,
+        workers: int = 4,
+        batch_size: int = 1000,
+        progress: Callable[[dict], None] | None = None,
+    ) -> dict:
+        """
+        Imports every regular file below a directory for a user.
+
+        Files whose content the user already owns are skipped, as they would be on upload;
+        symbolic links are not followed. Each file is recorded under its base name.
+
+        Args:
+            directory (str): The root of the tree to import.
+            username (str): The owner of the imported files.
+            workers (int): The number of processes hashing files.
+            batch_size (int): The number of files committed per transaction.
+            progress (Callable[[dict], None], optional): Called with the counters after every
+                committed batch.
+
+        Raises:
+            OSError: If the content of a file could not be stored.
+            SQLAlchemyError: If a batch could not be committed.
+
+        Returns:
+            dict: The number of `files` processed, of files `imported` and of `bytes` hashed,
+                  and the `elapsed` time in seconds, including the runs that were resumed.
+        """
+        directory = os.path.abspath(directory)
+        checkpoint_path = ImportService._checkpoint_path(directory, username)
+        state = ImportService._load_checkpoint(checkpoint_path)
+        counts = state.get("counts") or {"files": 0, "imported": 0, "bytes": 0}
+        started = time.monotonic() - state.get("elapsed", 0)
+
+        paths = ImportService._iter_files(directory, state.get("last", []))
+        batches = iter(lambda: list(islice(paths, batch_size)), [])
+        context = get_context("spawn")
+        with ProcessPoolExecutor(max(workers, 1), mp_context=context) as executor:
+            # The next batch is hashed while the previous one is committed.
+            pending = []
+            for batch in chain(batches, [[]]):
+                futures = [executor.submit(_hash_file, path) for path in batch]
+                if pending:
+                    ImportService._commit_batch(pending, username, counts)
+                    ImportService._checkpoint(
+                        checkpoint_path, directory, last, counts, started, progress
+                    )
+                pending = futures
+                last = batch[-1] if batch else None
+
+        try:
+            os.remove(checkpoint_path)
+        except FileNotFoundError:
+            pass
+        return {**counts, "elapsed": time.monotonic() - started}
+
+    @staticmethod
+    def describe(counts: dict) -> str:
+        """
+        Formats the counters of an import for progress messages.
+
+        Args:
+            counts (dict): The counters returned by `import_directory`.
+
+        Returns:
+            str: The number of files processed and imported, and the throughput.
+        """
+        megabytes = counts["bytes"] / 2**20
+        rate = megabytes / counts["elapsed"] if counts["elapsed"] else 0
+        files_rate = counts["files"] / counts["elapsed"] if counts["elapsed"] else 0
+        return (
+            f"{counts['files']} files processed, {counts['imported']} imported, "
+            f"{megabytes:.1f} MiB at {rate:.1f} MiB/s ({files_rate:.0f} files/s)."
+        )
+
+    @staticmethod
+    @offloaded
+    def _commit_batch(futures: list[Future], username: str, counts: dict) -> None:
+        entries = []
+        for future in futures:
+            try:
+                entries.append(future.result())
+            except OSError as e:
+                current_app.logger.warning(f"Skipping unreadable file: {str(e)}.")
+        existing = FileRepository.get_existing_hashes(
+            (file_hash for _, file_hash, _ in entries), username
+        )
+        counts["files"] += len(entries)
+        counts["bytes"] += sum(size for _, _, size in entries)
+
+        batch_hashes = set()
+        stored = set()
+        new_files = []
+        FileRepository.release_connection()
+        with (
+            FileSystemService.lock_hashes(
+                *(file_hash for _, file_hash, _ in entries if file_hash not in existing)
+            ),
+            hash_filter.writing(),
+        ):
+            try:
+                for path, file_hash, size in entries:
+                    if file_hash in existing or file_hash in batch_hashes:
+                        continue
+                    encoding = FileSystemService.choose_file_encoding(path, size)
+                    if not FileSystemService.file_exists(file_hash):
+                        if not FileSystemService.import_file(
+                            path, file_hash, size, encoding
+                        ):
+                            raise OSError(f"Could not import file {path}.")
+                        stored.add(file_hash)
+
+                    batch_hashes.add(file_hash)
+                    hash_filter.add(file_hash)
+                    new_files.append(
+                        FileMetadata(
+                            file_hash,
+                            os.path.basename(path)[-File.MAX_FILENAME_LENGTH :],
+                            username,
+                            size,
+                            encoding,
+                        )
+                    )
+
+                refcounts = FileRepository.add_files(new_files, stored) if new_files else []
+                newly_referenced = refcounts.count(1)
+            except (OSError, SQLAlchemyError) as e:
+                current_app.logger.error(f"Error while importing files: {str(e)}.")
+                for file_hash in stored:
+                    if not FileRepository.is_blob_referenced(file_hash):
+                        FileSystemService.delete_file(file_hash)
+                raise
+            hash_filter.record_changes(added=newly_referenced)
+
+        for file_hash in batch_hashes:
+            metadata_cache.invalidate(file_hash)
+        counts["imported"] += len(refcounts) - refcounts.count(None)
+
+    @staticmethod
+    def _iter_files(directory: str, after: list[str]) -> Iterator[str]:
+        # Entries are visited in the order of their path components, so every path after
+        # the checkpoint sorts after it, and whole directories before it are skipped.
+        def walk(path: str, parts: list[str]) -> Iterator[str]:
+            for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+                entry_parts = parts + [entry.name]
+                if entry.is_dir(follow_symlinks=False):
+                    if entry_parts >= after[: len(entry_parts)]:
+                        yield from walk(entry.path, entry_parts)
+                elif entry.is_file(follow_symlinks=False) and entry_parts > after:
+                    yield entry.path
+
+        return walk(directory, [])
+
+    @staticmethod
+    def _checkpoint(
+        path: str,
+        directory: str,
+        last_path: str,
+        counts: dict,
+        started: float,
+        progress: Callable[[dict], None] | None,
+    ) -> None:
+        state = {
+            "last": os.path.relpath(last_path, directory).split(os.sep),
+            "counts": counts,
+            "elapsed": time.monotonic() - started,
+        }
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+        if progress is not None:
+            progress({**counts, "elapsed": state["elapsed"]})
+
+    @staticmethod
+    def _checkpoint_path(directory: str, username: str) -> str:
+        key = hashlib.sha256(f"{directory}\0{username}".encode()).hexdigest()[:16]
+        meta_dir = os.path.join(current_app.config["STORAGE_FOLDER"], ".meta")
+        os.makedirs(meta_dir, exist_ok=True)
+        return os.path.join(meta_dir, f"import-{key}.json")
+
+    @staticmethod
+    def _load_checkpoint(path: str) -> dict:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+
+def _hash_file(path: str) -> tuple[str, str, int]:
+    with open(path, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256")
+        return path, digest.hexdigest(), os.fstat(f.fileno()).st_size
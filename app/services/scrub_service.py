@@ -0,0 +1,279 @@
+import fcntl
+import hashlib
+import json
+import os
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from multiprocessing import get_context
+
+from flask import Flask, current_app
+
+from app.cache import hot_object_cache, metadata_cache
+from app.compression import DECOMPRESSION_ERRORS, Codec
+from app.concurrency import offloaded
+from app.repositories.file_repository import FileRepository
+from app.services.filesystem_service import FileSystemService
+from app.storage import StorageBackend, create_storage
+
+# The storage backend of a worker process, created by `_init_worker`.
+_worker_storage = None
+
+
+class ScrubService:
+    """
+    Service class checking that the store and the database agree and that stored content is intact.
+
+    A scrub streams the referenced blobs from the database in hash order and rehashes their
+    content in parallel, then lists the content of the store to find content without a blob
+    record. Three kinds of problems are reported:
+
+    - missing: a referenced blob whose content is not in the store;
+    - corrupt: a blob whose content no longer matches its hash;
+    - orphan: content in the store without a blob record.
+
+    Every problem is confirmed again under the blob's lock before it is reported, so uploads
+    and garbage collection running meanwhile are not mistaken for problems. When repairing,
+    corrupt content is moved to `<STORAGE_FOLDER>/.quarantine` and orphans are removed, so that
+    uploading the content again restores it; missing content can only be restored that way.
+    """
+
+    STATUSES = ("missing", "corrupt", "orphan")
+
+    @staticmethod
+    def scrub(
+        workers: int = 4,
+        io_budget: int = 0,
+        repair: bool = False,
+        batch_size: int = 1000,
+        restart: bool = False,
+        report: Callable[[str, str], None] | None = None,
+    ) -> dict | None:
+        """
+        Checks the whole store, resuming from the last checkpoint.
+
+        After each batch of blobs, the position of the scrub and its counters are saved to
+        `<STORAGE_FOLDER>/.meta/scrub.json`, so an interrupted scrub resumes where it stopped
+        instead of rehashing millions of blobs again; the listing of the store for orphans is
+        not checkpointed. Only one scrub runs at a time across all worker processes.
+
+        Args:
+            workers (int): The number of processes rehashing content, 1 to rehash in-process.
+            io_budget (int): The maximum number of bytes read per second, 0 for no limit.
+            repair (bool): Whether to quarantine corrupt content and remove orphans.
+            batch_size (int): The number of blobs checked between two checkpoints.
+            restart (bool): Whether to ignore the checkpoint and start from the beginning.
+            report (Callable[[str, str], None], optional): Called with the status and the hash
+                of every problem found. Defaults to logging a warning.
+
+        Returns:
+            dict | None: The number of blobs `checked`, of each kind of problem and of
+                         problems `repaired`, or None if another scrub is already running.
+        """
+        report = report or (
+            lambda status, file_hash: current_app.logger.warning(
+                f"Scrub found {status} blob {file_hash}."
+            )
+        )
+        meta_dir = os.path.join(current_app.config["STORAGE_FOLDER"], ".meta")
+        os.makedirs(meta_dir, exist_ok=True)
+        with open(os.path.join(meta_dir, "scrub.lock"), "a+b") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+
+            checkpoint_path = os.path.join(meta_dir, "scrub.json")
+            state = {} if restart else ScrubService._load_checkpoint(checkpoint_path)
+            after = state.get("after", "")
+            counts = state.get("counts") or dict.fromkeys(
+                ("checked", *ScrubService.STATUSES, "repaired"), 0
+            )
+
+            def found(status: str, file_hash: str) -> None:
+                counts[status] += 1
+                report(status, file_hash)
+                if repair and ScrubService._repair(status, file_hash):
+                    counts["repaired"] += 1
+
+            executor = None
+            if workers > 1:
+                executor = ProcessPoolExecutor(
+                    workers,
+                    mp_context=get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(dict(current_app.config),),
+                )
+            try:
+                while blobs := FileRepository.get_referenced_blobs(after, batch_size):
+                    for file_hash, encoding, status in ScrubService._verify_batch(
+                        executor, blobs, io_budget / max(workers, 1)
+                    ):
+                        counts["checked"] += 1
+                        if status != "ok" and ScrubService._confirm(
+                            file_hash, encoding, status
+                        ):
+                            found(status, file_hash)
+                    after = blobs[-1][0]
+                    ScrubService._save_checkpoint(
+                        checkpoint_path, {"after": after, "counts": counts}
+                    )
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+
+            storage = FileSystemService.get_storage()
+            hashes = storage.iter_hashes()
+            while batch := list(islice(hashes, batch_size)):
+                known = FileRepository.get_known_blobs(batch)
+                for file_hash in batch:
+                    if file_hash not in known and ScrubService._confirm(
+                        file_hash, None, "orphan"
+                    ):
+                        found("orphan", file_hash)
+
+            try:
+                os.remove(checkpoint_path)
+            except FileNotFoundError:
+                pass
+            return counts
+
+    @staticmethod
+    def verify_blob(
+        storage: StorageBackend,
+        file_hash: str,
+        encoding: str | None,
+        chunk_size: int,
+        io_budget: float = 0,
+    ) -> str:
+        """
+        Rehashes the content of a blob.
+
+        Args:
+            storage (StorageBackend): The backend holding the content.
+            file_hash (str): The hash of the blob.
+            encoding (str | None): The content coding the blob is stored with, if any.
+            chunk_size (int): The number of bytes read at once.
+            io_budget (float): The maximum number of bytes read per second, 0 for no limit.
+
+        Returns:
+            str: "ok" if the content matches its hash, "missing" or "corrupt" otherwise.
+        """
+        size = storage.size(file_hash)
+        if size is None:
+            return "missing"
+        digest = hashlib.sha256()
+        chunks = storage.read_range(file_hash, 0, size, chunk_size)
+        if encoding is not None:
+            chunks = Codec(encoding).decompress(chunks, chunk_size)
+        try:
+            for chunk in chunks:
+                digest.update(chunk)
+        except FileNotFoundError:
+            return "missing"
+        except (OSError, *DECOMPRESSION_ERRORS):
+            return "corrupt"
+        finally:
+            if io_budget > 0:
+                time.sleep(size / io_budget)
+        return "ok" if digest.hexdigest() == file_hash else "corrupt"
+
+    @staticmethod
+    def _verify_batch(
+        executor: ProcessPoolExecutor | None, blobs: list, io_budget: float
+    ) -> Iterator[tuple[str, str | None, str]]:
+        chunk_size = current_app.config["DOWNLOAD_CHUNK_SIZE"]
+        tasks = [
+            (file_hash, encoding, chunk_size, io_budget)
+            for file_hash, _, encoding in blobs
+        ]
+        if executor is None:
+            storage = FileSystemService.get_storage()
+            statuses = (ScrubService.verify_blob(storage, *task) for task in tasks)
+        else:
+            statuses = executor.map(_verify_in_worker, tasks, chunksize=16)
+        for (file_hash, _, encoding), status in zip(blobs, statuses):
+            yield file_hash, encoding, status
+
+    @staticmethod
+    @offloaded
+    def _confirm(file_hash: str, encoding: str | None, status: str) -> bool:
+        storage = FileSystemService.get_storage()
+        FileRepository.release_connection()
+        with FileSystemService.lock_hashes(file_hash):
+            if status == "orphan":
+                return not FileRepository.get_known_blobs(
+                    [file_hash]
+                ) and storage.exists(file_hash)
+            if not FileRepository.is_blob_referenced(file_hash):
+                return False
+            return (
+                ScrubService.verify_blob(
+                    storage,
+                    file_hash,
+                    encoding,
+                    current_app.config["DOWNLOAD_CHUNK_SIZE"],
+                )
+                == status
+            )
+
+    @staticmethod
+    @offloaded
+    def _repair(status: str, file_hash: str) -> bool:
+        if status == "missing":
+            return False
+        storage = FileSystemService.get_storage()
+        FileRepository.release_connection()
+        with FileSystemService.lock_hashes(file_hash):
+            try:
+                if status == "corrupt":
+                    ScrubService._quarantine(storage, file_hash)
+                storage.delete(file_hash)
+            except OSError as e:
+                current_app.logger.error(
+                    f"Failed to repair {status} blob {file_hash}: {str(e)}."
+                )
+                return False
+        metadata_cache.invalidate(file_hash)
+        hot_object_cache.discard(file_hash)
+        return True
+
+    @staticmethod
+    def _quarantine(storage: StorageBackend, file_hash: str) -> None:
+        quarantine_dir = os.path.join(
+            current_app.config["STORAGE_FOLDER"], ".quarantine"
+        )
+        os.makedirs(quarantine_dir, exist_ok=True)
+        size = storage.size(file_hash) or 0
+        with open(os.path.join(quarantine_dir, file_hash), "wb") as f:
+            for chunk in storage.read_range(
+                file_hash, 0, size, current_app.config["DOWNLOAD_CHUNK_SIZE"]
+            ):
+                f.write(chunk)
+
+    @staticmethod
+    def _load_checkpoint(path: str) -> dict:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    @staticmethod
+    def _save_checkpoint(path: str, state: dict) -> None:
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, path)
+
+
+def _init_worker(config: dict) -> None:
+    global _worker_storage
+    app = Flask(__name__)
+    app.config.update(config)
+    _worker_storage = create_storage(app)
+
+
+def _verify_in_worker(task: tuple) -> str:
+    return ScrubService.verify_blob(_worker_storage, *task)
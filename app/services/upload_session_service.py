@@ -0,0 +1,411 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from flask import current_app
+
+from app.concurrency import flock, offloaded, run_blocking
+from app.services.file_service import FileService
+from app.streaming import HashingTempFile
+
+UPLOAD_ID = re.compile(r"[0-9a-f]{32}")
+
+# The running hash of the committed prefix of each session, with the offset it has reached.
+# It is kept per worker process, since hash objects cannot be shared or saved.
+_hashes = {}
+
+
+class UploadSessionService:
+    """
+    Service class for resumable uploads, sent in chunks over several requests.
+
+    A session is created with the size of the upload, and its content is written to
+    `<STORAGE_FOLDER>/.uploads/<id>.part` at the offsets given by the client, in any order and
+    possibly in parallel. The ranges received so far are recorded in `<id>.json`, and the
+    committed offset is the end of the received range starting at 0: after a disconnect, the
+    client asks for it and sends the rest from there. Each worker hashes the committed prefix
+    as it grows, so finalizing an upload sent in order only hashes its last chunk, and the
+    finished file is moved into the store like a regular upload. Chunks being written are
+    recorded in the state, and the prefix is only hashed up to the first of them, since a
+    slower chunk may still overwrite bytes that a faster one has since committed.
+
+    Chunk writes hold `<id>.lock` shared, while finalizing, aborting and expiring a session
+    hold it exclusively, so a session never disappears under a chunk being written. Sessions
+    expire `UPLOAD_SESSION_TTL` seconds after their last chunk.
+    """
+
+    @staticmethod
+    def create(username: str, filename: str, size: int) -> dict:
+        """
+        Creates an upload session.
+
+        Args:
+            username (str): The owner of the session.
+            filename (str): The name of the uploaded file.
+            size (int): The size of the upload in bytes.
+
+        Returns:
+            dict: The `upload_id` of the session, its committed `offset`, its `size` and the
+                  unix time at which it `expires`.
+        """
+        upload_id = uuid.uuid4().hex
+        paths = UploadSessionService._paths(upload_id)
+        os.makedirs(os.path.dirname(paths["state"]), exist_ok=True)
+        open(paths["part"], "wb").close()
+        open(paths["lock"], "wb").close()
+        state = {
+            "username": username,
+            "filename": filename,
+            "size": size,
+            "ranges": [],
+            "writing": [],
+            "updated": time.time(),
+        }
+        with open(paths["state"], "w") as f:
+            json.dump(state, f)
+        return UploadSessionService._describe(upload_id, state)
+
+    @staticmethod
+    def get_session(upload_id: str, username: str) -> dict | None:
+        """
+        Returns the progress of an upload session.
+
+        Args:
+            upload_id (str): The identifier of the session.
+            username (str): The user asking, who must own the session.
+
+        Returns:
+            dict | None: The session as returned by `create`, or None if there is no such
+                         session for the user.
+        """
+        paths = UploadSessionService._paths(upload_id)
+        if paths is None:
+            return None
+        with UploadSessionService._state(paths, username, fcntl.LOCK_SH) as state:
+            if state is None:
+                return None
+            return UploadSessionService._describe(upload_id, state)
+
+    @staticmethod
+    def write_chunk(
+        upload_id: str, username: str, offset: int, stream
+    ) -> dict | None:
+        """
+        Writes a chunk of an upload at an offset.
+
+        The chunk is copied in pieces of `UPLOAD_CHUNK_SIZE` bytes. The bytes received before
+        the client disconnected, or before the chunk went past the end of the upload, are
+        kept, so the committed offset also advances within an interrupted chunk.
+
+        Args:
+            upload_id (str): The identifier of the session.
+            username (str): The user sending the chunk, who must own the session.
+            offset (int): The position of the chunk in the upload.
+            stream: A binary file-like object holding the chunk.
+
+        Returns:
+            dict | None: The session as returned by `create`, an error message if the chunk
+                         does not fit in the upload, or None if there is no such session for
+                         the user.
+        """
+        paths = UploadSessionService._paths(upload_id)
+        if paths is None:
+            return None
+        with UploadSessionService._lifecycle(paths, fcntl.LOCK_SH):
+            with UploadSessionService._state(
+                paths, username, fcntl.LOCK_EX, save=True
+            ) as state:
+                if state is None:
+                    return None
+                size = state["size"]
+                committed = UploadSessionService._committed_offset(state)
+                # Committed bytes may already be hashed, so they cannot be written again.
+                if not committed <= offset <= size:
+                    return {"error": "Offset is outside the upload.", "offset": committed}
+                token = uuid.uuid4().hex
+                state.setdefault("writing", []).append([token, offset])
+
+            position = offset
+            overflow = False
+            fd = os.open(paths["part"], os.O_WRONLY)
+            try:
+                while chunk := stream.read(current_app.config["UPLOAD_CHUNK_SIZE"]):
+                    if position + len(chunk) > size:
+                        chunk = chunk[: size - position]
+                        position += run_blocking(os.pwrite, fd, chunk, position)
+                        overflow = True
+                        break
+                    position += run_blocking(os.pwrite, fd, chunk, position)
+            finally:
+                os.close(fd)
+                state = UploadSessionService._record(
+                    upload_id, paths, username, token, offset, position
+                )
+        if state is None:
+            return None
+        if overflow:
+            return {
+                "error": "Chunk goes past the end of the upload.",
+                "offset": UploadSessionService._committed_offset(state),
+            }
+        return UploadSessionService._describe(upload_id, state)
+
+    @staticmethod
+    def complete(
+        upload_id: str, username: str, expected_hash: str | None = None
+    ) -> dict | None:
+        """
+        Finalizes an upload session and stores the uploaded file.
+
+        The session is removed unless the upload is incomplete, in which case the client can
+        still send the missing chunks.
+
+        Args:
+            upload_id (str): The identifier of the session.
+            username (str): The user finalizing the upload, who must own the session.
+            expected_hash (str, optional): The SHA-256 the client computed for the upload.
+
+        Returns:
+            dict | None: The result of `FileService.save_upload`, an error message with the
+                         committed `offset` if the upload is incomplete, or None if there is no
+                         such session for the user.
+        """
+        paths = UploadSessionService._paths(upload_id)
+        if paths is None:
+            return None
+        with UploadSessionService._lifecycle(paths, fcntl.LOCK_EX):
+            with UploadSessionService._state(paths, username, fcntl.LOCK_EX) as state:
+                if state is None:
+                    return None
+                offset = UploadSessionService._committed_offset(state)
+                if offset < state["size"]:
+                    return {"error": "Upload is incomplete.", "offset": offset}
+                digest = UploadSessionService._advance_hash(
+                    upload_id, paths, state["size"]
+                )
+
+            _hashes.pop(upload_id, None)
+            if expected_hash is not None and digest.hexdigest() != expected_hash:
+                UploadSessionService._remove(paths)
+                return {"error": "Checksum mismatch."}
+
+            temp_file = HashingTempFile.from_file(paths["part"], digest)
+            result = FileService.save_upload(temp_file, state["filename"], username)
+            UploadSessionService._remove(paths)
+        return result
+
+    @staticmethod
+    def abort(upload_id: str, username: str) -> bool:
+        """
+        Removes an upload session and the content received so far.
+
+        Args:
+            upload_id (str): The identifier of the session.
+            username (str): The user aborting the upload, who must own the session.
+
+        Returns:
+            bool: True if the session was removed, False if there is no such session for the user.
+        """
+        paths = UploadSessionService._paths(upload_id)
+        if paths is None:
+            return False
+        with UploadSessionService._lifecycle(paths, fcntl.LOCK_EX):
+            with UploadSessionService._state(paths, username, fcntl.LOCK_SH) as state:
+                if state is None:
+                    return False
+            _hashes.pop(upload_id, None)
+            UploadSessionService._remove(paths)
+        return True
+
+    @staticmethod
+    def collect_expired() -> int:
+        """
+        Removes the upload sessions that received no chunk for `UPLOAD_SESSION_TTL` seconds.
+
+        Sessions with a chunk being written are left for the next run.
+
+        Returns:
+            int: The number of sessions removed.
+        """
+        directory = UploadSessionService._directory()
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return 0
+
+        removed = 0
+        now = time.time()
+        ttl = current_app.config["UPLOAD_SESSION_TTL"]
+        for name in names:
+            upload_id, extension = os.path.splitext(name)
+            if not UPLOAD_ID.fullmatch(upload_id):
+                continue
+            paths = UploadSessionService._paths(upload_id)
+            if extension != ".json":
+                # Leftovers of sessions interrupted while being created or removed.
+                UploadSessionService._remove_leftover(paths, extension, now - ttl)
+                continue
+            try:
+                with UploadSessionService._lifecycle(
+                    paths, fcntl.LOCK_EX | fcntl.LOCK_NB
+                ):
+                    with UploadSessionService._state(
+                        paths, None, fcntl.LOCK_SH
+                    ) as state:
+                        if state is None or state["updated"] > now - ttl:
+                            continue
+                    UploadSessionService._remove(paths)
+            except BlockingIOError:
+                continue
+            removed += 1
+
+        for upload_id in list(_hashes):
+            if not os.path.exists(UploadSessionService._paths(upload_id)["state"]):
+                _hashes.pop(upload_id, None)
+        if removed:
+            current_app.logger.info(f"Removed {removed} expired upload sessions.")
+        return removed
+
+    @staticmethod
+    def _record(
+        upload_id: str, paths: dict, username: str, token: str, start: int, stop: int
+    ) -> dict | None:
+        # Merges the range written by a chunk and hashes the committed prefix if it grew,
+        # up to the first chunk still being written.
+        with UploadSessionService._state(
+            paths, username, fcntl.LOCK_EX, save=True
+        ) as state:
+            if state is None:
+                return None
+            writing = [
+                entry for entry in state.get("writing", []) if entry[0] != token
+            ]
+            state["writing"] = writing
+            if stop > start:
+                ranges = sorted(state["ranges"] + [[start, stop]])
+                merged = [ranges[0]]
+                for range_start, range_stop in ranges[1:]:
+                    if range_start <= merged[-1][1]:
+                        merged[-1][1] = max(merged[-1][1], range_stop)
+                    else:
+                        merged.append([range_start, range_stop])
+                state["ranges"] = merged
+            state["updated"] = time.time()
+            UploadSessionService._advance_hash(
+                upload_id,
+                paths,
+                min(
+                    [UploadSessionService._committed_offset(state)]
+                    + [entry[1] for entry in writing]
+                ),
+            )
+            return state
+
+    @staticmethod
+    @offloaded
+    def _advance_hash(upload_id: str, paths: dict, offset: int):
+        # Called with the state locked exclusively, so that one thread at a time advances it.
+        digest, hashed = _hashes.get(upload_id) or (hashlib.sha256(), 0)
+        chunk_size = current_app.config["UPLOAD_CHUNK_SIZE"]
+        with open(paths["part"], "rb") as f:
+            f.seek(hashed)
+            while hashed < offset:
+                chunk = f.read(min(chunk_size, offset - hashed))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                hashed += len(chunk)
+        _hashes[upload_id] = (digest, hashed)
+        return digest
+
+    @staticmethod
+    def _committed_offset(state: dict) -> int:
+        ranges = state["ranges"]
+        return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+    @staticmethod
+    def _describe(upload_id: str, state: dict) -> dict:
+        return {
+            "upload_id": upload_id,
+            "offset": UploadSessionService._committed_offset(state),
+            "size": state["size"],
+            "expires": state["updated"] + current_app.config["UPLOAD_SESSION_TTL"],
+        }
+
+    @staticmethod
+    @contextmanager
+    def _lifecycle(paths: dict, operation: int) -> Iterator[None]:
+        try:
+            lock_file = open(paths["lock"], "rb")
+        except FileNotFoundError:
+            # The session is gone; reading its state reports it.
+            yield
+            return
+        with lock_file:
+            flock(lock_file, operation)
+            yield
+
+    @staticmethod
+    @contextmanager
+    def _state(
+        paths: dict, username: str | None, operation: int, save: bool = False
+    ) -> Iterator[dict | None]:
+        # The state is rewritten in place, so that its lock stays on the same file.
+        try:
+            state_file = open(paths["state"], "r+")
+        except FileNotFoundError:
+            yield None
+            return
+        with state_file:
+            flock(state_file, operation)
+            try:
+                state = json.load(state_file)
+            except ValueError:
+                state = None
+            if state is not None and username not in (None, state["username"]):
+                state = None
+            yield state
+            if save and state is not None:
+                state_file.seek(0)
+                json.dump(state, state_file)
+                state_file.truncate()
+
+    @staticmethod
+    def _remove(paths: dict) -> None:
+        for path in (paths["state"], paths["part"], paths["lock"]):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _remove_leftover(paths: dict, extension: str, cutoff: float) -> None:
+        path = paths[{".part": "part", ".lock": "lock"}.get(extension, "state")]
+        if os.path.exists(paths["state"]) or path == paths["state"]:
+            return
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _directory() -> str:
+        return os.path.join(current_app.config["STORAGE_FOLDER"], ".uploads")
+
+    @staticmethod
+    def _paths(upload_id: str) -> dict | None:
+        if not UPLOAD_ID.fullmatch(upload_id):
+            return None
+        base = os.path.join(UploadSessionService._directory(), upload_id)
+        return {
+            "state": f"{base}.json",
+            "part": f"{base}.part",
+            "lock": f"{base}.lock",
+        }
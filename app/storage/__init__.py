@@ -0,0 +1,114 @@
+import os
+from collections.abc import Iterator
+
+from flask import Flask
+
+from app.storage.base import StorageBackend
+from app.storage.chunked import ChunkedStorage
+from app.storage.durability import Durability
+from app.storage.local import LocalStorage, ShardLayout, parse_shard_layout
+from app.storage.locks import HashLocks
+from app.storage.pack import PackStorage
+from app.storage.s3 import S3Storage
+
+
+def create_storage(app: Flask) -> StorageBackend:
+    """
+    Creates the storage backend selected by the `STORAGE_BACKEND` setting.
+
+    When `STORAGE_CHUNKING` is set, new blobs are split into chunks that are stored with
+    that backend in the `chunks` subfolder, while blobs stored as a whole stay readable.
+
+    Args:
+        app (Flask): The application whose configuration is used.
+
+    Raises:
+        ValueError: If the configured backend is unknown.
+
+    Returns:
+        StorageBackend: The storage backend.
+    """
+    root = app.config["STORAGE_FOLDER"]
+    durability = Durability(
+        app.config["STORAGE_DURABILITY"], app.config["STORAGE_GROUP_SYNC_WINDOW"]
+    )
+    storage = _create_backend(app, root, durability)
+    if not app.config["STORAGE_CHUNKING"]:
+        return storage
+    return ChunkedStorage(
+        root,
+        _create_backend(app, os.path.join(root, "chunks"), durability),
+        storage,
+        app.config["CHUNK_MIN_SIZE"],
+        app.config["CHUNK_AVG_SIZE"],
+        app.config["CHUNK_MAX_SIZE"],
+        durability,
+    )
+
+
+def iter_backends(storage: StorageBackend) -> Iterator[StorageBackend]:
+    """
+    Yields a backend and every backend nested in it.
+
+    Args:
+        storage (StorageBackend): The outermost backend.
+
+    Returns:
+        Iterator[StorageBackend]: The backends, outermost first.
+    """
+    yield storage
+    for child in storage.children():
+        yield from iter_backends(child)
+
+
+def _create_backend(app: Flask, root: str, durability: Durability) -> StorageBackend:
+    backend = app.config["STORAGE_BACKEND"]
+    files = LocalStorage(
+        root,
+        (app.config["SHARD_DEPTH"], app.config["SHARD_WIDTH"]),
+        parse_shard_layout(app.config["SHARD_FALLBACK_LAYOUT"]),
+        durability,
+    )
+    if backend == "local":
+        return files
+    if backend == "pack":
+        return PackStorage(
+            root,
+            app.config["PACK_MAX_OBJECT_SIZE"],
+            app.config["PACK_MAX_SIZE"],
+            app.config["PACK_COMPACT_RATIO"],
+            files,
+            durability,
+        )
+    if backend == "s3":
+        # Nested backends, such as the chunks of chunked storage, get a prefix of their own.
+        folder = os.path.relpath(root, app.config["STORAGE_FOLDER"])
+        return S3Storage(
+            root,
+            app.config["S3_BUCKET"],
+            app.config["S3_PREFIX"] + ("" if folder == "." else f"{folder}/"),
+            app.config["S3_ENDPOINT_URL"],
+            app.config["S3_REGION"],
+            app.config["S3_ADDRESSING_STYLE"],
+            app.config["S3_MAX_POOL_CONNECTIONS"],
+            app.config["S3_MULTIPART_THRESHOLD"],
+            app.config["S3_MULTIPART_CHUNK_SIZE"],
+            app.config["S3_CACHE_MAX_BYTES"],
+            app.config["S3_CACHE_MAX_OBJECT_SIZE"],
+        )
+    raise ValueError(f"Unknown storage backend: {backend}.")
+
+
+__all__ = [
+    "ChunkedStorage",
+    "Durability",
+    "HashLocks",
+    "LocalStorage",
+    "PackStorage",
+    "S3Storage",
+    "ShardLayout",
+    "StorageBackend",
+    "create_storage",
+    "iter_backends",
+    "parse_shard_layout",
+]
@@ -0,0 +1,155 @@
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+
+
+class StorageBackend(ABC):
+    """
+    Interface of the engines that hold file content, addressed by its hash.
+
+    `FileSystemService` delegates every content operation to the backend selected by the
+    `STORAGE_BACKEND` setting, so the rest of the application does not depend on how blobs
+    are laid out.
+    """
+
+    @abstractmethod
+    def get_file_path(self, file_hash: str) -> str:
+        """
+        Returns the path under which the content is stored as a standalone file.
+
+        Args:
+            file_hash (str): The hash of the content.
+
+        Returns:
+            str: The path of the standalone file, whether or not it exists.
+        """
+
+    @abstractmethod
+    def exists(self, file_hash: str) -> bool:
+        """
+        Checks if the content is stored.
+
+        Args:
+            file_hash (str): The hash of the content.
+
+        Returns:
+            bool: True if the content is stored, False otherwise.
+        """
+
+    @abstractmethod
+    def size(self, file_hash: str) -> int | None:
+        """
+        Returns the size of the stored content.
+
+        Args:
+            file_hash (str): The hash of the content.
+
+        Returns:
+            int | None: The size in bytes, or None if the content is not stored.
+        """
+
+    @abstractmethod
+    def store(self, source_path: str, file_hash: str, size: int) -> None:
+        """
+        Moves a finished temporary file into the store.
+
+        The source file is consumed: it is either renamed into place or removed once its
+        content has been copied. Readers never observe partially stored content.
+
+        Args:
+            source_path (str): The path of the temporary file, on the store's filesystem.
+            file_hash (str): The hash of the content.
+            size (int): The size of the content in bytes.
+
+        Raises:
+            OSError: If the content could not be stored.
+
+        Returns:
+            None
+        """
+
+    @abstractmethod
+    def delete(self, file_hash: str) -> None:
+        """
+        Removes the content from the store if it is present.
+
+        Args:
+            file_hash (str): The hash of the content.
+
+        Raises:
+            OSError: If the content could not be removed.
+
+        Returns:
+            None
+        """
+
+    @abstractmethod
+    def read_range(
+        self, file_hash: str, start: int, stop: int, chunk_size: int
+    ) -> Iterator[bytes]:
+        """
+        Streams a byte range of the content.
+
+        Args:
+            file_hash (str): The hash of the content.
+            start (int): The offset of the first byte.
+            stop (int): The offset after the last byte.
+            chunk_size (int): The maximum size of each yielded chunk.
+
+        Raises:
+            OSError: If the content cannot be read.
+
+        Returns:
+            Iterator[bytes]: The chunks of the range.
+        """
+
+    @abstractmethod
+    def iter_hashes(self) -> Iterator[str]:
+        """
+        Streams the hashes of every content in the store.
+
+        A content may be listed twice, for instance while it is being moved between two
+        locations, and content stored or deleted during the iteration may or may not be listed.
+
+        Returns:
+            Iterator[str]: The hashes of the stored content.
+        """
+
+    def local_path(self, file_hash: str) -> str | None:
+        """
+        Returns the path of a plain file holding exactly the content, if there is one.
+
+        Such a file can be handed to the front proxy or to `sendfile`.
+
+        Args:
+            file_hash (str): The hash of the content.
+
+        Returns:
+            str | None: The path of the file, or None if the content is not stored as a plain file.
+        """
+        return None
+
+    def children(self) -> list["StorageBackend"]:
+        """
+        Returns the backends this backend delegates part of the content to.
+
+        Returns:
+            list[StorageBackend]: The nested backends, empty if there are none.
+        """
+        return []
+
+    def maintenance(self) -> None:
+        """
+        Runs the backend's periodic housekeeping, such as reclaiming space.
+
+        Returns:
+            None
+        """
+
+    def stats(self) -> dict:
+        """
+        Returns the backend's usage statistics.
+
+        Returns:
+            dict: Backend-specific counters, empty if the backend keeps none.
+        """
+        return {}
@@ -0,0 +1,330 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+from app.chunking import iter_chunks
+from app.concurrency import native_local
+from app.storage.base import StorageBackend
+from app.storage.durability import Durability
+
+
+class ChunkedStorage(StorageBackend):
+    """
+    Storage backend splitting blobs into content-defined chunks stored once each.
+
+    Every blob is split with `iter_chunks`, each distinct chunk is stored under its own
+    SHA-256 in the `chunks` backend, and the blob is recorded as an ordered manifest of chunk
+    hashes in a SQLite index, `<root>/.meta/chunks.sqlite`, together with a reference count
+    per chunk. Near-identical blobs, such as successive builds or dumps, thus share most of
+    their chunks. Reads reassemble the requested range from the chunks as a stream. Blobs
+    stored before chunking was enabled are still read from the `legacy` backend.
+
+    Reference counts are changed in `BEGIN IMMEDIATE` transactions, and unreferenced chunks
+    are removed before the transaction commits, so a concurrent store either sees the chunk
+    row and keeps the chunk alive, or sees it gone and writes the chunk again. New chunks are
+    written before that transaction, so that stores only hold the index lock briefly; the
+    chunks of a store that fails before committing are removed by `collect_orphans`.
+
+    Attributes:
+        root (str): The storage folder.
+        chunks (StorageBackend): The backend holding the chunks.
+        legacy (StorageBackend): The backend holding blobs stored as a whole.
+        min_size (int): The minimum size of a chunk.
+        avg_size (int): The target average size of a chunk.
+        max_size (int): The maximum size of a chunk.
+        durability (Durability): The policy deciding whether index commits are flushed.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        chunks: StorageBackend,
+        legacy: StorageBackend,
+        min_size: int,
+        avg_size: int,
+        max_size: int,
+        durability: Durability | None = None,
+    ):
+        self.root = root
+        self.chunks = chunks
+        self.legacy = legacy
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        self.durability = durability or Durability()
+        self._temp_dir = os.path.join(root, ".tmp")
+        self._index_path = os.path.join(root, ".meta", "chunks.sqlite")
+        self._local = native_local()
+
+        os.makedirs(os.path.dirname(self._index_path), exist_ok=True)
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "hash TEXT PRIMARY KEY, size INTEGER NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS manifest ("
+                "file_hash TEXT NOT NULL, position INTEGER NOT NULL, "
+                "chunk_hash TEXT NOT NULL, offset INTEGER NOT NULL, "
+                "length INTEGER NOT NULL, PRIMARY KEY (file_hash, position)"
+                ") WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "hash TEXT PRIMARY KEY, length INTEGER NOT NULL, "
+                "refcount INTEGER NOT NULL"
+                ") WITHOUT ROWID"
+            )
+
+    def get_file_path(self, file_hash: str) -> str:
+        return self.legacy.get_file_path(file_hash)
+
+    def exists(self, file_hash: str) -> bool:
+        return self._file_size(file_hash) is not None or self.legacy.exists(file_hash)
+
+    def size(self, file_hash: str) -> int | None:
+        size = self._file_size(file_hash)
+        if size is not None:
+            return size
+        return self.legacy.size(file_hash)
+
+    def store(self, source_path: str, file_hash: str, size: int) -> None:
+        manifest = []
+        written = set()
+        total = 0
+        # The chunks of a blob that is already indexed would not be referenced.
+        indexed = self._file_size(file_hash) is not None
+        with open(source_path, "rb") as source:
+            for data in iter_chunks(
+                source, self.min_size, self.avg_size, self.max_size
+            ):
+                chunk_hash = hashlib.sha256(data).hexdigest()
+                if (
+                    not indexed
+                    and chunk_hash not in written
+                    and not self.chunks.exists(chunk_hash)
+                ):
+                    self._store_chunk(chunk_hash, data)
+                    written.add(chunk_hash)
+                manifest.append((chunk_hash, total, len(data)))
+                total += len(data)
+
+        with self._transaction() as connection:
+            if self._file_size(file_hash) is None:
+                self._reference_chunks(connection, manifest, source_path)
+                connection.executemany(
+                    "INSERT INTO manifest "
+                    "(file_hash, position, chunk_hash, offset, length) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (
+                        (file_hash, position, chunk_hash, offset, length)
+                        for position, (chunk_hash, offset, length) in enumerate(
+                            manifest
+                        )
+                    ),
+                )
+                connection.execute(
+                    "INSERT INTO files (hash, size) VALUES (?, ?)", (file_hash, total)
+                )
+        os.remove(source_path)
+
+    def delete(self, file_hash: str) -> None:
+        with self._transaction() as connection:
+            counts = connection.execute(
+                "SELECT chunk_hash, COUNT(*) FROM manifest "
+                "WHERE file_hash = ? GROUP BY chunk_hash",
+                (file_hash,),
+            ).fetchall()
+            for chunk_hash, count in counts:
+                connection.execute(
+                    "UPDATE chunks SET refcount = refcount - ? WHERE hash = ?",
+                    (count, chunk_hash),
+                )
+                refcount = connection.execute(
+                    "SELECT refcount FROM chunks WHERE hash = ?", (chunk_hash,)
+                ).fetchone()
+                if refcount is not None and refcount[0] <= 0:
+                    connection.execute(
+                        "DELETE FROM chunks WHERE hash = ?", (chunk_hash,)
+                    )
+                    self.chunks.delete(chunk_hash)
+            connection.execute(
+                "DELETE FROM manifest WHERE file_hash = ?", (file_hash,)
+            )
+            connection.execute("DELETE FROM files WHERE hash = ?", (file_hash,))
+        self.legacy.delete(file_hash)
+
+    def read_range(
+        self, file_hash: str, start: int, stop: int, chunk_size: int
+    ) -> Iterator[bytes]:
+        if self._file_size(file_hash) is None:
+            yield from self.legacy.read_range(file_hash, start, stop, chunk_size)
+            return
+
+        rows = (
+            self._connection()
+            .execute(
+                "SELECT chunk_hash, offset, length FROM manifest "
+                "WHERE file_hash = ? AND offset < ? AND offset + length > ? "
+                "ORDER BY position",
+                (file_hash, stop, start),
+            )
+            .fetchall()
+        )
+        for chunk_hash, offset, length in rows:
+            yield from self.chunks.read_range(
+                chunk_hash,
+                max(start - offset, 0),
+                min(stop - offset, length),
+                chunk_size,
+            )
+
+    def iter_hashes(self) -> Iterator[str]:
+        after = ""
+        while rows := (
+            self._connection()
+            .execute(
+                "SELECT hash FROM files WHERE hash > ? ORDER BY hash LIMIT 1000",
+                (after,),
+            )
+            .fetchall()
+        ):
+            for (after,) in rows:
+                yield after
+        yield from self.legacy.iter_hashes()
+
+    def local_path(self, file_hash: str) -> str | None:
+        if self._file_size(file_hash) is not None:
+            return None
+        return self.legacy.local_path(file_hash)
+
+    def children(self) -> list[StorageBackend]:
+        return [self.chunks, self.legacy]
+
+    def maintenance(self) -> None:
+        self.collect_orphans()
+        self.chunks.maintenance()
+        self.legacy.maintenance()
+
+    def collect_orphans(self) -> int:
+        """
+        Removes the stored chunks that have no row in the index.
+
+        Such chunks are left behind by stores that failed or were interrupted between writing
+        their chunks and committing the manifest. Each one is checked again and removed in an
+        index transaction, so a concurrent store that wrote the same chunk either committed
+        its row first, or finds the chunk gone in its own transaction and writes it again.
+
+        Returns:
+            int: The number of chunks removed.
+        """
+        removed = 0
+        connection = self._connection()
+        query = "SELECT 1 FROM chunks WHERE hash = ?"
+        for chunk_hash in self.chunks.iter_hashes():
+            if connection.execute(query, (chunk_hash,)).fetchone() is not None:
+                continue
+            with self._transaction() as connection:
+                if connection.execute(query, (chunk_hash,)).fetchone() is None:
+                    self.chunks.delete(chunk_hash)
+                    removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        """
+        Returns how much content is stored and how much space its chunks take.
+
+        Returns:
+            dict: The `files`, `file_bytes`, `chunks` and `chunk_bytes` counters.
+        """
+        connection = self._connection()
+        files, file_bytes = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files"
+        ).fetchone()
+        chunks, chunk_bytes = connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks"
+        ).fetchone()
+        return {
+            "files": files,
+            "file_bytes": file_bytes,
+            "chunks": chunks,
+            "chunk_bytes": chunk_bytes,
+            **self.chunks.stats(),
+        }
+
+    def _reference_chunks(
+        self,
+        connection: sqlite3.Connection,
+        manifest: list[tuple[str, int, int]],
+        source_path: str,
+    ) -> None:
+        locations = {
+            chunk_hash: (offset, length) for chunk_hash, offset, length in manifest
+        }
+        for chunk_hash, count in Counter(row[0] for row in manifest).items():
+            updated = connection.execute(
+                "UPDATE chunks SET refcount = refcount + ? WHERE hash = ?",
+                (count, chunk_hash),
+            ).rowcount
+            if updated:
+                continue
+            offset, length = locations[chunk_hash]
+            connection.execute(
+                "INSERT INTO chunks (hash, length, refcount) VALUES (?, ?, ?)",
+                (chunk_hash, length, count),
+            )
+            # The chunk may have been removed by a delete that committed meanwhile.
+            if not self.chunks.exists(chunk_hash):
+                with open(source_path, "rb") as source:
+                    source.seek(offset)
+                    self._store_chunk(chunk_hash, source.read(length))
+
+    def _store_chunk(self, chunk_hash: str, data: bytes) -> None:
+        os.makedirs(self._temp_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=self._temp_dir, prefix="chunk-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            self.chunks.store(path, chunk_hash, len(data))
+        except OSError:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _file_size(self, file_hash: str) -> int | None:
+        row = (
+            self._connection()
+            .execute("SELECT size FROM files WHERE hash = ?", (file_hash,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self._index_path, timeout=30, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            if self.durability.mode != "none":
+                connection.execute("PRAGMA synchronous=FULL")
+            self._local.connection = connection
+        return connection
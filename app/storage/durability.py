@@ -0,0 +1,105 @@
+import os
+from collections.abc import Iterable
+
+from app.concurrency import native_lock
+
+MODES = ("none", "fsync", "group")
+
+
+class Durability:
+    """
+    Flushes stored files and directory entries to disk according to a durability mode.
+
+    In "none" mode nothing is flushed and durability is left to the operating system. In
+    "fsync" mode every call flushes its paths immediately. In "group" mode the first caller
+    waits `window` seconds, then flushes the paths of every caller that joined it meanwhile
+    with one fsync per distinct path, and wakes them all up, so concurrent uploads share
+    their directory fsyncs and pay the disk latency once. Batches are per process. Like
+    the metadata writer, groups wait on native locks, which the threads of the gevent pool
+    can release for each other, so callers must not run in the hub.
+
+    Attributes:
+        mode (str): The durability mode, "none", "fsync" or "group".
+        window (float): The number of seconds a group waits for more paths.
+    """
+
+    def __init__(self, mode: str = "none", window: float = 0.002):
+        if mode not in MODES:
+            raise ValueError(f"Unknown durability mode: {mode}.")
+        self.mode = mode
+        self.window = window
+        self.batches = 0
+        self.fsyncs = 0
+        self._lock = native_lock()
+        self._batch = None
+
+    def sync(self, paths: Iterable[str]) -> None:
+        """
+        Flushes files or directories to disk, returning once they are durable.
+
+        Args:
+            paths (Iterable[str]): The files and directories to flush.
+
+        Raises:
+            OSError: If a path could not be flushed.
+
+        Returns:
+            None
+        """
+        if self.mode == "none":
+            return
+        if self.mode == "fsync":
+            self._flush(set(paths))
+            return
+
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            batch.paths.update(paths)
+
+        if leader:
+            batch.window.acquire(timeout=self.window)
+            with self._lock:
+                self._batch = None
+            try:
+                self._flush(batch.paths)
+            except OSError as e:
+                batch.error = e
+            batch.done.release()
+        else:
+            # Each follower passes the wake-up on to the next one.
+            batch.done.acquire()
+            batch.done.release()
+        if batch.error is not None:
+            raise batch.error
+
+    def stats(self) -> dict:
+        """
+        Returns the number of flushes performed by this process.
+
+        Returns:
+            dict: The durability `mode` and the `batches` and `fsyncs` counters.
+        """
+        return {"mode": self.mode, "batches": self.batches, "fsyncs": self.fsyncs}
+
+    def _flush(self, paths: set[str]) -> None:
+        self.batches += 1
+        for path in paths:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self.fsyncs += 1
+
+
+class _Batch:
+    def __init__(self):
+        self.paths = set()
+        self.window = native_lock()
+        self.window.acquire()
+        self.done = native_lock()
+        self.done.acquire()
+        self.error = None
@@ -0,0 +1,215 @@
+import os
+import string
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO
+
+from app.storage.base import StorageBackend
+from app.storage.durability import Durability
+
+ShardLayout = tuple[int, int]
+
+
+def parse_shard_layout(value: str) -> ShardLayout | None:
+    """
+    Parses a shard layout written as `<depth>:<width>`, for instance "2:2" for `ab/cd/<hash>`.
+
+    Args:
+        value (str): The layout to parse, or an empty string.
+
+    Raises:
+        ValueError: If the value is not a valid layout.
+
+    Returns:
+        ShardLayout | None: The depth and width of the layout, or None for an empty value.
+    """
+    if not value:
+        return None
+    depth, _, width = value.partition(":")
+    layout = (int(depth), int(width))
+    if layout[0] < 0 or layout[1] < 1:
+        raise ValueError(f"Invalid shard layout: {value}.")
+    return layout
+
+
+class LocalStorage(StorageBackend):
+    """
+    Storage backend keeping each blob as a standalone file under the storage folder.
+
+    Files are sharded into `depth` levels of directories named after consecutive `width`
+    character prefixes of the hash, so the default layout (1, 2) gives `<root>/ab/<hash>`
+    and (2, 2) gives `<root>/ab/cd/<hash>`. While blobs are being moved to a new layout
+    with `reshard`, lookups that miss in the current layout fall back to the previous one.
+
+    A blob only appears under its final name through an atomic rename of a complete
+    temporary file. Depending on `durability`, the file is flushed before the rename and
+    its directory after it, so that after a crash a blob is either complete or absent.
+
+    Attributes:
+        root (str): The storage folder.
+        layout (ShardLayout): The depth and width of the current layout.
+        fallback (ShardLayout | None): The layout blobs are being moved from, if any.
+        durability (Durability): The policy used to flush stored blobs to disk.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        layout: ShardLayout = (1, 2),
+        fallback: ShardLayout | None = None,
+        durability: Durability | None = None,
+    ):
+        self.root = root
+        self.layout = layout
+        self.fallback = fallback if fallback != layout else None
+        self.durability = durability or Durability()
+
+    def get_file_path(self, file_hash: str) -> str:
+        return self._layout_path(file_hash, self.layout)
+
+    def exists(self, file_hash: str) -> bool:
+        return self._find(file_hash) is not None
+
+    def size(self, file_hash: str) -> int | None:
+        try:
+            with self._open(file_hash) as f:
+                return os.fstat(f.fileno()).st_size
+        except FileNotFoundError:
+            return None
+
+    def store(self, source_path: str, file_hash: str, size: int) -> None:
+        file_path = self.get_file_path(file_hash)
+        directories = [os.path.dirname(file_path)]
+        while not os.path.isdir(directories[-1]):
+            directories.append(os.path.dirname(directories[-1]))
+        os.makedirs(directories[0], exist_ok=True)
+        self.durability.sync([source_path])
+        os.replace(source_path, file_path)
+        self.durability.sync(directories)
+
+    def delete(self, file_hash: str) -> None:
+        # The previous location goes first: a concurrent reshard either already moved
+        # the file, which is then removed from the current location, or cannot move it.
+        for layout in (self.fallback, self.layout):
+            if layout is None:
+                continue
+            try:
+                os.remove(self._layout_path(file_hash, layout))
+            except FileNotFoundError:
+                pass
+
+    def read_range(
+        self, file_hash: str, start: int, stop: int, chunk_size: int
+    ) -> Iterator[bytes]:
+        with self._open(file_hash) as f:
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def iter_hashes(self) -> Iterator[str]:
+        for layout in (self.layout, self.fallback):
+            if layout is not None and os.path.isdir(self.root):
+                yield from self._iter_shard(self.root, layout, 0)
+
+    def local_path(self, file_hash: str) -> str | None:
+        return self._find(file_hash)
+
+    def reshard(self, source: ShardLayout, workers: int = 8) -> int:
+        """
+        Moves every blob stored in another layout to the current one.
+
+        Top-level shard directories are processed in parallel and each blob is moved with an
+        atomic rename, so the service can keep running as long as `source` is configured as
+        its fallback layout.
+
+        Args:
+            source (ShardLayout): The layout to move blobs from.
+            workers (int): The number of shard directories processed at once.
+
+        Returns:
+            int: The number of blobs moved.
+        """
+        if source == self.layout or not os.path.isdir(self.root):
+            return 0
+        if source[0] == 0:
+            return self._move_shard(self.root, source, 0)
+        shards = [
+            entry.path
+            for entry in os.scandir(self.root)
+            if entry.is_dir() and self._is_shard_name(entry.name, source)
+        ]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return sum(
+                executor.map(lambda shard: self._move_shard(shard, source, 1), shards)
+            )
+
+    def _move_shard(self, directory: str, source: ShardLayout, level: int) -> int:
+        moved = 0
+        for entry in os.scandir(directory):
+            if entry.is_dir():
+                if level < source[0] and self._is_shard_name(entry.name, source):
+                    moved += self._move_shard(entry.path, source, level + 1)
+            elif level == source[0] and entry.path == self._layout_path(
+                entry.name, source
+            ):
+                target = self.get_file_path(entry.name)
+                if target == entry.path:
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                try:
+                    os.replace(entry.path, target)
+                    moved += 1
+                except FileNotFoundError:
+                    pass
+        return moved
+
+    def _iter_shard(
+        self, directory: str, layout: ShardLayout, level: int
+    ) -> Iterator[str]:
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            if level < layout[0]:
+                if entry.is_dir() and self._is_shard_name(entry.name, layout):
+                    yield from self._iter_shard(entry.path, layout, level + 1)
+            elif (
+                entry.is_file()
+                and len(entry.name) == 64
+                and entry.path == self._layout_path(entry.name, layout)
+                and all(c in string.hexdigits for c in entry.name)
+            ):
+                yield entry.name
+
+    def _find(self, file_hash: str) -> str | None:
+        file_path = self.get_file_path(file_hash)
+        if os.path.isfile(file_path):
+            return file_path
+        if self.fallback is None:
+            return None
+        previous_path = self._layout_path(file_hash, self.fallback)
+        if os.path.isfile(previous_path):
+            return previous_path
+        # The file may have been moved between the two checks.
+        return file_path if os.path.isfile(file_path) else None
+
+    def _open(self, file_hash: str) -> BinaryIO:
+        file_path = self._find(file_hash) or self.get_file_path(file_hash)
+        try:
+            return open(file_path, "rb")
+        except FileNotFoundError:
+            # A concurrent reshard moved the file after it was found.
+            if self.fallback is None:
+                raise
+            return open(self.get_file_path(file_hash), "rb")
+
+    def _layout_path(self, file_hash: str, layout: ShardLayout) -> str:
+        depth, width = layout
+        shards = [file_hash[i * width : (i + 1) * width] for i in range(depth)]
+        return os.path.join(self.root, *shards, file_hash)
+
+    @staticmethod
+    def _is_shard_name(name: str, layout: ShardLayout) -> bool:
+        return len(name) == layout[1] and all(c in string.hexdigits for c in name)
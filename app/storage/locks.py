@@ -0,0 +1,74 @@
+import fcntl
+import os
+from collections.abc import Iterable, Iterator
+from contextlib import ExitStack, contextmanager
+
+from sqlalchemy import Engine, text
+
+from app.concurrency import flock
+
+
+class HashLocks:
+    """
+    Exclusive per-hash locks shared by every thread and worker process using the store.
+
+    Each hash maps to one of 4096 lock files, `<root>/<prefix>.lock`, named after the first
+    three characters of the hash, which are locked with `flock`. Since `flock` locks belong to
+    the open file rather than to the process, two threads of the same worker exclude each
+    other just like two workers do. Hashes sharing a prefix share a lock, which keeps the
+    number of lock files bounded at the cost of rarely serialising unrelated hashes.
+
+    Lock files only exclude holders on the same host. When an `engine` is given, as it is for a
+    PostgreSQL database shared by several nodes, each hash is also locked with a session-level
+    advisory lock on a connection of its own, so that nodes sharing the database and the store
+    exclude each other as well. Advisory locks are used rather than transaction-level ones
+    because the writes they protect are committed by another session.
+
+    Attributes:
+        root (str): The folder holding the lock files.
+        engine (Engine | None): The PostgreSQL engine holding the advisory locks, if any.
+    """
+
+    def __init__(self, root: str, engine: Engine | None = None):
+        self.root = root
+        self.engine = engine
+        os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def hold(self, file_hashes: Iterable[str]) -> Iterator[None]:
+        """
+        Holds the locks of several hashes until the block exits.
+
+        Lock files, then advisory locks, are acquired in sorted order, so callers locking
+        overlapping sets of hashes cannot deadlock each other, and each lock is acquired only
+        once.
+
+        Args:
+            file_hashes (Iterable[str]): The hashes to lock.
+
+        Returns:
+            Iterator[None]: A context manager holding the locks.
+        """
+        file_hashes = set(file_hashes)
+        with ExitStack() as stack:
+            for prefix in sorted({file_hash[:3] for file_hash in file_hashes}):
+                lock_file = stack.enter_context(
+                    open(os.path.join(self.root, f"{prefix}.lock"), "a+b")
+                )
+                flock(lock_file, fcntl.LOCK_EX)
+            if self.engine is not None and file_hashes:
+                stack.enter_context(self._hold_advisory(file_hashes))
+            yield
+
+    @contextmanager
+    def _hold_advisory(self, file_hashes: set[str]) -> Iterator[None]:
+        # Session-level locks outlive the transaction, so they are released before the
+        # connection goes back to the pool; a broken connection takes its locks with it.
+        with self.engine.connect() as connection:
+            try:
+                for key in sorted({int(file_hash[:15], 16) for file_hash in file_hashes}):
+                    connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": key})
+                yield
+            finally:
+                connection.execute(text("SELECT pg_advisory_unlock_all()"))
+                connection.commit()
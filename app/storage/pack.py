@@ -0,0 +1,343 @@
+import fcntl
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+from collections.abc import Iterator
+
+from app.concurrency import flock, native_local, native_lock
+from app.storage.base import StorageBackend
+from app.storage.durability import Durability
+from app.storage.local import LocalStorage
+
+
+class PackStorage(StorageBackend):
+    """
+    Storage backend appending small blobs to large pack files.
+
+    Blobs of at most `max_object_size` bytes are appended to the current pack file
+    `<root>/packs/pack-<n>.dat` under an exclusive file lock shared by every worker process;
+    a new pack is started once the current one reaches `max_pack_size` bytes. Each record
+    starts with a header holding its key and length. Where every blob lives is recorded in a
+    compact SQLite index, `<root>/packs/index.sqlite`, mapping the hash to its pack, offset
+    and length, and reads are served from memory-mapped packs. Larger blobs are kept as
+    standalone files by a `LocalStorage`, so they can still be offloaded to the front proxy.
+
+    Deleting a packed blob only removes its index entry. Compaction rewrites the live
+    records of sealed packs whose live share dropped below `compact_ratio` into the current
+    pack and removes the old pack, so readers that looked a blob up just before it moved
+    retry with the new location.
+
+    Attributes:
+        root (str): The storage folder.
+        max_object_size (int): The size in bytes of the largest blob stored in a pack.
+        max_pack_size (int): The size in bytes after which a new pack is started.
+        compact_ratio (float): The live share below which a sealed pack is compacted.
+        large_objects (LocalStorage): The backend holding the blobs too large for a pack.
+        durability (Durability): The policy used to flush appended records to disk before
+            they are indexed.
+    """
+
+    _RECORD_HEADER = struct.Struct("<HQ")
+    _PACK_PREFIX = "pack-"
+    _PACK_SUFFIX = ".dat"
+
+    def __init__(
+        self,
+        root: str,
+        max_object_size: int,
+        max_pack_size: int,
+        compact_ratio: float,
+        large_objects: LocalStorage | None = None,
+        durability: Durability | None = None,
+    ):
+        self.root = root
+        self.max_object_size = max_object_size
+        self.max_pack_size = max_pack_size
+        self.compact_ratio = compact_ratio
+        self.durability = durability or Durability()
+        self.large_objects = large_objects or LocalStorage(root, durability=durability)
+        self._directory = os.path.join(root, "packs")
+        self._lock_path = os.path.join(self._directory, ".lock")
+        self._index_path = os.path.join(self._directory, "index.sqlite")
+        self._local = native_local()
+        self._maps = {}
+        self._maps_lock = native_lock()
+
+        os.makedirs(self._directory, exist_ok=True)
+        with self._locked():
+            self._connection().execute(
+                "CREATE TABLE IF NOT EXISTS objects ("
+                "hash TEXT PRIMARY KEY, pack INTEGER NOT NULL, "
+                "offset INTEGER NOT NULL, length INTEGER NOT NULL"
+                ") WITHOUT ROWID"
+            )
+
+    def get_file_path(self, file_hash: str) -> str:
+        return self.large_objects.get_file_path(file_hash)
+
+    def exists(self, file_hash: str) -> bool:
+        return (
+            self._lookup(file_hash) is not None or self.large_objects.exists(file_hash)
+        )
+
+    def size(self, file_hash: str) -> int | None:
+        location = self._lookup(file_hash)
+        if location is not None:
+            return location[2]
+        return self.large_objects.size(file_hash)
+
+    def store(self, source_path: str, file_hash: str, size: int) -> None:
+        if size > self.max_object_size:
+            self.large_objects.store(source_path, file_hash, size)
+            return
+
+        with self._locked():
+            if self._lookup(file_hash) is None:
+                with open(source_path, "rb") as source:
+                    pack, offset = self._append(file_hash, source, size)
+                self._sync_pack(pack)
+                with self._connection() as connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO objects (hash, pack, offset, length) "
+                        "VALUES (?, ?, ?, ?)",
+                        (file_hash, pack, offset, size),
+                    )
+        os.remove(source_path)
+
+    def delete(self, file_hash: str) -> None:
+        with self._connection() as connection:
+            connection.execute("DELETE FROM objects WHERE hash = ?", (file_hash,))
+        self.large_objects.delete(file_hash)
+
+    def read_range(
+        self, file_hash: str, start: int, stop: int, chunk_size: int
+    ) -> Iterator[bytes]:
+        location = self._lookup(file_hash)
+        if location is None:
+            yield from self.large_objects.read_range(
+                file_hash, start, stop, chunk_size
+            )
+            return
+
+        try:
+            pack_map = self._map(location[0], location[1] + location[2])
+        except FileNotFoundError:
+            location = self._lookup(file_hash)
+            if location is None:
+                raise
+            pack_map = self._map(location[0], location[1] + location[2])
+
+        offset = location[1]
+        stop = min(stop, location[2])
+        while start < stop:
+            end = min(start + chunk_size, stop)
+            yield pack_map[offset + start : offset + end]
+            start = end
+
+    def iter_hashes(self) -> Iterator[str]:
+        after = ""
+        while rows := (
+            self._connection()
+            .execute(
+                "SELECT hash FROM objects WHERE hash > ? ORDER BY hash LIMIT 1000",
+                (after,),
+            )
+            .fetchall()
+        ):
+            for (after,) in rows:
+                yield after
+        yield from self.large_objects.iter_hashes()
+
+    def local_path(self, file_hash: str) -> str | None:
+        return self.large_objects.local_path(file_hash)
+
+    def children(self) -> list[StorageBackend]:
+        return [self.large_objects]
+
+    def maintenance(self) -> None:
+        self.compact()
+
+    def compact(self) -> int:
+        """
+        Compacts the sealed packs whose live share dropped below `compact_ratio`.
+
+        Each pack is compacted under the pack lock: its live records are appended to the
+        current pack, their index entries are moved only if they still point at the old
+        pack (so a blob deleted meanwhile is not brought back), and the old pack is then
+        removed.
+
+        Returns:
+            int: The number of packs removed.
+        """
+        packs = self._pack_numbers()
+        if not packs:
+            return 0
+        live = {
+            pack: length
+            for pack, length in self._connection().execute(
+                "SELECT pack, SUM(length + LENGTH(hash) + ?) "
+                "FROM objects GROUP BY pack",
+                (self._RECORD_HEADER.size,),
+            )
+        }
+
+        removed = 0
+        for pack in packs[:-1]:
+            path = self._pack_path(pack)
+            with self._locked():
+                try:
+                    total = os.path.getsize(path)
+                except FileNotFoundError:
+                    continue
+                if total and live.get(pack, 0) / total >= self.compact_ratio:
+                    continue
+                self._move_live_records(pack)
+                os.remove(path)
+            removed += 1
+        self._drop_stale_maps()
+        return removed
+
+    def stats(self) -> dict:
+        """
+        Returns the number and total size of the packs and of the live records in them.
+
+        Returns:
+            dict: The `packs`, `pack_bytes`, `objects` and `live_bytes` counters.
+        """
+        packs = self._pack_numbers()
+        objects, live_bytes = (
+            self._connection()
+            .execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM objects")
+            .fetchone()
+        )
+        return {
+            "packs": len(packs),
+            "pack_bytes": sum(
+                os.path.getsize(self._pack_path(pack)) for pack in packs
+            ),
+            "objects": objects,
+            "live_bytes": live_bytes,
+        }
+
+    def _append(self, file_hash: str, source, size: int) -> tuple[int, int]:
+        key = file_hash.encode()
+        packs = self._pack_numbers()
+        pack = packs[-1] if packs else 1
+        path = self._pack_path(pack)
+        if os.path.exists(path) and os.path.getsize(path) >= self.max_pack_size:
+            pack += 1
+            path = self._pack_path(pack)
+
+        with open(path, "ab") as f:
+            offset = f.seek(0, os.SEEK_END) + self._RECORD_HEADER.size + len(key)
+            f.write(self._RECORD_HEADER.pack(len(key), size) + key)
+            shutil.copyfileobj(source, f)
+        return pack, offset
+
+    def _sync_pack(self, pack: int) -> None:
+        # The directory entry only changes when the pack is created, and flushing an
+        # unchanged directory costs next to nothing.
+        self.durability.sync([self._pack_path(pack), self._directory])
+
+    def _move_live_records(self, pack: int) -> None:
+        rows = (
+            self._connection()
+            .execute(
+                "SELECT hash, offset, length FROM objects WHERE pack = ?", (pack,)
+            )
+            .fetchall()
+        )
+        if not rows:
+            return
+        moved = []
+        with open(self._pack_path(pack), "rb") as source:
+            for file_hash, offset, length in rows:
+                source.seek(offset)
+                reader = _LimitedReader(source, length)
+                new_pack, new_offset = self._append(file_hash, reader, length)
+                moved.append((new_pack, new_offset, file_hash, pack))
+        for new_pack in {row[0] for row in moved}:
+            self._sync_pack(new_pack)
+        with self._connection() as connection:
+            connection.executemany(
+                "UPDATE objects SET pack = ?, offset = ? WHERE hash = ? AND pack = ?",
+                moved,
+            )
+
+    def _lookup(self, file_hash: str) -> tuple[int, int, int] | None:
+        return (
+            self._connection()
+            .execute(
+                "SELECT pack, offset, length FROM objects WHERE hash = ?", (file_hash,)
+            )
+            .fetchone()
+        )
+
+    def _map(self, pack: int, min_size: int) -> mmap.mmap:
+        with self._maps_lock:
+            pack_map = self._maps.get(pack)
+            if pack_map is None or len(pack_map) < min_size:
+                with open(self._pack_path(pack), "rb") as f:
+                    pack_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[pack] = pack_map
+            return pack_map
+
+    def _drop_stale_maps(self) -> None:
+        with self._maps_lock:
+            for pack in list(self._maps):
+                if not os.path.exists(self._pack_path(pack)):
+                    del self._maps[pack]
+
+    def _pack_numbers(self) -> list[int]:
+        return sorted(
+            int(name[len(self._PACK_PREFIX) : -len(self._PACK_SUFFIX)])
+            for name in os.listdir(self._directory)
+            if name.startswith(self._PACK_PREFIX) and name.endswith(self._PACK_SUFFIX)
+        )
+
+    def _pack_path(self, pack: int) -> str:
+        return os.path.join(
+            self._directory, f"{self._PACK_PREFIX}{pack:08d}{self._PACK_SUFFIX}"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._index_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            if self.durability.mode != "none":
+                connection.execute("PRAGMA synchronous=FULL")
+            self._local.connection = connection
+        return connection
+
+    def _locked(self) -> "_PackLock":
+        return _PackLock(self._lock_path)
+
+
+class _PackLock:
+    def __init__(self, path: str):
+        self._path = path
+        self._file = None
+
+    def __enter__(self) -> "_PackLock":
+        self._file = open(self._path, "a+b")
+        flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._file.close()
+
+
+class _LimitedReader:
+    def __init__(self, source, remaining: int):
+        self._source = source
+        self._remaining = remaining
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._source.read(size)
+        self._remaining -= len(data)
+        return data
@@ -0,0 +1,283 @@
+import os
+import string
+import tempfile
+from collections.abc import Iterator
+from typing import BinaryIO
+
+from app.concurrency import is_patched, native_lock
+from app.storage.base import StorageBackend
+
+try:
+    import boto3
+    from boto3.exceptions import Boto3Error
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotocoreConfig
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:
+    boto3 = None
+
+# Error codes of requests for a missing object.
+_NOT_FOUND = ("404", "NoSuchKey", "NotFound")
+
+
+class S3Storage(StorageBackend):
+    """
+    Storage backend keeping each blob as an object of an S3-compatible bucket.
+
+    Objects are named `<prefix><hash>`, so several nodes sharing the bucket share their blobs.
+    Blobs are uploaded from their temporary file, as multipart uploads of `multipart_chunk_size`
+    bytes above `multipart_threshold` bytes, and ranges are downloaded with ranged GETs over a
+    pool of at most `max_pool_connections` HTTP connections. Any S3-compatible service can be
+    used, such as MinIO, by setting its `endpoint_url`.
+
+    When `cache_max_bytes` is set, blobs of at most `cache_max_object_size` bytes are
+    downloaded whole into a read-through cache under `<root>/.s3cache` the first time they are
+    read, and served from that local copy until they are evicted. The least recently read
+    blobs are evicted once the cache holds more than `cache_max_bytes` bytes. Any worker may
+    evict a copy at any time, so copies are opened before they are used and a reader keeps
+    the content of an evicted copy it already opened; they are never offloaded to the front
+    proxy, which would open them too late.
+
+    Attributes:
+        root (str): The local folder holding the cache.
+        bucket (str): The name of the bucket.
+        prefix (str): The prefix of the object names.
+        multipart_threshold (int): The size in bytes from which blobs are uploaded in parts.
+        multipart_chunk_size (int): The size in bytes of each part.
+        cache_max_bytes (int): The size budget in bytes of the cache, 0 to disable it.
+        cache_max_object_size (int): The size in bytes of the largest blob kept in the cache.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: str | None = None,
+        region: str | None = None,
+        addressing_style: str = "auto",
+        max_pool_connections: int = 50,
+        multipart_threshold: int = 8 * 1024 * 1024,
+        multipart_chunk_size: int = 8 * 1024 * 1024,
+        cache_max_bytes: int = 0,
+        cache_max_object_size: int = 64 * 1024 * 1024,
+    ):
+        if boto3 is None:
+            raise ValueError("The s3 storage backend requires the boto3 package.")
+        if not bucket:
+            raise ValueError("The s3 storage backend requires S3_BUCKET.")
+        self.root = root
+        self.bucket = bucket
+        self.prefix = prefix
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunk_size = multipart_chunk_size
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_max_object_size = cache_max_object_size
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            config=BotocoreConfig(
+                max_pool_connections=max_pool_connections,
+                retries={"mode": "standard"},
+                s3={"addressing_style": addressing_style},
+            ),
+        )
+        self._cache_root = os.path.join(root, ".s3cache")
+        self._cache_bytes = None
+        self._cache_lock = native_lock()
+        self._counters = {
+            "gets": 0,
+            "puts": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "cache_evictions": 0,
+        }
+
+    def get_file_path(self, file_hash: str) -> str:
+        return os.path.join(self._cache_root, file_hash[:2], file_hash)
+
+    def exists(self, file_hash: str) -> bool:
+        # The bucket is asked even for cached blobs, which another node may have deleted.
+        return self._head(file_hash) is not None
+
+    def size(self, file_hash: str) -> int | None:
+        try:
+            return os.stat(self.get_file_path(file_hash)).st_size
+        except FileNotFoundError:
+            return self._head(file_hash)
+
+    def store(self, source_path: str, file_hash: str, size: int) -> None:
+        # Threads of the transfer manager would be greenlets of a pool thread under gevent,
+        # so parts are then sent one after the other.
+        transfer = TransferConfig(
+            multipart_threshold=self.multipart_threshold,
+            multipart_chunksize=self.multipart_chunk_size,
+            use_threads=not is_patched(),
+        )
+        try:
+            self.client.upload_file(
+                source_path, self.bucket, self._key(file_hash), Config=transfer
+            )
+        except (Boto3Error, BotoCoreError, ClientError) as e:
+            raise OSError(f"Could not upload {file_hash}: {str(e)}.") from e
+        self._counters["puts"] += 1
+        os.remove(source_path)
+
+    def delete(self, file_hash: str) -> None:
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=self._key(file_hash))
+        except (BotoCoreError, ClientError) as e:
+            raise OSError(f"Could not delete {file_hash}: {str(e)}.") from e
+        try:
+            os.remove(self.get_file_path(file_hash))
+        except FileNotFoundError:
+            pass
+
+    def read_range(
+        self, file_hash: str, start: int, stop: int, chunk_size: int
+    ) -> Iterator[bytes]:
+        if stop <= start:
+            return
+        cached = self._open_cached(file_hash)
+        if cached is not None:
+            yield from self._read_file(cached, start, stop, chunk_size)
+            return
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket,
+                Key=self._key(file_hash),
+                Range=f"bytes={start}-{stop - 1}",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in _NOT_FOUND:
+                raise FileNotFoundError(file_hash) from e
+            raise OSError(f"Could not read {file_hash}: {str(e)}.") from e
+        except BotoCoreError as e:
+            raise OSError(f"Could not read {file_hash}: {str(e)}.") from e
+        self._counters["gets"] += 1
+        try:
+            yield from response["Body"].iter_chunks(chunk_size)
+        except BotoCoreError as e:
+            raise OSError(f"Could not read {file_hash}: {str(e)}.") from e
+        finally:
+            response["Body"].close()
+
+    def iter_hashes(self) -> Iterator[str]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        try:
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+                for item in page.get("Contents", []):
+                    name = item["Key"][len(self.prefix) :]
+                    if len(name) == 64 and all(c in string.hexdigits for c in name):
+                        yield name
+        except (BotoCoreError, ClientError) as e:
+            raise OSError(f"Could not list the bucket: {str(e)}.") from e
+
+    def stats(self) -> dict:
+        return {
+            "bucket": self.bucket,
+            **self._counters,
+            "cache_bytes": self._cache_bytes or 0,
+        }
+
+    def _key(self, file_hash: str) -> str:
+        return f"{self.prefix}{file_hash}"
+
+    def _head(self, file_hash: str) -> int | None:
+        try:
+            response = self.client.head_object(
+                Bucket=self.bucket, Key=self._key(file_hash)
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] in _NOT_FOUND:
+                return None
+            raise OSError(f"Could not look up {file_hash}: {str(e)}.") from e
+        except BotoCoreError as e:
+            raise OSError(f"Could not look up {file_hash}: {str(e)}.") from e
+        return response["ContentLength"]
+
+    def _open_cached(self, file_hash: str) -> BinaryIO | None:
+        # Opens the cached copy of a blob, downloading it first if it fits. The copy is
+        # opened before it is touched, so an eviction by another worker in between only
+        # unlinks it, and a copy evicted before it could be opened is simply downloaded again.
+        if not self.cache_max_bytes:
+            return None
+        path = self.get_file_path(file_hash)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            pass
+        else:
+            os.utime(f.fileno())
+            self._counters["cache_hits"] += 1
+            return f
+        self._counters["cache_misses"] += 1
+        size = self.size(file_hash)
+        if size is None:
+            raise FileNotFoundError(file_hash)
+        if size > self.cache_max_object_size:
+            return None
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self._cache_root, prefix="download-")
+        f = os.fdopen(fd, "w+b")
+        try:
+            self.client.download_fileobj(
+                self.bucket,
+                self._key(file_hash),
+                f,
+                Config=TransferConfig(use_threads=False),
+            )
+            f.flush()
+            self._counters["gets"] += 1
+            os.replace(temp_path, path)
+        except (Boto3Error, BotoCoreError, ClientError, OSError):
+            f.close()
+            os.remove(temp_path)
+            return None
+        self._evict(size)
+        f.seek(0)
+        return f
+
+    def _evict(self, added: int) -> None:
+        # Copies are added by every worker, so their total is recounted from disk whenever
+        # this process's running estimate exceeds the budget.
+        with self._cache_lock:
+            if self._cache_bytes is not None:
+                self._cache_bytes += added
+                if self._cache_bytes <= self.cache_max_bytes:
+                    return
+            entries = []
+            for shard in os.scandir(self._cache_root):
+                if shard.is_dir():
+                    for entry in os.scandir(shard.path):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.cache_max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                    self._counters["cache_evictions"] += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._cache_bytes = total
+
+    @staticmethod
+    def _read_file(f: BinaryIO, start: int, stop: int, chunk_size: int) -> Iterator[bytes]:
+        with f:
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
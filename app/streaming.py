@@ -0,0 +1,154 @@
+import hashlib
+import os
+import tempfile
+
+from flask import Request
+
+from app.concurrency import run_blocking
+
+
+class HashingTempFile:
+    """
+    Writable temporary file that computes the SHA-256 of its content while it is written.
+
+    Upload parts are spooled into a temporary file inside the storage folder, so once the
+    body has been received the hash is already known and the file can be moved into the
+    store with a single atomic rename. Unless the file is detached, closing it removes it
+    from disk.
+
+    Attributes:
+        name (str): The path of the temporary file.
+        size (int): The number of bytes written so far.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(dir=directory, prefix="upload-")
+        self._file = os.fdopen(fd, "w+b")
+        self._hash = hashlib.sha256()
+        self._detached = False
+        self.size = 0
+
+    @classmethod
+    def from_file(cls, path: str, digest) -> "HashingTempFile":
+        """
+        Wraps an existing file whose content has already been hashed.
+
+        Args:
+            path (str): The path of the file, inside the storage folder.
+            digest: The SHA-256 hash object fed with the whole content of the file.
+
+        Returns:
+            HashingTempFile: The temporary file, owning the file on disk.
+        """
+        temp_file = cls.__new__(cls)
+        temp_file.name = path
+        temp_file._file = open(path, "r+b")
+        temp_file._hash = digest
+        temp_file._detached = False
+        temp_file.size = os.fstat(temp_file._file.fileno()).st_size
+        return temp_file
+
+    def write(self, data: bytes) -> int:
+        """
+        Writes a chunk to the temporary file and feeds it to the running hash.
+
+        Args:
+            data (bytes): The chunk to write.
+
+        Returns:
+            int: The number of bytes written.
+        """
+        self._hash.update(data)
+        self.size += len(data)
+        return run_blocking(self._file.write, data)
+
+    def hexdigest(self) -> str:
+        """
+        Returns the SHA-256 of everything written so far.
+
+        Returns:
+            str: The hexadecimal representation of the hash.
+        """
+        return self._hash.hexdigest()
+
+    def detach(self) -> str:
+        """
+        Flushes and closes the temporary file without removing it.
+
+        After detaching, the caller owns the file on disk and is responsible for renaming
+        or removing it.
+
+        Returns:
+            str: The path of the temporary file.
+        """
+        self._file.close()
+        self._detached = True
+        return self.name
+
+    def close(self) -> None:
+        """
+        Closes the temporary file and removes it unless it has been detached.
+
+        Returns:
+            None
+        """
+        self._file.close()
+        if not self._detached:
+            self._detached = True
+            try:
+                os.remove(self.name)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name: str):
+        return getattr(self._file, name)
+
+    def __enter__(self) -> "HashingTempFile":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def spool_stream(stream, directory: str, chunk_size: int) -> HashingTempFile:
+    """
+    Copies a readable stream into a new hashing temporary file chunk by chunk.
+
+    Args:
+        stream: A binary file-like object to read from.
+        directory (str): The directory in which to create the temporary file.
+        chunk_size (int): The maximum number of bytes held in memory at once.
+
+    Returns:
+        HashingTempFile: The temporary file containing the stream's content.
+    """
+    temp_file = HashingTempFile(directory)
+    try:
+        while chunk := stream.read(chunk_size):
+            temp_file.write(chunk)
+    except Exception:
+        temp_file.close()
+        raise
+    return temp_file
+
+
+class StreamingRequest(Request):
+    """
+    Request class that streams uploaded files straight into the store's temporary folder.
+
+    Werkzeug calls `_get_file_stream` for every file part of a multipart body, so returning
+    a `HashingTempFile` here means each part is hashed and written to disk as it arrives,
+    without ever being buffered in memory as a whole.
+    """
+
+    def _get_file_stream(
+        self,
+        total_content_length: int | None,
+        content_type: str | None,
+        filename: str | None = None,
+        content_length: int | None = None,
+    ) -> HashingTempFile:
+        from app.services.filesystem_service import FileSystemService
+
+        return HashingTempFile(FileSystemService.get_temp_dir())
@@ -1,6 +1,9 @@
 import hashlib
+import unicodedata
+from urllib.parse import quote
 
 from flask import current_app, jsonify
+from werkzeug.http import dump_options_header
 
 
 def hash_file(file_content: bytes) -> str:
@@ -52,3 +55,28 @@ def handle_error(message: str, status_code: int, log_message: str = None) -> tup
     if log_message:
         current_app.logger.error(log_message)
     return json_response({"error": message}, status_code)
+
+
+def content_disposition(filename: str) -> str:
+    """
+    Builds a `Content-Disposition` header value offering a file as an attachment.
+
+    Non-ASCII filenames are sent both as an ASCII approximation and as an RFC 5987
+    encoded `filename*` parameter, the same way `flask.send_file` does.
+
+    Args:
+        filename (str): The name under which the file is offered to the client.
+
+    Returns:
+        str: The header value.
+    """
+    try:
+        filename.encode("ascii")
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", filename)
+        simple = simple.encode("ascii", "ignore").decode("ascii")
+        quoted = quote(filename, safe="!#$&+^`|~")
+        options = {"filename": simple, "filename*": f"UTF-8''{quoted}"}
+    else:
+        options = {"filename": filename}
+    return dump_options_header("attachment", options)
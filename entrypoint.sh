@@ -5,4 +5,7 @@ echo "Running migrations..."
 flask db upgrade
 
 echo "Starting Gunicorn..."
-gunicorn -b 0.0.0.0:5000 run:app
\ No newline at end of file
+gunicorn -b 0.0.0.0:5000 \
+    -k "${GUNICORN_WORKER_CLASS:-sync}" \
+    --worker-connections "${GUNICORN_WORKER_CONNECTIONS:-1000}" \
+    run:app
\ No newline at end of file
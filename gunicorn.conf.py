@@ -0,0 +1,6 @@
+def post_worker_init(worker):
+    # Every worker runs the background maintenance of the application it serves; it is
+    # imported here, after gevent workers have patched the standard library.
+    from app.background import start_background_tasks
+
+    start_background_tasks(worker.wsgi)
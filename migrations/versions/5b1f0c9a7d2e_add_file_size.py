@@ -0,0 +1,26 @@
+"""Add file size
+
+Revision ID: 5b1f0c9a7d2e
+Revises: 23243ec9b94e
+Create Date: 2026-10-17 10:12:41.518305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1f0c9a7d2e'
+down_revision = '23243ec9b94e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('size', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_column('size')
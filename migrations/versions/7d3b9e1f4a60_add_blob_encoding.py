@@ -0,0 +1,26 @@
+"""Add blob encoding
+
+Revision ID: 7d3b9e1f4a60
+Revises: c41d8e6b2a95
+Create Date: 2026-10-17 12:31:17.904412
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3b9e1f4a60'
+down_revision = 'c41d8e6b2a95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('blob', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('encoding', sa.String(length=16), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('blob', schema=None) as batch_op:
+        batch_op.drop_column('encoding')
@@ -0,0 +1,82 @@
+"""Split blobs from file ownership
+
+Revision ID: 9e4a2f7c3b10
+Revises: 5b1f0c9a7d2e
+Create Date: 2026-10-17 11:02:19.734012
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4a2f7c3b10'
+down_revision = '5b1f0c9a7d2e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('blob',
+    sa.Column('file_hash', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.Column('refcount', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('file_hash')
+    )
+    op.execute(
+        "INSERT INTO blob (file_hash, size, refcount) "
+        "SELECT file_hash, MAX(size), COUNT(*) FROM file GROUP BY file_hash"
+    )
+
+    # The unique constraint on file_hash was created without a name, so the ownership
+    # table is rebuilt instead of altered.
+    op.create_table('file_ownership',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('file_hash', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.String(length=64), nullable=False),
+    sa.Column('username', sa.String(length=80), nullable=False),
+    sa.ForeignKeyConstraint(['file_hash'], ['blob.file_hash'], name='fk_file_file_hash_blob'),
+    sa.PrimaryKeyConstraint('id', name='pk_file'),
+    sa.UniqueConstraint('username', 'file_hash', name='uq_file_username_file_hash')
+    )
+    op.execute(
+        "INSERT INTO file_ownership (id, file_hash, filename, username) "
+        "SELECT id, file_hash, filename, username FROM file"
+    )
+    op.drop_table('file')
+    op.rename_table('file_ownership', 'file')
+    _restart_id_sequence()
+    op.create_index('ix_file_file_hash', 'file', ['file_hash'], unique=False)
+
+
+def downgrade():
+    op.create_table('file_legacy',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('file_hash', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.String(length=64), nullable=False),
+    sa.Column('username', sa.String(length=80), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('file_hash')
+    )
+    # Only the oldest owner of each content can be kept with a globally unique hash.
+    op.execute(
+        "INSERT INTO file_legacy (id, file_hash, filename, username, size) "
+        "SELECT file.id, file.file_hash, file.filename, file.username, blob.size "
+        "FROM file LEFT OUTER JOIN blob ON blob.file_hash = file.file_hash "
+        "WHERE file.id IN (SELECT MIN(id) FROM file GROUP BY file_hash)"
+    )
+    op.drop_index('ix_file_file_hash', table_name='file')
+    op.drop_table('file')
+    op.drop_table('blob')
+    op.rename_table('file_legacy', 'file')
+    _restart_id_sequence()
+
+
+def _restart_id_sequence():
+    # Rows were copied with their IDs, which PostgreSQL's sequence did not hand out.
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "SELECT setval(pg_get_serial_sequence('file', 'id'), "
+            "COALESCE(MAX(id), 0) + 1, false) FROM file"
+        )
@@ -0,0 +1,24 @@
+"""Add file username/id index
+
+Revision ID: c41d8e6b2a95
+Revises: 9e4a2f7c3b10
+Create Date: 2026-10-17 11:48:03.261874
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d8e6b2a95'
+down_revision = '9e4a2f7c3b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_file_username_id', 'file', ['username', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_file_username_id', table_name='file')
@@ -0,0 +1,26 @@
+"""Add blob reclaim_after
+
+Revision ID: e2a7c5d9f813
+Revises: 7d3b9e1f4a60
+Create Date: 2026-10-17 15:08:42.551930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7c5d9f813'
+down_revision = '7d3b9e1f4a60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('blob', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reclaim_after', sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('blob', schema=None) as batch_op:
+        batch_op.drop_column('reclaim_after')
@@ -0,0 +1,37 @@
+"""Widen file filename
+
+Revision ID: f3b6d1a8c0e4
+Revises: e2a7c5d9f813
+Create Date: 2026-10-17 18:21:37.408215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b6d1a8c0e4'
+down_revision = 'e2a7c5d9f813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.alter_column('filename',
+               existing_type=sa.String(length=64),
+               type_=sa.String(length=255),
+               existing_nullable=False)
+
+
+def downgrade():
+    # Keep the end of longer names, extension included, as uploads cut them.
+    op.execute(
+        "UPDATE file SET filename = substr(filename, length(filename) - 63) "
+        "WHERE length(filename) > 64"
+    )
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.alter_column('filename',
+               existing_type=sa.String(length=255),
+               type_=sa.String(length=64),
+               existing_nullable=False)
@@ -1,7 +1,9 @@
 from app import create_app
+from app.background import start_background_tasks
 from app.config import Config
 
 app = create_app()
 
 if __name__ == "__main__":
+    start_background_tasks(app)
     app.run(debug=Config.DEBUG)
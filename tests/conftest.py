@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+from app.config import Config
+
+
+@pytest.fixture
+def config(tmp_path) -> type[Config]:
+    """
+    Returns a configuration keeping the store and the SQLite database of a test in `tmp_path`.
+
+    A database given through `DATABASE_URL`, such as a PostgreSQL server, is used instead of
+    SQLite, so that the suite can run against it.
+    """
+
+    class TestConfig(Config):
+        STORAGE_FOLDER = str(tmp_path / "store")
+        SQLALCHEMY_DATABASE_URI = os.getenv(
+            "DATABASE_URL", "sqlite:///" + str(tmp_path / "files.db")
+        )
+        BLOB_GC_INTERVAL = 0
+
+    return TestConfig
@@ -0,0 +1,79 @@
+import os
+import time
+
+import pytest
+
+from app import create_app
+from app.cache import HotObjectCache, InvalidationLog, LRUCache
+
+
+@pytest.fixture
+def app(config):
+    return create_app(config)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """
+    Test that the cache keeps at most `max_entries` entries and evicts the least recently used one.
+    """
+    cache = LRUCache(2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    assert cache.get("a") == 1
+
+    cache.set("c", 3, ttl=60)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_lru_cache_expires_entries():
+    """
+    Test that expired entries are treated as misses, including cached negative results.
+    """
+    cache = LRUCache(10)
+    cache.set("a", None, ttl=0.01)
+    assert cache.get("a", "missing") is None
+    time.sleep(0.02)
+    assert cache.get("a", "missing") == "missing"
+
+
+def test_invalidation_log_is_shared_between_instances(tmp_path):
+    """
+    Test that hashes published through one mapping are visible through another one.
+    """
+    path = os.path.join(tmp_path, "invalidation")
+    writer = InvalidationLog(path, slots=4)
+    reader = InvalidationLog(path, slots=4)
+    file_hash = "ab" * 32
+
+    position = reader.position
+    writer.publish(file_hash)
+    assert reader.read_since(position) == [file_hash]
+
+    for _ in range(4):
+        writer.publish(file_hash)
+    assert reader.read_since(position) is None
+
+
+def test_hot_object_cache_respects_byte_budget(app):
+    """
+    Test that the hot object cache evicts bodies once the byte budget is exceeded.
+    """
+    cache = HotObjectCache()
+    app.config.update(HOT_CACHE_MAX_BYTES=10, HOT_CACHE_MAX_OBJECT_SIZE=6)
+    cache.init_app(app)
+
+    assert cache.get("a", lambda _: b"aaaaa") == b"aaaaa"
+    assert cache.get("a", lambda _: b"other") == b"aaaaa"
+    cache.get("b", lambda _: b"bbbbb")
+    cache.get("c", lambda _: b"ccccc")
+
+    assert cache.stats()["bytes"] == 10
+    assert cache.get("a", lambda _: b"reloaded") == b"reloaded"
+    assert not cache.accepts(7)
+
+    cache.discard("c")
+    assert cache.stats()["entries"] == 1
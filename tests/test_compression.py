@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import io
+import os
+
+import pytest
+from flask import Flask
+
+from app import create_app, db
+from app.compression import Codec
+from app.models import Blob
+from app.services.filesystem_service import FileSystemService
+
+
+@pytest.fixture
+def app(config):
+    class CompressionConfig(config):
+        COMPRESSION = "gzip"
+
+    app = create_app(CompressionConfig)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+def upload(app: Flask, content: bytes) -> str:
+    response = app.test_client().post(
+        "/upload",
+        data={"file": (io.BytesIO(content), "log.txt")},
+        content_type="multipart/form-data",
+        auth=("user1", "password1"),
+    )
+    assert response.status_code == 201
+    return response.json["file_hash"]
+
+
+def test_decompress_range_bounds_chunks():
+    """
+    Test that ranges are cut from the decompressed stream in bounded chunks.
+    """
+    codec = Codec("gzip")
+    content = b"0123456789" * 10000
+    compressed = gzip.compress(content)
+    chunks = [compressed[i : i + 100] for i in range(0, len(compressed), 100)]
+
+    parts = list(codec.decompress_range(chunks, 12345, 67890, 1000))
+    assert b"".join(parts) == content[12345:67890]
+    assert max(len(part) for part in parts) <= 1000
+
+
+def test_compressible_upload_is_stored_compressed(app: Flask):
+    """
+    Test that text is compressed at rest under the hash of the original content and served
+    compressed only to clients that accept gzip.
+    """
+    content = b"2026-10-17 12:00:00 INFO request served\n" * 2000
+    file_hash = upload(app, content)
+    assert file_hash == hashlib.sha256(content).hexdigest()
+
+    with app.app_context():
+        blob = db.session.get(Blob, file_hash)
+        assert blob.encoding == "gzip"
+        assert blob.size == len(content)
+        assert FileSystemService.get_file_size(file_hash) < len(content) / 5
+
+    client = app.test_client()
+    response = client.get(
+        f"/download/{file_hash}", headers={"Accept-Encoding": "gzip, br"}
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == f'"{file_hash}-gzip"'
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.data) == content
+
+    response = client.get(
+        f"/download/{file_hash}",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": f'"{file_hash}-gzip"'},
+    )
+    assert response.status_code == 304
+
+    response = client.get(f"/download/{file_hash}")
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["ETag"] == f'"{file_hash}"'
+    assert response.data == content
+
+    response = client.get(
+        f"/download/{file_hash}",
+        headers={"Accept-Encoding": "gzip", "Range": "bytes=1000-1999"},
+    )
+    assert response.status_code == 206
+    assert "Content-Encoding" not in response.headers
+    assert response.data == content[1000:2000]
+
+
+def test_incompressible_upload_is_stored_as_is(app: Flask):
+    """
+    Test that content whose sample does not compress is stored without an encoding.
+    """
+    content = os.urandom(50000)
+    file_hash = upload(app, content)
+
+    with app.app_context():
+        assert db.session.get(Blob, file_hash).encoding is None
+        assert FileSystemService.get_file_size(file_hash) == len(content)
+
+    response = app.test_client().get(
+        f"/download/{file_hash}", headers={"Accept-Encoding": "gzip"}
+    )
+    assert "Content-Encoding" not in response.headers
+    assert response.data == content
@@ -0,0 +1,83 @@
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+pytest.importorskip("gevent")
+
+SCRIPT = textwrap.dedent(
+    """
+    from gevent import monkey
+
+    monkey.patch_all()
+
+    import hashlib
+    import io
+    import os
+    import sys
+
+    import gevent
+
+    from app import concurrency, create_app, db
+    from app.config import Config
+    from app.models import Blob
+
+    class GeventConfig(Config):
+        STORAGE_FOLDER = os.path.join(sys.argv[1], "store")
+        SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(sys.argv[1], "files.db")
+        BLOB_GC_INTERVAL = 0
+        UPLOAD_SESSION_GC_INTERVAL = 0
+        IO_THREADS = 2
+        STORAGE_DURABILITY = "group"
+        STORAGE_BACKEND = sys.argv[2]
+
+    app = create_app(GeventConfig)
+    with app.app_context():
+        db.create_all()
+    assert concurrency.is_cooperative()
+    assert gevent.get_hub().threadpool.maxsize == 2
+
+    same = os.urandom(50000)
+    contents = [same] * 20 + [os.urandom(20000) for _ in range(20)]
+
+    def upload(index, content):
+        response = app.test_client().post(
+            "/upload",
+            data={"file": (io.BytesIO(content), "file.bin")},
+            content_type="multipart/form-data",
+            auth=("user1" if index % 2 else "user2", "password1" if index % 2 else "password2"),
+        )
+        assert response.status_code == 201, response.json
+        return response.json["file_hash"]
+
+    greenlets = [gevent.spawn(upload, i, c) for i, c in enumerate(contents)]
+    gevent.joinall(greenlets, raise_error=True, timeout=60)
+    hashes = [greenlet.value for greenlet in greenlets]
+    assert hashes == [hashlib.sha256(content).hexdigest() for content in contents]
+
+    client = app.test_client()
+    downloads = [gevent.spawn(lambda h: client.get(f"/download/{h}").data, h) for h in hashes]
+    gevent.joinall(downloads, raise_error=True, timeout=60)
+    assert [greenlet.value for greenlet in downloads] == contents
+
+    with app.app_context():
+        assert db.session.get(Blob, hashes[0]).refcount == 2
+    print("ok")
+    """
+)
+
+
+@pytest.mark.parametrize("backend", ["local", "pack"])
+def test_gevent_workers_offload_blocking_calls(tmp_path, backend: str):
+    """
+    Test that concurrent uploads and downloads succeed on greenlets with a tiny I/O thread pool.
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT, str(tmp_path), backend],
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().endswith("ok")
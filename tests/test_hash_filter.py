@@ -0,0 +1,140 @@
+import hashlib
+import io
+import os
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from app import create_app, db
+from app.hash_filter import BloomFilter, hash_filter
+from app.models import Blob, File
+
+
+@pytest.fixture
+def app(config):
+    class BloomFilterConfig(config):
+        BLOOM_FILTER_ENABLED = True
+        BLOOM_FILTER_CAPACITY = 1000
+
+    app = create_app(BloomFilterConfig)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+    hash_filter.init_app(create_app(config))
+
+
+def test_bloom_filter_persists_between_instances(tmp_path):
+    """
+    Test that keys added through one mapping are visible to another one and survive a rebuild.
+    """
+    path = os.path.join(tmp_path, "bloom")
+    writer = BloomFilter.for_capacity(path, 100, 0.01)
+    reader = BloomFilter.for_capacity(path, 100, 0.01)
+    writer.open()
+    reader.open()
+    assert writer.count == -1
+
+    writer.add("a" * 64)
+    assert reader.might_contain("a" * 64)
+    assert not reader.might_contain("b" * 64)
+
+    assert writer.rebuild(["b" * 64, "c" * 64]) == 2
+    assert reader.might_contain("b" * 64)
+    assert not reader.might_contain("a" * 64)
+    assert reader.count == 2
+
+
+def test_bloom_filter_lookups_survive_rebuilds_in_other_threads(tmp_path):
+    """
+    Test that lookups reading the mapping while another thread rebuilds the filter do not fail.
+    """
+    path = os.path.join(tmp_path, "bloom")
+    bloom_filter = BloomFilter.for_capacity(path, 100, 0.01)
+    bloom_filter.open()
+    stop = threading.Event()
+    errors = []
+
+    def look_up() -> None:
+        while not stop.is_set():
+            try:
+                bloom_filter.might_contain("a" * 64)
+            except ValueError as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=look_up) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 1
+    while time.monotonic() < deadline and not errors:
+        bloom_filter.rebuild(["a" * 64])
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+
+def test_bloom_filter_rebuild_waits_for_uncommitted_keys(tmp_path):
+    """
+    Test that a rebuild started after a key was added but before it was committed keeps it.
+    """
+    path = os.path.join(tmp_path, "bloom")
+    writer = BloomFilter.for_capacity(path, 100, 0.01)
+    rebuilder = BloomFilter.for_capacity(path, 100, 0.01)
+    writer.open()
+    rebuilder.open()
+    committed = []
+
+    def scan():
+        yield from list(committed)
+
+    with writer.writing():
+        writer.add("pending")
+        thread = threading.Thread(target=rebuilder.rebuild, args=(scan(),))
+        thread.start()
+        time.sleep(0.05)
+        committed.append("pending")
+        writer.adjust(count=1)
+    thread.join()
+
+    assert writer.might_contain("pending")
+    assert writer.count == 1
+
+
+def test_download_of_unknown_hash_skips_database(app: Flask):
+    """
+    Test that the filter rejects unknown hashes and learns about uploaded files.
+    """
+    with app.app_context():
+        if db.engine.dialect.name != "sqlite":
+            assert hash_filter.stats() == {"enabled": False}
+            pytest.skip("The filter only follows a database local to the host.")
+    client = app.test_client()
+    content = os.urandom(32)
+    file_hash = hashlib.sha256(content).hexdigest()
+
+    assert client.get(f"/download/{file_hash}").status_code == 404
+    assert hash_filter.stats()["definite_misses"] == 1
+
+    client.post(
+        "/upload",
+        data={"file": (io.BytesIO(content), "filtered.bin")},
+        content_type="multipart/form-data",
+        auth=("user1", "password1"),
+    )
+    assert client.get(f"/download/{file_hash}").data == content
+    assert hash_filter.stats()["count"] == 1
+
+    with app.app_context():
+        db.session.add(Blob(file_hash="e" * 64, refcount=1))
+        db.session.add(File(file_hash="e" * 64, filename="e.txt", username="user1"))
+        db.session.commit()
+        hash_filter.init_app(app)
+        assert hash_filter.might_contain("e" * 64)
+
+        client.delete(f"/delete/{file_hash}", auth=("user1", "password1"))
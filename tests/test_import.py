@@ -0,0 +1,86 @@
+import hashlib
+import os
+
+import pytest
+from flask import Flask
+
+from app import create_app, db
+from app.models import Blob, File
+from app.services.filesystem_service import FileSystemService
+from app.services.import_service import ImportService
+
+
+@pytest.fixture
+def app(config):
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+@pytest.fixture
+def dataset(tmp_path) -> dict[str, bytes]:
+    contents = {
+        "a.bin": os.urandom(100),
+        "b/c.bin": os.urandom(200),
+        "b/d/e.bin": os.urandom(300),
+        "b/d/same.bin": b"same",
+        "f.bin": b"same",
+    }
+    for name, content in contents.items():
+        path = tmp_path / "dataset" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+    return contents
+
+
+def test_import_directory(app: Flask, dataset: dict[str, bytes], tmp_path):
+    """
+    Test that a tree is imported with hardlinked content and deduplicated records.
+    """
+    directory = str(tmp_path / "dataset")
+    with app.app_context():
+        counts = ImportService.import_directory(directory, "user1", 2, batch_size=2)
+        assert counts["files"] == 5
+        assert counts["imported"] == 4
+        assert counts["bytes"] == sum(len(content) for content in dataset.values())
+
+        for content in dataset.values():
+            file_hash = hashlib.sha256(content).hexdigest()
+            assert db.session.get(Blob, file_hash).refcount == 1
+            path = FileSystemService.get_file_path(file_hash)
+            with open(path, "rb") as f:
+                assert f.read() == content
+            assert os.stat(path).st_nlink == 2
+        assert os.path.isfile(tmp_path / "dataset" / "a.bin")
+
+        counts = ImportService.import_directory(directory, "user1", 2)
+        assert counts["imported"] == 0
+        assert db.session.query(File).count() == 4
+
+
+def test_import_directory_resumes_after_interruption(
+    app: Flask, dataset: dict[str, bytes], tmp_path
+):
+    """
+    Test that an interrupted import resumes after the last committed batch.
+    """
+    directory = str(tmp_path / "dataset")
+
+    def interrupt(counts: dict) -> None:
+        raise KeyboardInterrupt
+
+    with app.app_context():
+        with pytest.raises(KeyboardInterrupt):
+            ImportService.import_directory(directory, "user1", 1, 2, interrupt)
+        assert db.session.query(File).count() == 2
+
+        progress = []
+        counts = ImportService.import_directory(
+            directory, "user1", 1, 2, progress.append
+        )
+        assert [entry["files"] for entry in progress] == [4, 5]
+        assert counts["files"] == 5
+        assert db.session.query(File).count() == 4
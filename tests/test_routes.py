@@ -1,18 +1,30 @@
+import hashlib
+import io
 import os
+import tarfile
 import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 from flask import Flask
 from flask.testing import FlaskClient
+from sqlalchemy.exc import SQLAlchemyError
 
 from app import create_app, db
-from app.models import File
+from app.background import start_background_tasks
+from app.cache import hot_object_cache
+from app.models import Blob, File, FileMetadata
+from app.repositories.file_repository import FileRepository
+from app.services.file_service import FileService
 from app.services.filesystem_service import FileSystemService
 
 
 @pytest.fixture
-def app():
-    app = create_app()
+def app(config):
+    app = create_app(config)
     with app.app_context():
         db.create_all()
     yield app
@@ -50,19 +62,39 @@ def test_upload_file(client: FlaskClient, temp_file: tempfile.NamedTemporaryFile
     assert "file_hash" in response.json
 
 
+def test_upload_file_with_long_name(client: FlaskClient, app: Flask):
+    """
+    Test that a name longer than the filename column is cut to its end instead of failing.
+    """
+    filename = "n" * 300 + ".txt"
+    response = client.post(
+        "/upload",
+        data={"file": (io.BytesIO(b"long name"), filename)},
+        content_type="multipart/form-data",
+        auth=("user1", "password1"),
+    )
+    assert response.status_code == 201
+
+    with app.app_context():
+        stored = File.query.one().filename
+        assert stored == filename[-File.MAX_FILENAME_LENGTH :]
+        os.remove(FileSystemService.get_file_path(response.json["file_hash"]))
+
+
 def test_download_file(
     client: FlaskClient, app: Flask, temp_file: tempfile.NamedTemporaryFile
 ):
     """
     Test file download functionality by checking if a stored file can be retrieved correctly.
     """
-    file_hash = "d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2"
+    file_hash = "d2" * 32
     file_record = File(file_hash=file_hash, filename="testfile.txt", username="user1")
 
     with app.app_context():
         file_path = FileSystemService.get_file_path(file_hash)
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
+        db.session.add(Blob(file_hash=file_hash, refcount=1))
         db.session.add(file_record)
         db.session.commit()
 
@@ -78,15 +110,17 @@ def test_delete_file(
     client: FlaskClient, app: Flask, temp_file: tempfile.NamedTemporaryFile
 ):
     """
-    Test file deletion functionality by checking if a file can be removed and no longer exists.
+    Test file deletion functionality by checking if a file can be removed and no longer exists
+    once unreferenced blobs have been collected.
     """
-    file_hash = "d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2d2"
+    file_hash = "d2" * 32
     file_record = File(file_hash=file_hash, filename="testfile.txt", username="user1")
 
     with app.app_context():
         file_path = FileSystemService.get_file_path(file_hash)
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
+        db.session.add(Blob(file_hash=file_hash, refcount=1))
         db.session.add(file_record)
         db.session.commit()
 
@@ -96,4 +130,717 @@ def test_delete_file(
         response = client.delete(f"/delete/{file_hash}", auth=("user1", "password1"))
         assert response.status_code == 200
         assert "File deleted." in response.json["message"]
+
+        assert FileService.collect_garbage() == 1
+        assert not os.path.isfile(file_path)
+
+
+def test_upload_same_content_by_different_users(client: FlaskClient, app: Flask):
+    """
+    Test that content uploaded by several users is stored once and kept until its last owner deletes it.
+    """
+    content = os.urandom(128)
+    file_hash = hashlib.sha256(content).hexdigest()
+
+    for username, password in (("user1", "password1"), ("user2", "password2")):
+        response = client.post(
+            "/upload",
+            data={"file": (io.BytesIO(content), f"{username}.bin")},
+            content_type="multipart/form-data",
+            auth=(username, password),
+        )
+        assert response.status_code == 201
+        assert response.json == {"file_hash": file_hash}
+
+    with app.app_context():
+        assert db.session.get(Blob, file_hash).refcount == 2
+        file_path = FileSystemService.get_file_path(file_hash)
+
+        client.delete(f"/delete/{file_hash}", auth=("user1", "password1"))
+        assert FileService.collect_garbage() == 0
+        assert client.get(f"/download/{file_hash}").data == content
+
+        client.delete(f"/delete/{file_hash}", auth=("user2", "password2"))
+        assert db.session.get(Blob, file_hash).refcount == 0
+        assert FileService.collect_garbage() == 1
         assert not os.path.isfile(file_path)
+        assert client.get(f"/download/{file_hash}").status_code == 404
+
+
+def test_collect_garbage_retries_failures_and_keeps_revived_blobs(
+    client: FlaskClient, app: Flask, monkeypatch: pytest.MonkeyPatch
+):
+    """
+    Test that failed removals are postponed and retried, and that a blob uploaded again after
+    its tombstone was written keeps its content.
+    """
+    contents = [os.urandom(64), os.urandom(64)]
+    hashes = [hashlib.sha256(content).hexdigest() for content in contents]
+    for content, file_hash in zip(contents, hashes):
+        auth = ("user1", "password1")
+        data = {"file": (io.BytesIO(content), "file.bin")}
+        assert client.post("/upload", data=data, auth=auth).status_code == 201
+        assert client.delete(f"/delete/{file_hash}", auth=auth).status_code == 200
+
+    data = {"file": (io.BytesIO(contents[1]), "again.bin")}
+    assert client.post("/upload", data=data, auth=("user2", "password2")).status_code == 201
+
+    with app.app_context():
+        monkeypatch.setattr(FileSystemService, "delete_file", lambda file_hash: False)
+        assert FileService.collect_garbage() == 0
+        monkeypatch.undo()
+        assert db.session.get(Blob, hashes[0]).reclaim_after > time.time()
+        assert FileService.collect_garbage() == 0
+
+        db.session.get(Blob, hashes[0]).reclaim_after = time.time()
+        db.session.commit()
+        assert FileService.collect_garbage() == 1
+        assert db.session.get(Blob, hashes[0]) is None
+        assert db.session.get(Blob, hashes[1]).refcount == 1
+    assert client.get(f"/download/{hashes[1]}").data == contents[1]
+
+
+def test_concurrent_uploads_of_same_content_store_it_once(
+    client: FlaskClient, app: Flask
+):
+    """
+    Test that concurrent uploads of the same content write it once and all reference it.
+    """
+    content = os.urandom(4096)
+    file_hash = hashlib.sha256(content).hexdigest()
+    users = [("user1", "password1"), ("user2", "password2")]
+    storage = app.extensions["storage"]
+    store = storage.store
+    stored = []
+
+    def counting_store(source_path: str, file_hash: str, size: int) -> None:
+        stored.append(file_hash)
+        time.sleep(0.05)
+        store(source_path, file_hash, size)
+
+    def upload(username: str, password: str) -> int:
+        barrier.wait()
+        return app.test_client().post(
+            "/upload",
+            data={"file": (io.BytesIO(content), f"{username}.bin")},
+            content_type="multipart/form-data",
+            auth=(username, password),
+        ).status_code
+
+    storage.store = counting_store
+    barrier = threading.Barrier(len(users))
+    try:
+        with ThreadPoolExecutor(len(users)) as executor:
+            statuses = list(executor.map(lambda user: upload(*user), users))
+    finally:
+        del storage.store
+
+    assert statuses == [201, 201]
+    assert stored == [file_hash]
+    with app.app_context():
+        assert db.session.get(Blob, file_hash).refcount == 2
+    assert client.get(f"/download/{file_hash}").data == content
+
+
+def test_metadata_writes_of_concurrent_uploads_are_committed_together(
+    client: FlaskClient, app: Flask
+):
+    """
+    Test that concurrent uploads share metadata transactions and that SQLite runs in WAL mode.
+    """
+    contents = [os.urandom(256) for _ in range(6)]
+    writer = app.extensions["metadata_writer"]
+    writer.window = 0.2
+    barrier = threading.Barrier(len(contents))
+
+    def upload(content: bytes) -> int:
+        barrier.wait()
+        return app.test_client().post(
+            "/upload",
+            data={"file": (io.BytesIO(content), "file.bin")},
+            content_type="multipart/form-data",
+            auth=("user1", "password1"),
+        ).status_code
+
+    with ThreadPoolExecutor(len(contents)) as executor:
+        statuses = list(executor.map(upload, contents))
+
+    assert statuses == [201] * len(contents)
+    assert writer.writes == len(contents)
+    assert writer.batches < len(contents)
+    with app.app_context():
+        assert File.query.count() == len(contents)
+        if db.engine.dialect.name == "sqlite":
+            assert db.session.execute(db.text("PRAGMA journal_mode")).scalar() == "wal"
+        for content in contents:
+            os.remove(FileSystemService.get_file_path(hashlib.sha256(content).hexdigest()))
+
+
+def test_failing_metadata_write_only_fails_its_caller(app: Flask):
+    """
+    Test that a write failing in a shared transaction does not fail the other writes.
+    """
+    writer = app.extensions["metadata_writer"]
+    writer.window = 0.2
+    files = [
+        FileMetadata("a" * 64, "first.bin", "user1", 1),
+        FileMetadata("a" * 64, "again.bin", "user1", 1),
+        FileMetadata("b" * 64, "other.bin", "user1", 1),
+    ]
+    barrier = threading.Barrier(len(files) + 1)
+
+    def add(file: FileMetadata) -> int | None:
+        with app.app_context():
+            barrier.wait()
+            return FileRepository.add_file(file)
+
+    def fail() -> None:
+        with app.app_context():
+            barrier.wait()
+            writer.run(lambda: db.session.execute(db.text("INSERT INTO missing VALUES (1)")))
+
+    with ThreadPoolExecutor(len(files) + 1) as executor:
+        failure = executor.submit(fail)
+        results = list(executor.map(add, files))
+        with pytest.raises(SQLAlchemyError):
+            failure.result()
+
+    assert sorted(results[:2], key=str) == [1, None]
+    assert results[2] == 1
+    with app.app_context():
+        assert File.query.count() == 2
+        assert db.session.get(Blob, "a" * 64).refcount == 1
+
+
+def test_in_memory_sqlite_database_ignores_pool_sizing(config):
+    """
+    Test that the pool size settings meant for database servers are not passed to SQLite.
+    """
+
+    class MemoryConfig(config):
+        SQLALCHEMY_DATABASE_URI = "sqlite://"
+
+    app = create_app(MemoryConfig)
+    assert "pool_size" not in app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+    assert app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_pre_ping"]
+    with app.app_context():
+        db.create_all()
+        assert File.query.count() == 0
+
+
+def test_background_tasks_only_start_when_requested(config):
+    """
+    Test that creating the application, as migrations and CLI commands do, starts no maintenance.
+    """
+
+    class MaintainedConfig(config):
+        BLOB_GC_INTERVAL = 3600
+        UPLOAD_SESSION_GC_INTERVAL = 3600
+
+    app = create_app(MaintainedConfig)
+    names = {thread.name for thread in threading.enumerate()}
+    assert not names & {"blob-gc", "upload-session-gc"}
+
+    threads = start_background_tasks(app)
+    assert {thread.name for thread in threads} == {"blob-gc", "upload-session-gc"}
+    assert all(thread.is_alive() and thread.daemon for thread in threads)
+
+
+def test_lone_metadata_write_is_committed_without_waiting(app: Flask):
+    """
+    Test that a write with no other write in progress does not wait for the batch window.
+    """
+    writer = app.extensions["metadata_writer"]
+    writer.window = 5
+    started = time.monotonic()
+    with app.app_context():
+        FileRepository.add_file(FileMetadata("c" * 64, "alone.bin", "user1", 1))
+    assert time.monotonic() - started < 1
+    assert writer.batches == 1
+
+
+def test_upload_file_streams_to_store(client: FlaskClient, app: Flask):
+    """
+    Test that an upload is hashed while streaming and moved into the store without leftovers.
+    """
+    content = os.urandom(300 * 1024)
+    file_hash = hashlib.sha256(content).hexdigest()
+
+    data = {"file": (io.BytesIO(content), "random.bin")}
+    response = client.post(
+        "/upload",
+        data=data,
+        content_type="multipart/form-data",
+        auth=("user1", "password1"),
+    )
+    assert response.status_code == 201
+    assert response.json["file_hash"] == file_hash
+
+    with app.app_context():
+        with open(FileSystemService.get_file_path(file_hash), "rb") as f:
+            assert f.read() == content
+
+        response = client.post(
+            "/upload",
+            data={"file": (io.BytesIO(content), "random.bin")},
+            content_type="multipart/form-data",
+            auth=("user1", "password1"),
+        )
+        assert response.json["message"] == "File already exists."
+        assert os.listdir(FileSystemService.get_temp_dir()) == []
+
+        os.remove(FileSystemService.get_file_path(file_hash))
+
+
+def test_download_file_conditional_and_ranges(client: FlaskClient, app: Flask):
+    """
+    Test that downloads honour ETag validators, HEAD requests and single or multiple byte ranges.
+    """
+    content = b"0123456789abcdefghij"
+    file_hash = hashlib.sha256(content).hexdigest()
+    file_record = File(file_hash=file_hash, filename="digits.txt", username="user1")
+
+    with app.app_context():
+        file_path = FileSystemService.get_file_path(file_hash)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(content)
+
+        db.session.add(Blob(file_hash=file_hash, refcount=1))
+        db.session.add(file_record)
+        db.session.commit()
+
+        response = client.get(f"/download/{file_hash}")
+        assert response.status_code == 200
+        assert response.headers["ETag"] == f'"{file_hash}"'
+        assert "immutable" in response.headers["Cache-Control"]
+
+        response = client.head(f"/download/{file_hash}")
+        assert response.status_code == 200
+        assert response.content_length == len(content)
+        assert response.data == b""
+
+        response = client.get(
+            f"/download/{file_hash}", headers={"If-None-Match": f'"{file_hash}"'}
+        )
+        assert response.status_code == 304
+
+        response = client.get(f"/download/{file_hash}", headers={"Range": "bytes=5-9"})
+        assert response.status_code == 206
+        assert response.data == b"56789"
+        assert response.headers["Content-Range"] == f"bytes 5-9/{len(content)}"
+
+        response = client.get(
+            f"/download/{file_hash}",
+            headers={"Range": "bytes=5-9", "If-Range": '"stale"'},
+        )
+        assert response.status_code == 200
+        assert response.data == content
+
+        response = client.get(
+            f"/download/{file_hash}", headers={"Range": "bytes=0-1,-3"}
+        )
+        assert response.status_code == 206
+        assert response.mimetype == "multipart/byteranges"
+        assert response.content_length == len(response.data)
+        assert b"\r\n\r\n01\r\n" in response.data
+        assert b"\r\n\r\nhij\r\n" in response.data
+
+        response = client.get(f"/download/{file_hash}", headers={"Range": "bytes=50-"})
+        assert response.status_code == 416
+
+        os.remove(file_path)
+
+
+def test_download_file_offloaded_to_proxy(app: Flask):
+    """
+    Test that downloads are delegated to the front proxy with X-Accel-Redirect or X-Sendfile.
+    """
+    file_hash = "d2" * 32
+    file_record = File(file_hash=file_hash, filename="testfile.txt", username="user1")
+
+    with app.app_context():
+        file_path = FileSystemService.get_file_path(file_hash)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(b"test content")
+
+        db.session.add(Blob(file_hash=file_hash, refcount=1))
+        db.session.add(file_record)
+        db.session.commit()
+
+    app.config["DOWNLOAD_OFFLOAD"] = "x-accel"
+    response = app.test_client().get(f"/download/{file_hash}")
+    assert response.status_code == 200
+    assert response.data == b""
+    assert response.headers["X-Accel-Redirect"] == f"/protected-store/d2/{file_hash}"
+    assert response.headers["ETag"] == f'"{file_hash}"'
+
+    app.config["DOWNLOAD_OFFLOAD"] = "x-sendfile"
+    response = app.test_client().get(f"/download/{file_hash}")
+    assert response.headers["X-Sendfile"] == os.path.abspath(file_path)
+
+    os.remove(file_path)
+
+
+def test_download_file_uses_metadata_cache(client: FlaskClient, app: Flask):
+    """
+    Test that repeated downloads are served from the metadata cache and that deletes invalidate it.
+    """
+    with app.app_context():
+        if db.engine.dialect.name != "sqlite":
+            stats = client.get("/stats", auth=("user1", "password1")).json
+            assert stats["metadata_cache"] == {"enabled": False}
+            pytest.skip("The metadata cache only follows a database local to the host.")
+    file_hash = "d2" * 32
+    file_record = File(file_hash=file_hash, filename="testfile.txt", username="user1")
+
+    with app.app_context():
+        file_path = FileSystemService.get_file_path(file_hash)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(b"test content")
+
+        db.session.add(Blob(file_hash=file_hash, refcount=1))
+        db.session.add(file_record)
+        db.session.commit()
+
+        assert client.get(f"/download/{file_hash}").status_code == 200
+        assert client.get(f"/download/{file_hash}").status_code == 200
+
+        stats = client.get("/stats", auth=("user1", "password1")).json
+        assert stats["metadata_cache"]["hits"] == 1
+        assert stats["metadata_cache"]["misses"] == 1
+
+        client.delete(f"/delete/{file_hash}", auth=("user1", "password1"))
+        assert client.get(f"/download/{file_hash}").status_code == 404
+
+
+def test_download_file_from_hot_object_cache(client: FlaskClient, app: Flask, config):
+    """
+    Test that small files are served from memory once they have been downloaded.
+    """
+    with app.app_context():
+        if db.engine.dialect.name != "sqlite":
+            # Without the metadata cache, removed content is reported as missing first.
+            pytest.skip("The metadata cache only follows a database local to the host.")
+    app.config.update(HOT_CACHE_MAX_BYTES=1024 * 1024)
+    hot_object_cache.init_app(app)
+
+    content = b"hot content"
+    file_hash = hashlib.sha256(content).hexdigest()
+
+    with app.app_context():
+        file_path = FileSystemService.get_file_path(file_hash)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(content)
+
+        db.session.add(Blob(file_hash=file_hash, size=len(content), refcount=1))
+        db.session.add(File(file_hash=file_hash, filename="hot.txt", username="user1"))
+        db.session.commit()
+
+        assert client.get(f"/download/{file_hash}").data == content
+        os.remove(file_path)
+
+        assert client.get(f"/download/{file_hash}").data == content
+        response = client.get(f"/download/{file_hash}", headers={"Range": "bytes=4-"})
+        assert response.data == b"content"
+
+        stats = client.get("/stats", auth=("user1", "password1")).json
+        assert stats["hot_object_cache"]["hits"] == 2
+
+    hot_object_cache.init_app(create_app(config))
+
+
+def test_download_file_with_missing_content_of_unknown_size(
+    client: FlaskClient, app: Flask, config
+):
+    """
+    Test that a file recorded without a size whose content has gone missing is reported as not found.
+    """
+    app.config.update(HOT_CACHE_MAX_BYTES=1024 * 1024)
+    hot_object_cache.init_app(app)
+
+    content = b"sizeless content"
+    file_hash = hashlib.sha256(content).hexdigest()
+
+    with app.app_context():
+        file_path = FileSystemService.get_file_path(file_hash)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            f.write(content)
+
+        db.session.add(Blob(file_hash=file_hash, refcount=1))
+        db.session.add(File(file_hash=file_hash, filename="old.txt", username="user1"))
+        db.session.commit()
+
+        assert client.get(f"/download/{file_hash}").data == content
+        hot_object_cache.init_app(app)
+        os.remove(file_path)
+
+        response = client.get(f"/download/{file_hash}")
+        assert response.status_code == 404
+        assert response.json == {"error": "File not found."}
+
+    hot_object_cache.init_app(create_app(config))
+
+
+def test_upload_files_batch(client: FlaskClient, app: Flask):
+    """
+    Test that a batch upload stores new files once and reports duplicates per file.
+    """
+    contents = [os.urandom(64), os.urandom(64)]
+    hashes = [hashlib.sha256(content).hexdigest() for content in contents]
+
+    data = {
+        "file": [
+            (io.BytesIO(contents[0]), "first.bin"),
+            (io.BytesIO(contents[1]), "second.bin"),
+            (io.BytesIO(contents[0]), "first-copy.bin"),
+        ]
+    }
+    response = client.post(
+        "/upload/batch",
+        data=data,
+        content_type="multipart/form-data",
+        auth=("user1", "password1"),
+    )
+    assert response.status_code == 201
+    results = response.json["files"]
+    assert [result["file_hash"] for result in results] == [hashes[0], hashes[1], hashes[0]]
+    assert "message" not in results[0]
+    assert results[2]["message"] == "Duplicate of another file in the batch."
+
+    response = client.post(
+        "/upload/batch",
+        data={"file": [(io.BytesIO(contents[1]), "again.bin")]},
+        content_type="multipart/form-data",
+        auth=("user1", "password1"),
+    )
+    assert response.json["files"][0]["message"] == "File already exists."
+
+    with app.app_context():
+        assert File.query.count() == 2
+        for file_hash in hashes:
+            os.remove(FileSystemService.get_file_path(file_hash))
+
+
+def test_find_missing_files(client: FlaskClient, app: Flask):
+    """
+    Test that the existence probe returns only the hashes that are not stored.
+    """
+    stored_hash = "a" * 64
+    missing_hash = "b" * 64
+
+    with app.app_context():
+        db.session.add(Blob(file_hash=stored_hash, refcount=1))
+        db.session.add(File(file_hash=stored_hash, filename="a.txt", username="user1"))
+        db.session.commit()
+
+    response = client.post(
+        "/exists",
+        json={"hashes": [stored_hash, missing_hash, missing_hash]},
+        auth=("user1", "password1"),
+    )
+    assert response.status_code == 200
+    assert response.json["missing"] == [missing_hash]
+
+    response = client.post("/exists", json={"hashes": "nope"}, auth=("user1", "password1"))
+    assert response.status_code == 400
+
+
+def test_list_files_paginates_by_cursor(client: FlaskClient, app: Flask):
+    """
+    Test that a user's files are listed page by page and filtered by filename prefix.
+    """
+    with app.app_context():
+        for index in range(5):
+            file_hash = f"{index:064x}"
+            db.session.add(Blob(file_hash=file_hash, size=index, refcount=1))
+            db.session.add(
+                File(file_hash=file_hash, filename=f"report-{index}.txt", username="user1")
+            )
+        db.session.add(File(file_hash=f"{0:064x}", filename="other.txt", username="user2"))
+        db.session.commit()
+
+    response = client.get("/files?limit=2", auth=("user1", "password1"))
+    assert response.status_code == 200
+    page = response.json
+    assert [item["filename"] for item in page["files"]] == ["report-0.txt", "report-1.txt"]
+
+    filenames = [item["filename"] for item in page["files"]]
+    while page["next_cursor"] is not None:
+        page = client.get(
+            f"/files?limit=2&after={page['next_cursor']}", auth=("user1", "password1")
+        ).json
+        filenames += [item["filename"] for item in page["files"]]
+    assert filenames == [f"report-{index}.txt" for index in range(5)]
+
+    response = client.get("/files?prefix=report-3", auth=("user1", "password1"))
+    assert response.json == {
+        "files": [
+            {"id": 4, "file_hash": f"{3:064x}", "filename": "report-3.txt", "size": 3}
+        ],
+        "next_cursor": None,
+    }
+    assert client.get("/files?limit=0", auth=("user1", "password1")).status_code == 400
+
+
+def test_download_archive(client: FlaskClient):
+    """
+    Test that several files are streamed as ZIP and TAR archives with distinct member names.
+    """
+    contents = [os.urandom(100), os.urandom(70000), b"third"]
+    names = ["report.txt", "report.txt", "notes.md"]
+    hashes = []
+    for content, name in zip(contents, names):
+        response = client.post(
+            "/upload",
+            data={"file": (io.BytesIO(content), name)},
+            content_type="multipart/form-data",
+            auth=("user1", "password1"),
+        )
+        hashes.append(response.json["file_hash"])
+
+    response = client.post("/download/archive", json={"hashes": hashes + hashes[:1]})
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == ["report.txt", "report (1).txt", "notes.md"]
+        assert [archive.read(name) for name in archive.namelist()] == contents
+
+    response = client.post(
+        "/download/archive", json={"hashes": hashes, "format": "tar"}
+    )
+    with tarfile.open(fileobj=io.BytesIO(response.data)) as archive:
+        assert archive.getnames() == ["report.txt", "report (1).txt", "notes.md"]
+        assert [archive.extractfile(member).read() for member in archive] == contents
+
+    missing = "0" * 64
+    response = client.post("/download/archive", json={"hashes": [hashes[0], missing]})
+    assert response.status_code == 404
+    assert response.json["missing"] == [missing]
+
+    response = client.post("/download/archive", json={"hashes": hashes, "format": "rar"})
+    assert response.status_code == 400
+
+
+def test_resumable_upload_session(client: FlaskClient, app: Flask):
+    """
+    Test that an upload sent in parallel chunks resumes from the committed offset and is stored.
+    """
+    content = os.urandom(300000)
+    auth = ("user1", "password1")
+    response = client.post(
+        "/upload/sessions", json={"filename": "big.bin", "size": len(content)}, auth=auth
+    )
+    assert response.status_code == 201
+    session_url = response.headers["Location"]
+
+    def send(offset: int, chunk: bytes):
+        return client.patch(
+            session_url, data=chunk, headers={"Upload-Offset": str(offset)}, auth=auth
+        )
+
+    with ThreadPoolExecutor(2) as executor:
+        list(executor.map(send, [200000, 0], [content[200000:], content[:100000]]))
+    response = client.head(session_url, auth=auth)
+    assert response.headers["Upload-Offset"] == "100000"
+    assert client.get(session_url, auth=("user2", "password2")).status_code == 404
+
+    assert send(50000, content[50000:]).status_code == 409
+    response = client.post(f"{session_url}/complete", auth=auth)
+    assert response.status_code == 409
+    assert response.json["offset"] == 100000
+
+    assert send(100000, content[100000:250000]).json["offset"] == len(content)
+    response = client.post(
+        f"{session_url}/complete",
+        json={"sha256": hashlib.sha256(content).hexdigest()},
+        auth=auth,
+    )
+    assert response.status_code == 201
+    assert response.json["file_hash"] == hashlib.sha256(content).hexdigest()
+    assert client.get(f"/download/{response.json['file_hash']}").data == content
+    assert client.head(session_url, auth=auth).status_code == 404
+
+
+def test_upload_session_checksum_mismatch_and_expiry(client: FlaskClient, app: Flask):
+    """
+    Test that a mismatching checksum rejects an upload and that expired sessions are removed.
+    """
+    auth = ("user1", "password1")
+    for _ in range(2):
+        response = client.post(
+            "/upload/sessions", json={"filename": "f.txt", "size": 4}, auth=auth
+        )
+        client.patch(
+            response.headers["Location"],
+            data=b"data",
+            headers={"Upload-Offset": "0"},
+            auth=auth,
+        )
+    response = client.post(
+        f"{response.headers['Location']}/complete", json={"sha256": "0" * 64}, auth=auth
+    )
+    assert response.status_code == 400
+
+    app.config["UPLOAD_SESSION_TTL"] = -1
+    with app.app_context():
+        from app.services.upload_session_service import UploadSessionService
+
+        assert UploadSessionService.collect_expired() == 1
+        assert os.listdir(os.path.join(app.config["STORAGE_FOLDER"], ".uploads")) == []
+
+
+def test_upload_session_size_is_limited(client: FlaskClient, app: Flask):
+    """
+    Test that a session declaring more than `UPLOAD_SESSION_MAX_SIZE` bytes is rejected.
+    """
+    app.config["UPLOAD_SESSION_MAX_SIZE"] = 1000
+    auth = ("user1", "password1")
+
+    response = client.post(
+        "/upload/sessions", json={"filename": "f.txt", "size": 1001}, auth=auth
+    )
+    assert response.status_code == 413
+    assert not os.path.exists(os.path.join(app.config["STORAGE_FOLDER"], ".uploads"))
+
+    response = client.post(
+        "/upload/sessions", json={"filename": "f.txt", "size": 1000}, auth=auth
+    )
+    assert response.status_code == 201
+
+
+def test_upload_session_overlapping_chunks_hash_final_content(
+    client: FlaskClient, app: Flask
+):
+    """
+    Test that a chunk committed while a slower one overwrites it is not hashed before it ends.
+    """
+    from app.services.upload_session_service import UploadSessionService
+
+    auth = ("user1", "password1")
+    response = client.post(
+        "/upload/sessions", json={"filename": "f.bin", "size": 10}, auth=auth
+    )
+    upload_id = response.json["upload_id"]
+
+    class SlowChunk:
+        def __init__(self):
+            self.sent = False
+
+        def read(self, size: int) -> bytes:
+            if self.sent:
+                return b""
+            self.sent = True
+            UploadSessionService.write_chunk(upload_id, "user1", 0, io.BytesIO(b"A" * 10))
+            return b"B" * 10
+
+    with app.app_context():
+        UploadSessionService.write_chunk(upload_id, "user1", 0, SlowChunk())
+        result = UploadSessionService.complete(upload_id, "user1")
+    assert result["file_hash"] == hashlib.sha256(b"B" * 10).hexdigest()
+    assert client.get(f"/download/{result['file_hash']}").data == b"B" * 10
@@ -0,0 +1,182 @@
+import hashlib
+import io
+import os
+
+import pytest
+from flask import Flask
+
+from app import create_app, db
+from app.storage import ChunkedStorage, S3Storage
+from tests.test_storage import read_bytes, store_bytes
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+
+BUCKET = "files"
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def test_s3_storage_round_trip(tmp_path, bucket):
+    """
+    Test that blobs are stored as objects under the prefix and read back with ranged GETs.
+    """
+    storage = S3Storage(str(tmp_path), BUCKET, "node/")
+    content = os.urandom(1000)
+    file_hash = store_bytes(storage, content)
+
+    assert bucket.head_object(Bucket=BUCKET, Key=f"node/{file_hash}")
+    assert storage.exists(file_hash)
+    assert storage.size(file_hash) == 1000
+    assert storage.local_path(file_hash) is None
+    assert read_bytes(storage, file_hash, 0, 1000) == content
+    assert read_bytes(storage, file_hash, 100, 333) == content[100:333]
+    assert read_bytes(storage, file_hash, 5, 5) == b""
+    assert list(storage.iter_hashes()) == [file_hash]
+
+    storage.delete(file_hash)
+    assert not storage.exists(file_hash)
+    assert storage.size(file_hash) is None
+    with pytest.raises(FileNotFoundError):
+        read_bytes(storage, file_hash, 0, 10)
+
+
+def test_s3_storage_uploads_large_blobs_in_parts(tmp_path, bucket):
+    """
+    Test that blobs above the multipart threshold are uploaded in parts.
+    """
+    part_size = 5 * 1024 * 1024
+    storage = S3Storage(
+        str(tmp_path),
+        BUCKET,
+        multipart_threshold=part_size,
+        multipart_chunk_size=part_size,
+    )
+    content = os.urandom(2 * part_size + 10)
+    file_hash = store_bytes(storage, content)
+
+    response = bucket.head_object(Bucket=BUCKET, Key=file_hash)
+    assert response["ETag"].strip('"').endswith("-3")
+    assert read_bytes(storage, file_hash, part_size - 5, part_size + 5) == (
+        content[part_size - 5 : part_size + 5]
+    )
+
+
+def test_s3_storage_read_through_cache(tmp_path, bucket):
+    """
+    Test that small blobs are cached on first read and the least recently read are evicted.
+    """
+    storage = S3Storage(
+        str(tmp_path), BUCKET, cache_max_bytes=2500, cache_max_object_size=1000
+    )
+    contents = [os.urandom(1000) for _ in range(3)]
+    hashes = [store_bytes(storage, content) for content in contents]
+    large_hash = store_bytes(storage, os.urandom(2000))
+
+    assert read_bytes(storage, hashes[0], 0, 1000) == contents[0]
+    assert os.path.isfile(storage.get_file_path(hashes[0]))
+    assert storage.local_path(hashes[0]) is None
+    assert read_bytes(storage, hashes[0], 10, 20) == contents[0][10:20]
+    assert storage.stats()["cache_hits"] == 1
+    assert storage.stats()["gets"] == 1
+
+    read_bytes(storage, large_hash, 0, 2000)
+    assert not os.path.exists(storage.get_file_path(large_hash))
+
+    os.utime(storage.get_file_path(hashes[0]), (0, 0))
+    read_bytes(storage, hashes[1], 0, 1000)
+    read_bytes(storage, hashes[2], 0, 1000)
+    assert not os.path.exists(storage.get_file_path(hashes[0]))
+    assert os.path.isfile(storage.get_file_path(hashes[2]))
+    assert storage.stats()["cache_evictions"] == 1
+    assert storage.stats()["cache_bytes"] <= 2500
+
+    storage.delete(hashes[2])
+    assert not os.path.exists(storage.get_file_path(hashes[2]))
+
+
+def test_s3_storage_reads_survive_eviction_by_other_workers(tmp_path, bucket):
+    """
+    Test that a cached copy evicted while it is read, or before it is opened, is still served.
+    """
+    storage = S3Storage(
+        str(tmp_path), BUCKET, cache_max_bytes=2500, cache_max_object_size=1000
+    )
+    content = os.urandom(1000)
+    file_hash = store_bytes(storage, content)
+    read_bytes(storage, file_hash, 0, 1000)
+
+    chunks = storage.read_range(file_hash, 0, 1000, 100)
+    first = next(chunks)
+    os.remove(storage.get_file_path(file_hash))
+    assert first + b"".join(chunks) == content
+
+    assert read_bytes(storage, file_hash, 0, 1000) == content
+    assert storage.stats()["cache_misses"] == 2
+
+
+def test_s3_storage_requires_a_bucket(tmp_path):
+    """
+    Test that the backend refuses to start without a bucket.
+    """
+    with pytest.raises(ValueError):
+        S3Storage(str(tmp_path), "")
+
+
+@pytest.fixture
+def s3_app(config, bucket):
+    class S3Config(config):
+        STORAGE_BACKEND = "s3"
+        STORAGE_CHUNKING = True
+        S3_BUCKET = BUCKET
+        S3_PREFIX = "blobs/"
+        S3_CACHE_MAX_BYTES = 1024 * 1024
+
+    app = create_app(S3Config)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+def test_upload_and_download_with_s3_backend(s3_app: Flask, bucket):
+    """
+    Test that uploads land in the bucket, chunks under their own prefix, and ranges are served.
+    """
+    storage = s3_app.extensions["storage"]
+    assert isinstance(storage, ChunkedStorage)
+    client = s3_app.test_client()
+    content = os.urandom(300 * 1024)
+    file_hash = hashlib.sha256(content).hexdigest()
+
+    response = client.post(
+        "/upload",
+        data={"file": (io.BytesIO(content), "remote.bin")},
+        content_type="multipart/form-data",
+        auth=("user1", "password1"),
+    )
+    assert response.status_code == 201
+    keys = [
+        item["Key"]
+        for item in bucket.list_objects_v2(Bucket=BUCKET)["Contents"]
+    ]
+    assert keys and all(key.startswith("blobs/chunks/") for key in keys)
+
+    response = client.get(f"/download/{file_hash}")
+    assert response.data == content
+
+    response = client.get(
+        f"/download/{file_hash}", headers={"Range": "bytes=1000-1999"}
+    )
+    assert response.status_code == 206
+    assert response.data == content[1000:2000]
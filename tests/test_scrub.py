@@ -0,0 +1,114 @@
+import hashlib
+import io
+import json
+import os
+
+import pytest
+from flask import Flask
+
+from app import create_app, db
+from app.services.filesystem_service import FileSystemService
+from app.services.scrub_service import ScrubService
+
+
+@pytest.fixture
+def app(config):
+    class ScrubConfig(config):
+        COMPRESSION = "gzip"
+
+    app = create_app(ScrubConfig)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+def upload(app: Flask, content: bytes) -> str:
+    response = app.test_client().post(
+        "/upload",
+        data={"file": (io.BytesIO(content), "file.bin")},
+        content_type="multipart/form-data",
+        auth=("user1", "password1"),
+    )
+    assert response.status_code == 201
+    return response.json["file_hash"]
+
+
+def damage_store(app: Flask) -> dict[str, str]:
+    """
+    Uploads intact, corrupt and missing blobs and adds orphaned content to the store.
+    """
+    upload(app, os.urandom(500))
+    upload(app, b"compressible line\n" * 200)
+    corrupt = upload(app, os.urandom(300))
+    missing = upload(app, os.urandom(200))
+    orphan = hashlib.sha256(b"orphan").hexdigest()
+    with app.app_context():
+        with open(FileSystemService.get_file_path(corrupt), "r+b") as f:
+            f.write(b"bit rot")
+        os.remove(FileSystemService.get_file_path(missing))
+        orphan_path = FileSystemService.get_file_path(orphan)
+        os.makedirs(os.path.dirname(orphan_path), exist_ok=True)
+        with open(orphan_path, "wb") as f:
+            f.write(b"orphan")
+    return {"corrupt": corrupt, "missing": missing, "orphan": orphan}
+
+
+def test_scrub_reports_and_repairs_problems(app: Flask):
+    """
+    Test that a parallel scrub finds missing, corrupt and orphaned blobs and repairs what it can.
+    """
+    problems = damage_store(app)
+    found = []
+
+    with app.app_context():
+        counts = ScrubService.scrub(
+            workers=2, report=lambda status, file_hash: found.append((status, file_hash))
+        )
+        assert sorted(found) == sorted(problems.items())
+        assert counts["checked"] == 4
+        assert counts["repaired"] == 0
+
+        counts = ScrubService.scrub(workers=1, repair=True, report=lambda *_: None)
+        assert counts["repaired"] == 2
+        quarantine = os.path.join(app.config["STORAGE_FOLDER"], ".quarantine")
+        assert os.listdir(quarantine) == [problems["corrupt"]]
+
+        found.clear()
+        ScrubService.scrub(
+            workers=1, report=lambda status, file_hash: found.append((status, file_hash))
+        )
+        assert sorted(found) == sorted(
+            [("missing", problems["corrupt"]), ("missing", problems["missing"])]
+        )
+
+
+def test_scrub_resumes_from_checkpoint(app: Flask):
+    """
+    Test that an interrupted scrub resumes after the last checkpointed batch.
+    """
+    problems = damage_store(app)
+    first, second = sorted([problems["corrupt"], problems["missing"]])
+    checkpoint_path = os.path.join(app.config["STORAGE_FOLDER"], ".meta", "scrub.json")
+
+    def interrupt(status: str, file_hash: str) -> None:
+        if file_hash == second:
+            raise KeyboardInterrupt
+
+    with app.app_context():
+        with pytest.raises(KeyboardInterrupt):
+            ScrubService.scrub(workers=1, batch_size=1, report=interrupt)
+        with open(checkpoint_path) as f:
+            assert first <= json.load(f)["after"] < second
+
+        found = []
+        counts = ScrubService.scrub(
+            workers=1,
+            batch_size=1,
+            report=lambda status, file_hash: found.append(file_hash),
+        )
+        assert sorted(found) == sorted([second, problems["orphan"]])
+        assert counts["checked"] == 4
+        assert counts["missing"] == counts["corrupt"] == counts["orphan"] == 1
+        assert not os.path.exists(checkpoint_path)
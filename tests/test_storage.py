@@ -0,0 +1,289 @@
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import Flask
+
+from app import create_app, db
+from app.storage import (
+    ChunkedStorage,
+    Durability,
+    HashLocks,
+    LocalStorage,
+    PackStorage,
+    StorageBackend,
+)
+
+
+def store_bytes(storage: StorageBackend, content: bytes) -> str:
+    file_hash = hashlib.sha256(content).hexdigest()
+    source_path = os.path.join(storage.root, f"source-{file_hash}")
+    with open(source_path, "wb") as f:
+        f.write(content)
+    storage.store(source_path, file_hash, len(content))
+    assert not os.path.exists(source_path)
+    return file_hash
+
+
+def read_bytes(
+    storage: StorageBackend, file_hash: str, start: int, stop: int
+) -> bytes:
+    return b"".join(storage.read_range(file_hash, start, stop, 7))
+
+
+def test_pack_storage_round_trip(tmp_path):
+    """
+    Test that small blobs are packed, large blobs stay standalone, and ranges are readable.
+    """
+    storage = PackStorage(str(tmp_path), 100, 1000, 0.5)
+    small = os.urandom(50)
+    large = os.urandom(500)
+    small_hash = store_bytes(storage, small)
+    large_hash = store_bytes(storage, large)
+
+    assert storage.exists(small_hash) and storage.exists(large_hash)
+    assert storage.size(small_hash) == 50
+    assert storage.local_path(small_hash) is None
+    assert storage.local_path(large_hash) == storage.get_file_path(large_hash)
+    assert read_bytes(storage, small_hash, 0, 50) == small
+    assert read_bytes(storage, small_hash, 10, 33) == small[10:33]
+    assert read_bytes(storage, large_hash, 100, 400) == large[100:400]
+    assert storage.stats()["objects"] == 1
+
+    reader = PackStorage(str(tmp_path), 100, 1000, 0.5)
+    assert read_bytes(reader, small_hash, 0, 50) == small
+
+    storage.delete(small_hash)
+    storage.delete(large_hash)
+    assert not storage.exists(small_hash) and not storage.exists(large_hash)
+
+
+def test_pack_storage_compaction(tmp_path):
+    """
+    Test that compaction rewrites sealed packs with little live data and keeps live blobs readable.
+    """
+    storage = PackStorage(str(tmp_path), 100, 200, 0.6)
+    contents = [os.urandom(90) for _ in range(6)]
+    hashes = [store_bytes(storage, content) for content in contents]
+    assert storage.stats()["packs"] == 3
+
+    assert storage.compact() == 0
+    deleted = {hashes[0], hashes[2], hashes[3]}
+    for file_hash in deleted:
+        storage.delete(file_hash)
+    assert storage.compact() == 2
+
+    for file_hash, content in zip(hashes, contents):
+        assert storage.exists(file_hash) == (file_hash not in deleted)
+        if file_hash not in deleted:
+            assert read_bytes(storage, file_hash, 0, 90) == content
+    stats = storage.stats()
+    assert stats["objects"] == 3
+    assert stats["live_bytes"] == 270
+    assert stats["packs"] == 2
+
+
+@pytest.fixture
+def pack_app(config):
+    class PackConfig(config):
+        STORAGE_BACKEND = "pack"
+        PACK_COMPACT_INTERVAL = 0
+
+    app = create_app(PackConfig)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+def test_upload_and_download_with_pack_backend(pack_app: Flask):
+    """
+    Test that files uploaded to the pack backend are downloaded with ranges and offload is skipped.
+    """
+    pack_app.config["DOWNLOAD_OFFLOAD"] = "x-accel"
+    client = pack_app.test_client()
+    content = os.urandom(1000)
+    file_hash = hashlib.sha256(content).hexdigest()
+
+    response = client.post(
+        "/upload",
+        data={"file": (io.BytesIO(content), "packed.bin")},
+        content_type="multipart/form-data",
+        auth=("user1", "password1"),
+    )
+    assert response.status_code == 201
+    storage_folder = pack_app.config["STORAGE_FOLDER"]
+    assert not os.path.exists(os.path.join(storage_folder, file_hash[:2]))
+
+    response = client.get(f"/download/{file_hash}")
+    assert response.data == content
+    assert "X-Accel-Redirect" not in response.headers
+
+    response = client.get(f"/download/{file_hash}", headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.data == content[100:200]
+
+
+def test_reshard_with_fallback_reads(tmp_path):
+    """
+    Test that blobs stay readable through the fallback layout and are moved by a reshard.
+    """
+    old = LocalStorage(str(tmp_path))
+    contents = [os.urandom(20) for _ in range(10)]
+    hashes = [store_bytes(old, content) for content in contents]
+
+    storage = LocalStorage(str(tmp_path), (2, 2), (1, 2))
+    for file_hash, content in zip(hashes, contents):
+        assert storage.exists(file_hash)
+        assert storage.local_path(file_hash) == old.get_file_path(file_hash)
+        assert read_bytes(storage, file_hash, 0, 20) == content
+
+    assert storage.reshard((1, 2), workers=4) == 10
+    assert storage.reshard((1, 2), workers=4) == 0
+    for file_hash, content in zip(hashes, contents):
+        file_path = storage.get_file_path(file_hash)
+        assert file_path == os.path.join(
+            str(tmp_path), file_hash[:2], file_hash[2:4], file_hash
+        )
+        assert storage.local_path(file_hash) == file_path
+        assert storage.size(file_hash) == 20
+        assert read_bytes(storage, file_hash, 0, 20) == content
+
+    storage.delete(hashes[0])
+    assert not storage.exists(hashes[0])
+
+
+def test_chunked_storage_deduplicates_similar_blobs(tmp_path):
+    """
+    Test that near-identical blobs share chunks, are reassembled, and release their chunks.
+    """
+    root = str(tmp_path)
+    legacy = LocalStorage(root)
+    legacy_hash = store_bytes(legacy, b"stored before chunking")
+    storage = ChunkedStorage(
+        root, LocalStorage(os.path.join(root, "chunks")), legacy, 1024, 4096, 16384
+    )
+
+    original = os.urandom(200_000)
+    edited = original[:100_000] + b"inserted bytes" + original[100_000:]
+    original_hash = store_bytes(storage, original)
+    edited_hash = store_bytes(storage, edited)
+
+    stats = storage.stats()
+    assert stats["files"] == 2
+    assert stats["file_bytes"] == len(original) + len(edited)
+    assert stats["chunk_bytes"] < len(original) * 1.2
+
+    assert storage.size(edited_hash) == len(edited)
+    assert storage.local_path(edited_hash) is None
+    assert read_bytes(storage, edited_hash, 0, len(edited)) == edited
+    assert read_bytes(storage, edited_hash, 99_000, 150_000) == edited[99_000:150_000]
+    assert read_bytes(storage, legacy_hash, 0, 22) == b"stored before chunking"
+
+    storage.delete(original_hash)
+    assert not storage.exists(original_hash)
+    assert read_bytes(storage, edited_hash, 0, len(edited)) == edited
+
+    storage.delete(edited_hash)
+    assert storage.stats()["chunks"] == 0
+    assert storage.exists(legacy_hash)
+
+
+def test_chunked_storage_collects_orphaned_chunks(tmp_path):
+    """
+    Test that storing an indexed blob again writes no chunks and that orphaned chunks are removed.
+    """
+    root = str(tmp_path)
+    chunks = LocalStorage(os.path.join(root, "chunks"))
+    storage = ChunkedStorage(root, chunks, LocalStorage(root), 1024, 4096, 16384)
+    content = os.urandom(50_000)
+    file_hash = store_bytes(storage, content)
+    stored = set(chunks.iter_hashes())
+
+    assert store_bytes(storage, content) == file_hash
+    assert set(chunks.iter_hashes()) == stored
+
+    orphan_hash = store_bytes(chunks, b"chunk of an interrupted store")
+    assert storage.collect_orphans() == 1
+    assert not chunks.exists(orphan_hash)
+    assert set(chunks.iter_hashes()) == stored
+    assert read_bytes(storage, file_hash, 0, len(content)) == content
+
+
+def test_group_durability_batches_concurrent_syncs(tmp_path):
+    """
+    Test that concurrent stores in group mode share their flushes.
+    """
+    durability = Durability("group", window=0.05)
+    storage = LocalStorage(str(tmp_path), durability=durability)
+    contents = [os.urandom(10) for _ in range(8)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        hashes = list(executor.map(lambda data: store_bytes(storage, data), contents))
+
+    for file_hash, content in zip(hashes, contents):
+        assert read_bytes(storage, file_hash, 0, 10) == content
+    assert durability.batches < 2 * len(contents)
+
+
+def test_durability_rejects_unknown_mode():
+    """
+    Test that an unknown durability mode is refused.
+    """
+    with pytest.raises(ValueError):
+        Durability("sometimes")
+
+
+def test_hash_locks_exclude_concurrent_holders(tmp_path):
+    """
+    Test that threads holding the lock of the same hash run one at a time.
+    """
+    locks = HashLocks(str(tmp_path))
+    file_hash = hashlib.sha256(b"content").hexdigest()
+    active = []
+    overlaps = []
+
+    def hold(_) -> None:
+        with locks.hold([file_hash, file_hash[:3] + "0" * 61]):
+            active.append(1)
+            overlaps.append(len(active))
+            time.sleep(0.01)
+            active.pop()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(hold, range(8)))
+
+    assert overlaps == [1] * 8
+
+
+def test_hash_locks_exclude_other_nodes_on_postgresql(tmp_path, config):
+    """
+    Test that hash locks of nodes with separate lock folders exclude each other on PostgreSQL.
+    """
+    app = create_app(config)
+    with app.app_context():
+        if db.engine.dialect.name != "postgresql":
+            pytest.skip("Advisory locks require PostgreSQL.")
+        nodes = [
+            HashLocks(str(tmp_path / "a"), db.engine),
+            HashLocks(str(tmp_path / "b"), db.engine),
+        ]
+    file_hash = hashlib.sha256(b"content").hexdigest()
+    active = []
+    overlaps = []
+
+    def hold(index: int) -> None:
+        with nodes[index % 2].hold([file_hash]):
+            active.append(1)
+            overlaps.append(len(active))
+            time.sleep(0.01)
+            active.pop()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(hold, range(8)))
+
+    assert overlaps == [1] * 8